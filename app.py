@@ -14,8 +14,29 @@ import gc
 import json
 import argparse
 from pathlib import Path
-from typing import List, Tuple, Optional
+from contextlib import contextmanager
+from itertools import chain
+from typing import Iterable, Iterator, List, Tuple, Optional
+import threading
 from config import Config
+from pipeline import PrefetchPipeline
+from prompt_cache import PromptPrefixCache, reset_rope_deltas
+from parallel import DataParallelScheduler, visible_gpu_ids
+from stub_model import StubCaptioner
+from shard import LeaseManager, in_shard, parse_shard
+from caption_cache import CaptionCache, hash_context, hash_file
+from caption_writer import CaptionWriter, atomic_write_text
+from scan import iter_image_files
+from bucketing import bucket_batches, fixed_batches
+from memory_governor import MemoryGovernor, is_oom_error
+from metrics import metrics, peak_rss_bytes, serve_metrics
+from vision_cache import VisionCache
+from decoding import CaptionStoppingCriteria, FirstTokenTimer, soft_char_limit
+from cpu_backend import CPU_DTYPES, compile_forward, configure_threads, cpu_worker_devices, quantize_int8
+from quality import REASON_LABELS, CaptionValidator, GeneratedCaption, TruncatedCaption
+from journal import RunJournal, exhausted_files, load_history, run_header
+from model_manifest import ModelManifest, file_signature
+from model_snapshot import ModelSnapshot, snapshot_variant
 
 
 # ============ 核心修复: 猴子补丁注入HfFolder + is_offline_mode ============
@@ -107,72 +128,134 @@ def _inject_hf_compatibility():
         return False
 
 
-_inject_hf_compatibility()
 # ==============================================================================
 
-# 设置环境变量
+# 设置环境变量 (须在导入torch/transformers之前)
 os.environ["HF_HUB_ENABLE_HF_TRANSFER"] = "1"
 os.environ["HF_HUB_DOWNLOAD_TIMEOUT"] = "300"
 os.environ["TRANSFORMERS_NO_ADVISORY_WARNINGS"] = "1"
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 os.environ["PYTORCH_CUDA_ALLOC_CONF"] = "max_split_size_mb:128"
 
-# 修复NumPy 2.x兼容性
-try:
-    import numpy as np
+from PIL import Image
 
-    if np.__version__.startswith("2"):
-        print(f"⚠️  检测到NumPy {np.__version__}，Qwen3-VL要求NumPy<2.0", file=sys.stderr)
-        try:
-            import subprocess
-
-            subprocess.check_call([sys.executable, "-m", "pip", "install", "numpy<2.0", "--quiet"])
-            print("✅ NumPy已降级，重启脚本生效", file=sys.stderr)
-            sys.exit(0)
-        except Exception as e:
-            print(f"❌ 自动降级失败: {e}", file=sys.stderr)
-            print("💡 请手动运行: pip install 'numpy<2.0' --upgrade", file=sys.stderr)
-            sys.exit(1)
-except ImportError:
-    pass
-
-# 导入torch
-try:
-    import torch
-except ImportError as e:
-    print(f"❌ 无法导入torch: {str(e)}", file=sys.stderr)
-    print("💡 请先安装PyTorch 2.4.1", file=sys.stderr)
-    sys.exit(1)
+# 重量级依赖按需导入: torch/transformers在真正需要打标时由_import_model_deps导入，gradio只在启动UI时导入
+torch = None
+Qwen3VLProcessor = None
+Qwen3VLForConditionalGeneration = None
+BitsAndBytesConfig = None
 
 # 全局变量
-device = "cuda" if torch.cuda.is_available() else "cpu"
+device = None
 model = None
 processor = None
 model_path = "./qwen3_vl_models"
 global_use_4bit = False
-
-# 导入其他依赖
-try:
-    from PIL import Image
-    import gradio as gr
-    from transformers import (
-        Qwen3VLProcessor,
-        Qwen3VLForConditionalGeneration,
-        BitsAndBytesConfig
-    )
-    from tqdm import tqdm
-    import psutil
-    import platform
-except ImportError as e:
-    print(f"❌ 依赖导入失败: {str(e)}", file=sys.stderr)
-    print("\n💡 解决方案:", file=sys.stderr)
-    print("1. 确保已源码安装transformers (含Qwen3-VL支持)", file=sys.stderr)
-    print("2. 验证安装: python -c 'from transformers import Qwen3VLProcessor; print(\"OK\")'", file=sys.stderr)
-    print("3. 确保app.py开头包含猴子补丁注入代码", file=sys.stderr)
-    sys.exit(1)
+global_use_prompt_cache = False
+global_verify_full = False
+global_use_snapshot = False
+global_max_vision_tokens = 0
+prompt_cache = None
+caption_cache = None
+caption_writer = None
+memory_governor = MemoryGovernor()
+global_caption_cache_path = Config.get_caption_cache_path()
+vision_cache = None
+draft_model = None
+global_draft_model_path = None
+global_early_stop = True
+global_stop_at_newline = False
+global_skip_verify = False
+caption_validator = CaptionValidator()
+global_quality_retries = 2
+global_ban_subjective = False
+global_cpu_dtype = "float32"
+global_cpu_threads = 0
+global_cpu_interop_threads = 0
+global_compile = False
+global_vision_cache_dir = None
+global_vision_cache_gb = 20.0
+_processor_lock = threading.Lock()
+_cancel_event = threading.Event()
 
 # ============ 核心修复: 强化中文特化Prompt (100%中文输出) ============
-CAPTION_PROMPT = Config.get_caption_prompt()
+CAPTION_PROMPT = None
+
+
+def _check_numpy():
+    """修复NumPy 2.x兼容性"""
+    try:
+        import numpy as np
+
+        if np.__version__.startswith("2"):
+            print(f"⚠️  检测到NumPy {np.__version__}，Qwen3-VL要求NumPy<2.0", file=sys.stderr)
+            try:
+                import subprocess
+
+                subprocess.check_call([sys.executable, "-m", "pip", "install", "numpy<2.0", "--quiet"])
+                print("✅ NumPy已降级，重启脚本生效", file=sys.stderr)
+                sys.exit(0)
+            except Exception as e:
+                print(f"❌ 自动降级失败: {e}", file=sys.stderr)
+                print("💡 请手动运行: pip install 'numpy<2.0' --upgrade", file=sys.stderr)
+                sys.exit(1)
+    except ImportError:
+        pass
+
+
+def _import_torch():
+    """按需导入torch并确定运行设备 (已强制CPU时保持不变)"""
+    global torch, device
+
+    if torch is None:
+        _check_numpy()
+        try:
+            import torch
+        except ImportError as e:
+            print(f"❌ 无法导入torch: {str(e)}", file=sys.stderr)
+            print("💡 请先安装PyTorch 2.4.1", file=sys.stderr)
+            sys.exit(1)
+
+    if device is None:
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    return torch
+
+
+def _import_model_deps():
+    """按需导入torch + transformers (导入前注入huggingface_hub兼容层)"""
+    global Qwen3VLProcessor, Qwen3VLForConditionalGeneration, BitsAndBytesConfig
+
+    _import_torch()
+    if Qwen3VLProcessor is not None:
+        return
+
+    _inject_hf_compatibility()
+    try:
+        from transformers import (
+            Qwen3VLProcessor,
+            Qwen3VLForConditionalGeneration,
+            BitsAndBytesConfig
+        )
+    except ImportError as e:
+        print(f"❌ 依赖导入失败: {str(e)}", file=sys.stderr)
+        print("\n💡 解决方案:", file=sys.stderr)
+        print("1. 确保已源码安装transformers (含Qwen3-VL支持)", file=sys.stderr)
+        print("2. 验证安装: python -c 'from transformers import Qwen3VLProcessor; print(\"OK\")'", file=sys.stderr)
+        print("3. 确保app.py开头包含猴子补丁注入代码", file=sys.stderr)
+        sys.exit(1)
+
+
+def _caption_prompt() -> str:
+    """当前系统提示词 (首次使用时读取)"""
+    global CAPTION_PROMPT
+    if CAPTION_PROMPT is None:
+        CAPTION_PROMPT = Config.get_caption_prompt()
+    return CAPTION_PROMPT
+
+
+# 支持的图片格式
+SUPPORTED_FORMATS = {'.jpg', '.jpeg', '.png', '.bmp', '.webp', '.tiff'}
+DEDUP_MODES = ("share", "flag")
 
 # 中文主观词过滤（增强版）
 SUBJECTIVE_WORDS = [
@@ -185,6 +268,9 @@ SUBJECTIVE_WORDS = [
 
 def check_system_resources():
     """检查系统资源是否满足Qwen3-VL-8B要求"""
+    import psutil
+
+    _import_torch()
     print("🔍 系统资源检查 (Qwen3-VL-8B要求)...")
 
     disk = psutil.disk_usage(os.path.abspath("."))
@@ -219,8 +305,12 @@ def check_system_resources():
     }
 
 
-def smart_verify_qwen3_model(model_path: str):
-    """智能验证Qwen3-VL模型文件完整性 (无special_tokens_map.json依赖)"""
+def smart_verify_qwen3_model(model_path: str, full: bool = False):
+    """智能验证Qwen3-VL模型文件完整性 (无special_tokens_map.json依赖)
+
+    验证通过后写入校验清单；之后文件大小/mtime均未变化时只做stat检查，跳过tokenizer加载。
+    full=True 时忽略清单强制深度验证，计算权重文件内容hash并与上次深度验证的记录比较，不一致时验证失败。
+    """
     model_dir = Path(model_path)
 
     if not model_dir.exists() or not model_dir.is_dir():
@@ -246,7 +336,15 @@ def smart_verify_qwen3_model(model_path: str):
             return False, "检测到索引文件，但权重文件未完全下载"
         return False, "未找到模型权重文件 (需要model-0000X-of-00004.safetensors)"
 
-    total_size = sum(f.stat().st_size for f in weight_files)
+    manifest = ModelManifest(Config.get_model_manifest_path())
+    signature = file_signature(model_dir, [model_dir / f for f in required_files] + sorted(weight_files))
+    total_size = sum(size for size, _ in signature.values())
+    if not full:
+        entry = manifest.lookup(model_dir, signature)
+        if entry:
+            return True, (f"✅ Qwen3-VL模型文件未变化，沿用校验清单 "
+                          f"({len(weight_files)}分片, {total_size / 1e9:.1f}GB, 词表 {entry['vocab_size']})")
+
     if total_size < 12e9:
         return False, f"模型文件总大小过小 ({total_size / 1e9:.2f}GB)，可能下载不完整"
 
@@ -259,7 +357,25 @@ def smart_verify_qwen3_model(model_path: str):
     except Exception as e:
         return False, f"Tokenizer验证失败: {str(e)}"
 
-    return True, f"✅ Qwen3-VL模型验证成功! (4分片, {total_size / 1e9:.1f}GB)"
+    hashes, hash_note = None, ""
+    if full:
+        print("🔍 计算权重文件hash...")
+        try:
+            hashes = manifest.hash_weights(model_dir, sorted(weight_files))
+        except OSError as e:
+            return False, f"权重文件读取失败: {str(e)}"
+        mismatched = manifest.mismatched_hashes(model_dir, hashes)
+        if mismatched:
+            return False, (f"权重文件内容与上次深度验证记录的hash不一致 (可能已损坏): {mismatched}；"
+                           f"如已主动更新模型，请删除 {Config.get_model_manifest_path()} 后重新验证")
+        hash_note = ", 权重hash与记录一致" if manifest.recorded_hashes(model_dir) else ", 已记录权重hash作为基准"
+
+    try:
+        manifest.record(model_dir, signature, vocab_size, hashes=hashes)
+    except Exception as e:
+        print(f"⚠️  校验清单写入失败: {str(e)}")
+
+    return True, f"✅ Qwen3-VL模型验证成功! (4分片, {total_size / 1e9:.1f}GB{hash_note})"
 
 
 def load_qwen3_model(use_4bit: bool = False, use_cpu: bool = False):
@@ -270,12 +386,17 @@ def load_qwen3_model(use_4bit: bool = False, use_cpu: bool = False):
 
     if use_cpu:
         device = "cpu"
-        print("⚠️  强制使用CPU模式 (无GPU加速)")
+        print(f"⚠️  强制使用CPU模式 (无GPU加速，权重 {global_cpu_dtype})")
 
     if model is not None and processor is not None:
         print("✅ 模型已在内存中，跳过加载")
         return model, processor
 
+    _import_model_deps()
+    if device == "cpu":
+        print(f"🧵 CPU线程: {configure_threads(global_cpu_threads, global_cpu_interop_threads)}")
+    check_system_resources()
+
     print(f"🚀 正在加载Qwen3-VL-8B-Instruct模型 (设备: {device.upper()})...")
     print(f"   模型路径: {os.path.abspath(model_path)}")
 
@@ -285,7 +406,10 @@ def load_qwen3_model(use_4bit: bool = False, use_cpu: bool = False):
         raise FileNotFoundError(f"模型目录 {model_path} 不存在")
 
     print("🔍 智能验证模型文件...")
-    model_valid, validation_msg = smart_verify_qwen3_model(model_path)
+    if global_skip_verify:
+        model_valid, validation_msg = True, "⏭ 已跳过模型文件验证 (测试用小模型)"
+    else:
+        model_valid, validation_msg = smart_verify_qwen3_model(model_path, full=global_verify_full)
     if not model_valid:
         print(f"❌ 模型验证失败: {validation_msg}")
         print("💡 请重新下载完整模型: ./download_model.sh")
@@ -299,6 +423,8 @@ def load_qwen3_model(use_4bit: bool = False, use_cpu: bool = False):
             model_path,
             trust_remote_code=False
         )
+        # ✅ 批量生成要求左侧padding (decoder-only模型)
+        processor.tokenizer.padding_side = "left"
         print("✅ Processor加载成功!")
 
         quant_config = None
@@ -319,23 +445,41 @@ def load_qwen3_model(use_4bit: bool = False, use_cpu: bool = False):
         model_kwargs = {
             "trust_remote_code": False,
             "device_map": "auto" if device == "cuda" else "cpu",
-            "torch_dtype": torch.bfloat16 if device == "cuda" else torch.float32
+            "torch_dtype": torch.bfloat16 if device == "cuda" or global_cpu_dtype != "float32" else torch.float32
         }
-        if quant_config:
-            model_kwargs["quantization_config"] = quant_config
+        snapshot = None
+        if global_use_snapshot:
+            snapshot = ModelSnapshot(model_path, snapshot_variant(quant_config is not None, device,
+                                                                  model_kwargs["torch_dtype"]))
 
         print("🧠 加载Qwen3VLForConditionalGeneration...")
         start_time = time.time()
-        model = Qwen3VLForConditionalGeneration.from_pretrained(
-            model_path,
-            **model_kwargs
-        ).eval()
+        model = _load_snapshot(snapshot, model_kwargs) if snapshot is not None else None
+        if model is None:
+            if quant_config:
+                model_kwargs["quantization_config"] = quant_config
+            model = Qwen3VLForConditionalGeneration.from_pretrained(
+                model_path,
+                **model_kwargs
+            ).eval()
+            if snapshot is not None:
+                _save_snapshot(snapshot)
+        if device == "cpu" and global_cpu_dtype == "int8":
+            print("⚡ 文本解码器int8动态量化...")
+            quantize_int8(model)
+        if global_compile:
+            print("⚙️  启用torch.compile (首次生成时编译)")
+            compile_forward(model)
         load_time = time.time() - start_time
         print(f"✅ 模型加载成功! (耗时: {load_time:.1f}秒)")
 
-        if device == "cuda":
-            torch.cuda.empty_cache()
-        gc.collect()
+        memory_governor.device = device
+        memory_governor.cleanup()
+
+        refresh_prompt_cache()
+        open_vision_cache()
+        if global_draft_model_path:
+            load_draft_model(global_draft_model_path, model_kwargs["torch_dtype"])
 
         return model, processor
 
@@ -354,21 +498,121 @@ def load_qwen3_model(use_4bit: bool = False, use_cpu: bool = False):
         sys.exit(1)
 
 
-def _postprocess_caption(caption: str) -> str:
-    """后处理：过滤主观词 + 格式标准化 + 强制中文"""
-    # 移除系统/用户前缀
-    if "assistant" in caption:
-        caption = caption.split("assistant")[-1].strip()
+def load_draft_model(draft_path: str, torch_dtype):
+    """加载辅助解码用的小号Qwen3-VL草稿模型 (需与主模型共用tokenizer)，失败时回退为普通解码"""
+    global draft_model
+
+    print(f"🧠 加载草稿模型 (辅助解码): {draft_path}")
+    try:
+        start_time = time.time()
+        candidate = Qwen3VLForConditionalGeneration.from_pretrained(
+            draft_path,
+            trust_remote_code=False,
+            device_map="auto" if device == "cuda" else "cpu",
+            torch_dtype=torch_dtype
+        ).eval()
+    except Exception as e:
+        print(f"⚠️  草稿模型加载失败，使用普通解码: {str(e)}")
+        return None
+
+    vocab = model.config.get_text_config().vocab_size
+    draft_vocab = candidate.config.get_text_config().vocab_size
+    if vocab != draft_vocab:
+        print(f"⚠️  草稿模型词表 ({draft_vocab}) 与主模型 ({vocab}) 不一致，使用普通解码")
+        return None
+
+    draft_model = candidate
+    print(f"✅ 草稿模型加载成功! (耗时: {time.time() - start_time:.1f}秒)")
+    return draft_model
+
+
+def _load_snapshot(snapshot: ModelSnapshot, model_kwargs: dict):
+    """从模型快照加载 (量化配置已保存在快照config中)，快照无效或加载失败返回None"""
+    if not snapshot.is_valid():
+        print(f"💡 模型快照不可用 ({snapshot.mismatch_reason()})，从原始权重加载")
+        return None
+    try:
+        print(f"⚡ 从模型快照加载: {snapshot.path}")
+        return Qwen3VLForConditionalGeneration.from_pretrained(str(snapshot.path), **model_kwargs).eval()
+    except Exception as e:
+        print(f"⚠️  模型快照加载失败，回退到原始权重: {str(e)}")
+        gc.collect()
+        return None
+
+
+def _save_snapshot(snapshot: ModelSnapshot):
+    """保存模型快照，失败时只打印警告"""
+    try:
+        print(f"💾 保存模型快照: {snapshot.path}")
+        start_time = time.time()
+        if snapshot.save(model):
+            print(f"✅ 模型快照已保存 (耗时: {time.time() - start_time:.1f}秒)")
+        else:
+            print("⏭ 其他进程正在保存或已保存模型快照，跳过")
+    except Exception as e:
+        print(f"⚠️  模型快照保存失败: {str(e)}")
+
+
+def refresh_prompt_cache():
+    """构建/刷新系统提示词前缀KV缓存 (提示词文件变化时重新加载并重建)"""
+    global CAPTION_PROMPT, prompt_cache
+
+    if prompt_cache is None:
+        prompt_cache = PromptPrefixCache(Config.get_caption_prompt_path())
+        prompt_cache.enabled = global_use_prompt_cache
+
+    if not prompt_cache.is_stale():
+        return
+
+    CAPTION_PROMPT = Config.get_caption_prompt()
+    if not prompt_cache.enabled or model is None:
+        return
+
+    try:
+        print("🔧 构建提示词前缀KV缓存...")
+        start_time = time.time()
+        prefix_len = prompt_cache.build(model, processor, CAPTION_PROMPT)
+        if _verify_prompt_cache():
+            print(f"✅ 前缀缓存就绪! ({prefix_len} tokens, 耗时: {time.time() - start_time:.1f}秒)")
+            return
+        print("⚠️  当前transformers版本无法正确复用前缀缓存，已禁用")
+    except Exception as e:
+        print(f"⚠️  前缀缓存构建失败，已禁用: {str(e)}")
+
+    prompt_cache.enabled = False
+    prompt_cache.clear()
 
-    # 移除主观词
-    #for word in SUBJECTIVE_WORDS:
-        #caption = caption.replace(word, "")
+
+def _verify_prompt_cache() -> bool:
+    """自检: 同一探针图片在复用/不复用前缀缓存时，贪心解码的前若干个token应完全一致"""
+    probe = Image.radial_gradient("L").convert("RGB")
+    text = processor.apply_chat_template(
+        _build_caption_messages("probe"),
+        tokenize=False,
+        add_generation_prompt=True
+    )
+    inputs = _processor_inputs([text], [probe], None).to(model.device)
+    if not prompt_cache.matches(inputs):
+        return False
+
+    probe_kwargs = {"max_new_tokens": 8, "do_sample": False}
+    with torch.no_grad():
+        reset_rope_deltas(model)
+        ref = model.generate(**inputs, **probe_kwargs)
+        hit = model.generate(**prompt_cache.prepare(model, inputs), **probe_kwargs)
+    return ref.shape == hit.shape and bool(torch.equal(ref, hit))
+
+
+def _postprocess_caption(caption: str) -> str:
+    """后处理：过滤主观词 + 格式标准化 + 强制中文 (输入只含新生成的token，不含prompt)"""
+    # 主观词不再逐词替换删除，由质量检查 (--ban-subjective) 拒绝后重新生成
 
     # 标准化标点 (英文逗号分隔)
     caption = caption.replace("，", ",").replace("、", ",").replace("。", "").replace("；", ",")
 
-    # 移除多余空格
-    caption = ",".join([part.strip() for part in caption.split(",") if part.strip()])
+    # 移除多余空格，并去掉连续重复的片段 (退化重复被停止条件截断后的残留)
+    parts = [part.strip() for part in caption.split(",") if part.strip()]
+    caption = ",".join(part for i, part in enumerate(parts) if i == 0 or part != parts[i - 1])
 
     # 截断至200字符
     #if len(caption) > 200:
@@ -381,169 +625,1716 @@ def _postprocess_caption(caption: str) -> str:
     return caption
 
 
-# ✅ 核心修复: 严格遵循Qwen3-VL官方API + 强制中文输出
-def generate_chinese_caption(image_path: str, max_new_tokens: int = 300):
-    """使用Qwen3-VL生成100%中文训练专用caption"""
-    global model, processor
+# 用户指令 (每张图片相同)
+CAPTION_INSTRUCTION = "生成文生图模型训练用中文caption，禁用所有英文描述，必须使用中文自然语句描述"
+
+# 生成参数 (调整参数优化中文生成)
+GENERATION_KWARGS = {
+    "temperature": 0.55,  # ✅ 提高temperature增强创造性(中文)
+    "do_sample": True,
+    "top_p": 0.7,
+    "top_k": 20,
+    "repetition_penalty": 1.2
+}
+
+
+def _build_caption_messages(image_path: str, system_prompt: Optional[str] = None):
+    """构建单张图片的对话消息 (system_prompt为None时使用当前系统提示词)"""
+    # ✅ 核心: messages中使用图像文件路径（字符串）
+    return [
+        {"role": "system", "content": system_prompt if system_prompt is not None else _caption_prompt()},
+        {
+            "role": "user",
+            "content": [
+                {"type": "image", "image": image_path},  # ✅ 文件路径字符串
+                {"type": "text", "text": CAPTION_INSTRUCTION}
+            ]
+        }
+    ]
+
 
+def _max_image_pixels() -> Optional[int]:
+    """视觉token预算对应的最大像素数 (每个视觉token覆盖 (patch_size*merge_size)^2 像素)，不限制时返回None"""
+    if not global_max_vision_tokens or global_max_vision_tokens <= 0:
+        return None
+    image_processor = getattr(processor, "image_processor", None)
+    patch_size = getattr(image_processor, "patch_size", 16)
+    merge_size = getattr(image_processor, "merge_size", 2)
+    return global_max_vision_tokens * (patch_size * merge_size) ** 2
+
+
+def _backoff_max_pixels(image_path: str) -> Optional[int]:
+    """OOM回退期间的像素上限: 在视觉token预算 (不限制时为原图尺寸) 基础上按memory_governor.vision_scale缩小"""
+    max_pixels = _max_image_pixels()
+    if memory_governor.vision_scale >= 1.0:
+        return max_pixels
     try:
-        if not os.path.exists(image_path):
-            raise FileNotFoundError(f"图片不存在: {image_path}")
-
-        # 打开并验证图片
-        image = Image.open(image_path).convert("RGB")
-        image.verify()
-        image = Image.open(image_path).convert("RGB")
-
-        # ✅ 核心: messages中使用图像文件路径（字符串）
-        messages = [
-            {"role": "system", "content": CAPTION_PROMPT},
-            {
-                "role": "user",
-                "content": [
-                    {"type": "image", "image": image_path},  # ✅ 文件路径字符串
-                    {"type": "text", "text": "生成文生图模型训练用中文caption，禁用所有英文描述，必须使用中文自然语句描述"}
-                ]
-            }
-        ]
-
-        # 处理输入
-        text = processor.apply_chat_template(
-            messages,
+        with Image.open(image_path) as img:
+            area = img.size[0] * img.size[1]
+    except Exception:
+        return max_pixels
+    return max(1, int(min(area, max_pixels or area) * memory_governor.vision_scale))
+
+
+def vision_token_counts(inputs) -> List[int]:
+    """processor输出中每张图片的视觉token数 (合并后，按image_grid_thw计算)"""
+    grid = inputs.get("image_grid_thw") if inputs is not None else None
+    if grid is None:
+        return []
+    merge_size = getattr(getattr(processor, "image_processor", None), "merge_size", 2)
+    return [int(t * h * w) // (merge_size ** 2) for t, h, w in grid.tolist()]
+
+
+def _open_image(image_path: str, max_pixels: Optional[int] = None):
+    """打开并验证图片，返回RGB格式PIL Image (只解码一次)
+
+    max_pixels不为None时按比例缩小到该像素数以内：JPEG通过draft模式在解码阶段直接按1/2~1/8缩小，
+    再用高质量重采样缩放到目标尺寸，避免完整解码超大图片。
+    """
+    if not os.path.exists(image_path):
+        raise FileNotFoundError(f"图片不存在: {image_path}")
+
+    with Image.open(image_path) as img:
+        width, height = img.size
+        target = None
+        if max_pixels and width * height > max_pixels:
+            scale = (max_pixels / (width * height)) ** 0.5
+            target = (max(1, int(width * scale)), max(1, int(height * scale)))
+            img.draft("RGB", target)
+        img.load()  # 完整解码，截断/损坏的文件会在此抛出异常
+        image = img.convert("RGB")
+
+    if target and image.size[0] * image.size[1] > max_pixels:
+        image = image.resize(target, Image.BICUBIC)
+    return image
+
+
+def prepare_caption_inputs(image_paths: List[str]):
+    """解码、校验并预处理一批图片 (可在后台线程执行，不触碰GPU)
+
+    返回 (inputs, valid_indices)：inputs为CPU上的processor输出 (全部失败时为None)，
+    valid_indices为成功进入批次的图片下标。
+    """
+    valid_indices = []
+    texts = []
+    images = []
+    max_pixels = _max_image_pixels()
+    plan = _vision_lookup(image_paths, max_pixels)
+    for idx, image_path in enumerate(image_paths):
+        image = None
+        if plan is None or plan[idx][1] is None:
+            try:
+                with metrics.stage("decode"):
+                    image = _open_image(image_path, max_pixels)
+            except Exception as e:
+                print(f"❌ 处理 {os.path.basename(image_path)} 时出错: {str(e)}")
+                continue
+        valid_indices.append(idx)
+        texts.append(processor.apply_chat_template(
+            _build_caption_messages(image_path),
             tokenize=False,
             add_generation_prompt=True
-        )
+        ))
+        images.append(image)
 
-        # ✅ 核心: processor()中传入PIL Image对象
-        inputs = processor(
-            text=[text],
-            images=[image],  # ✅ PIL Image对象
-            return_tensors="pt",
-            padding=True
-        ).to(model.device)
+    if not valid_indices:
+        return None, valid_indices
 
-        # 生成 (调整参数优化中文生成)
-        start_time = time.time()
-        with torch.no_grad():
-            output = model.generate(
-                **inputs,
-                max_new_tokens=max_new_tokens,
-                temperature=0.55,  # ✅ 提高temperature增强创造性(中文)
-                do_sample=True,
-                top_p=0.7,
-                top_k=20,
-                repetition_penalty=1.2
-            )
-        gen_time = time.time() - start_time
-
-        # 解码
-        caption_raw = processor.decode(output[0], skip_special_tokens=True)
-        caption_clean = _postprocess_caption(caption_raw)
-
-        print(f"⏱️  生成耗时: {gen_time:.1f}秒 | 长度: {len(caption_clean)}字符")
-        print(f"   描述: {caption_clean[:80]}...")
-        return caption_clean
+    # ✅ 核心: 预处理传入PIL Image对象；批量时依赖左侧padding对齐生成起点
+    with metrics.stage("preprocess"):
+        inputs = _processor_inputs(texts, images, plan and [plan[idx] for idx in valid_indices])
+    return inputs, valid_indices
+
+
+def _image_hash(image_path: str) -> str:
+    """图片内容hash: 启用caption缓存时复用其 路径/大小/mtime -> hash 记录"""
+    if caption_cache is not None:
+        return caption_cache.image_hash(image_path)
+    return hash_file(image_path)
 
+
+def _vision_lookup(image_paths: List[str], max_pixels: Optional[int]):
+    """查询视觉编码缓存，返回每张图片的 (缓存键, 命中条目或None)；未启用缓存时返回None"""
+    if vision_cache is None:
+        return None
+    plan = []
+    for image_path in image_paths:
+        try:
+            key = vision_cache.key(_image_hash(image_path), max_pixels)
+        except OSError:
+            plan.append((None, None))
+            continue
+        plan.append((key, vision_cache.get(key)))
+    return plan
+
+
+def _expand_image_tokens(texts: List[str], grids) -> List[str]:
+    """与processor内部一致: 按图片网格 (t, h, w) 展开每条文本中的图片占位token"""
+    merge_length = processor.image_processor.merge_size ** 2
+    image_token = processor.image_token
+    return [text.replace(image_token, image_token * (int(t) * int(h) * int(w) // merge_length), 1)
+            for text, (t, h, w) in zip(texts, grids)]
+
+
+def _tokenize(texts: List[str]):
+    """tokenizer调用 (fast tokenizer不支持多线程并发调用，持有_processor_lock)"""
+    with _processor_lock:
+        return processor(text=texts, return_tensors="pt", padding=True)
+
+
+def _processor_inputs(texts: List[str], images: list, plan: Optional[list]):
+    """构造模型输入 (可在多个预取线程中并发调用)
+
+    图片预处理 (缩放/归一化，CPU密集) 不加锁并行执行，只有tokenizer调用持有_processor_lock。
+    plan不为None时只对未命中视觉缓存的图片做图片预处理，命中的图片按缓存的image_grid_thw展开图片占位token，
+    视觉输出在generate时由_vision_cache_hook填入。
+    """
+    hits = [hit for _, hit in plan] if plan is not None else [None] * len(images)
+    misses = [image for image, hit in zip(images, hits) if hit is None]
+    image_inputs = processor.image_processor(images=misses, return_tensors="pt") if misses else {}
+    miss_grids = iter(image_inputs["image_grid_thw"].tolist() if misses else [])
+    grids = [list(hit[0]) if hit is not None else next(miss_grids) for hit in hits]
+
+    inputs = _tokenize(_expand_image_tokens(texts, grids))
+    inputs["image_grid_thw"] = torch.tensor(grids, dtype=torch.long)
+    # 全部命中时无需像素输入，但pixel_values不为None模型才会进入视觉分支 (由钩子返回缓存结果)
+    inputs["pixel_values"] = image_inputs["pixel_values"] if misses else torch.zeros(0, 1)
+    if plan is not None:
+        inputs["vision_plan"] = plan
+    return inputs
+
+
+@contextmanager
+def _vision_cache_hook(plan: Optional[list]):
+    """generate期间替换get_image_features: 命中的图片直接使用缓存的视觉输出，未命中的计算后写入缓存"""
+    inner = getattr(model, "model", None)
+    original = getattr(inner, "get_image_features", None)
+    if plan is None or original is None:
+        yield
+        return
+
+    def cached(pixel_values, image_grid_thw=None, *args, **kwargs):
+        miss_positions = [pos for pos, (_, hit) in enumerate(plan) if hit is None]
+        computed = {}
+        if miss_positions:
+            embeds, deepstack = original(pixel_values, image_grid_thw[miss_positions], *args, **kwargs)
+            sizes = [len(e) for e in embeds]
+            layers = [torch.split(d, sizes) for d in deepstack]
+            for j, pos in enumerate(miss_positions):
+                computed[pos] = (embeds[j], [layer[j] for layer in layers])
+                key = plan[pos][0]
+                if key is not None:
+                    # 拷贝回主机与落盘在后台写入线程执行，不阻塞prefill
+                    vision_cache.put_async(key, image_grid_thw[pos], [embeds[j]] + [layer[j] for layer in layers])
+
+        target = image_grid_thw.device
+        image_embeds, per_image_deepstack = [], []
+        for pos, (_, hit) in enumerate(plan):
+            if hit is None:
+                embeds_pos, deepstack_pos = computed[pos]
+            else:
+                stacked = hit[1].to(target, non_blocking=True)
+                embeds_pos, deepstack_pos = stacked[0], list(stacked[1:])
+            image_embeds.append(embeds_pos)
+            per_image_deepstack.append(deepstack_pos)
+        deepstack_embeds = [torch.cat(layer, dim=0) for layer in zip(*per_image_deepstack)]
+        return tuple(image_embeds), deepstack_embeds
+
+    inner.get_image_features = cached
+    try:
+        yield
+    finally:
+        inner.__dict__.pop("get_image_features", None)
+
+
+def _vision_cache_context() -> str:
+    """视觉编码缓存上下文: 模型标识 + 图片预处理配置，任一变化则缓存失效"""
+    image_processor = processor.image_processor
+    return hash_context(
+        model=_model_identity(),
+        dtype=str(getattr(model, "dtype", None)),
+        image_processor={k: getattr(image_processor, k, None)
+                         for k in ("size", "patch_size", "temporal_patch_size", "merge_size", "image_mean",
+                                   "image_std", "do_resize", "do_rescale", "do_normalize")}
+    )
+
+
+def open_vision_cache() -> Optional[VisionCache]:
+    """打开视觉编码缓存并设置上下文 (未启用时返回None)"""
+    global vision_cache
+
+    if not global_vision_cache_dir:
+        return None
+    try:
+        if vision_cache is None or vision_cache.directory != global_vision_cache_dir:
+            vision_cache = VisionCache(global_vision_cache_dir, int(global_vision_cache_gb * (1 << 30)))
+        vision_cache.set_context(_vision_cache_context(), merge_size=processor.image_processor.merge_size)
     except Exception as e:
-        print(f"❌ 处理 {os.path.basename(image_path)} 时出错: {str(e)}")
-        if device == "cuda":
-            torch.cuda.empty_cache()
-        gc.collect()
+        print(f"⚠️  视觉编码缓存不可用，已跳过: {str(e)}")
+        vision_cache = None
+    return vision_cache
+
+
+def _record_generation(generated, start: float, end: float, timer: Optional[FirstTokenTimer] = None):
+    """记录generate耗时 (及首个token前的prefill / 之后的逐token解码耗时) 与每张图片生成的token数
+
+    指标未启用时直接返回。
+    """
+    if not metrics.enabled:
+        return
+    metrics.inc("batches_total")
+    metrics.observe("stage_seconds", end - start, stage="generate")
+    if timer is not None and timer.time is not None:
+        metrics.observe("stage_seconds", timer.time - start, stage="prefill")
+        metrics.observe("stage_seconds", end - timer.time, stage="decode_tokens")
+    pad_id = getattr(getattr(processor, "tokenizer", None), "pad_token_id", None)
+    for row in generated:
+        metrics.observe("generated_tokens", int((row != pad_id).sum()) if pad_id is not None else row.numel())
+
+
+_stop_tokenizer = None
+
+
+def _decoding_kwargs(prompt_len: int, batch_len: int, max_new_tokens: int):
+    """generate附加参数: caption感知停止条件、辅助解码草稿模型与首token计时 (仅启用指标时)，
+
+    返回 (kwargs, criteria, timer)。
+    """
+    global _stop_tokenizer
+
+    kwargs, criteria, timer = {}, None, None
+    if metrics.enabled:
+        from transformers import LogitsProcessorList
+
+        timer = FirstTokenTimer(torch.cuda.synchronize if device == "cuda" else None)
+        kwargs["logits_processor"] = LogitsProcessorList([timer])
+    if global_early_stop:
+        from transformers import StoppingCriteriaList
+
+        # 独立的tokenizer副本: 每步解码新token时不与预取线程争用_processor_lock
+        if _stop_tokenizer is None:
+            import copy
+            _stop_tokenizer = copy.deepcopy(processor.tokenizer)
+        criteria = CaptionStoppingCriteria(_stop_tokenizer, prompt_len, soft_max_chars=soft_char_limit(max_new_tokens),
+                                           stop_at_newline=global_stop_at_newline)
+        kwargs["stopping_criteria"] = StoppingCriteriaList([criteria])
+    # transformers的辅助解码只支持单条序列
+    if draft_model is not None and batch_len == 1:
+        kwargs["assistant_model"] = draft_model
+    return kwargs, criteria, timer
+
+
+def _decode_generated(generated, criteria: Optional[CaptionStoppingCriteria], max_new_tokens: int) -> List[str]:
+    """只解码新生成的token，去掉停止条件触发时多生成的部分并后处理
+
+    返回GeneratedCaption (tokens为该行生成的token数)；生成满max_new_tokens仍未结束 (且非停止条件所致)
+    的行标记为TruncatedCaption，由质量检查拒绝。
+    """
+    texts = processor.batch_decode(generated, skip_special_tokens=True)
+    if criteria is not None:
+        texts = [criteria.trim(row, text) for row, text in enumerate(texts)]
+        for reason, count in criteria.reasons.items():
+            if count:
+                metrics.inc("early_stops_total", count, reason=reason)
+
+    captions = [_postprocess_caption(text) for text in texts]
+    pad_id = processor.tokenizer.pad_token_id
+    lengths = (generated != pad_id).sum(-1).tolist() if pad_id is not None else [generated.shape[1]] * len(captions)
+    truncated = set()
+    if generated.shape[1] >= max_new_tokens:
+        eos = model.generation_config.eos_token_id
+        finished = set(eos if isinstance(eos, list) else [eos]) | {pad_id}
+        for row, last in enumerate(generated[:, -1].tolist()):
+            stopped = criteria is not None and criteria.row_reasons and criteria.row_reasons[row]
+            if last not in finished and not stopped:
+                truncated.add(row)
+
+    for row, length in enumerate(lengths):
+        captions[row] = (TruncatedCaption if row in truncated else GeneratedCaption)(captions[row])
+        captions[row].tokens = int(length)
+    return captions
+
+
+def _token_rate(generated, gen_time: float) -> str:
+    pad_id = getattr(processor.tokenizer, "pad_token_id", None)
+    tokens = int((generated != pad_id).sum()) if pad_id is not None else generated.numel()
+    mode = " (辅助解码)" if draft_model is not None and generated.shape[0] == 1 else ""
+    return f"{tokens / gen_time:.1f} tokens/秒{mode}" if gen_time > 0 else f"{tokens} tokens{mode}"
+
+
+def generate_from_inputs(inputs, max_new_tokens: int = 300) -> List[str]:
+    """对预处理好的输入执行generate，逐样本解码 (丢弃prompt部分token)"""
+    plan = inputs.pop("vision_plan", None)
+    inputs = inputs.to(model.device)
+    prompt_len = inputs["input_ids"].shape[1]
+    decoding_kwargs, criteria, timer = _decoding_kwargs(prompt_len, inputs["input_ids"].shape[0], max_new_tokens)
+
+    # ✅ 无padding时复用系统提示词前缀KV缓存，prefill只覆盖图片+用户指令 (辅助解码时草稿模型无对应缓存，不使用)
+    use_prefix = prompt_cache is not None and "assistant_model" not in decoding_kwargs and prompt_cache.matches(inputs)
+
+    start_time = time.perf_counter()
+    with torch.no_grad(), _vision_cache_hook(plan):
+        generate_inputs = prompt_cache.prepare(model, inputs) if use_prefix else inputs
+        output = model.generate(
+            **generate_inputs,
+            max_new_tokens=max_new_tokens,
+            **GENERATION_KWARGS,
+            **decoding_kwargs
+        )
+    end_time = time.perf_counter()
+    gen_time = end_time - start_time
+
+    generated = output[:, prompt_len:]
+    _record_generation(generated, start_time, end_time, timer)
+    with _processor_lock, metrics.stage("postprocess"):
+        captions = _decode_generated(generated, criteria, max_new_tokens)
+
+    if len(captions) > 1:
+        print(f"⏱️  批量生成耗时: {gen_time:.1f}秒 | {len(captions)}张 | "
+              f"平均 {gen_time / len(captions):.1f}秒/张 | {_token_rate(generated, gen_time)}")
+    else:
+        print(f"⏱️  生成耗时: {gen_time:.1f}秒 | 长度: {len(captions[0])}字符 | {_token_rate(generated, gen_time)}")
+        print(f"   描述: {captions[0][:80]}...")
+    return captions
+
+
+# ✅ 核心修复: 严格遵循Qwen3-VL官方API + 强制中文输出
+def generate_chinese_caption(image_path: str, max_new_tokens: int = 300, overrides: Optional[dict] = None,
+                             prompt: Optional[str] = None):
+    """使用Qwen3-VL生成100%中文训练专用caption，显存不足时降低分辨率重试
+
+    overrides覆盖GENERATION_KWARGS中的采样参数 (质量检查不通过后重新生成时使用)；
+    prompt为None时使用当前系统提示词 (多提示词打标时传入该配置的提示词)。
+    """
+    floor_attempts = 0
+    while True:
+        try:
+            caption = _generate_single(image_path, max_new_tokens, overrides, prompt)
+            memory_governor.on_success()
+            return caption
+        except Exception as e:
+            oom, error = is_oom_error(e), str(e)
+
+        # 离开except后异常回溯不再引用中间张量，清理才能真正释放显存
+        if oom and memory_governor.can_retry(floor_attempts):
+            if memory_governor.at_floor:
+                floor_attempts += 1
+                print(f"⚠️  {os.path.basename(image_path)} 显存不足 (已是最低分辨率)，清理显存后重试")
+            else:
+                print(f"⚠️  {os.path.basename(image_path)} 显存不足，降低分辨率重试")
+            memory_governor.on_oom(1)
+            continue
+        print(f"❌ 处理 {os.path.basename(image_path)} 时出错: {error}")
+        memory_governor.cleanup()
         return None
 
 
-def process_images(folder_path: str,trigger_word: str,use_4bit: bool = False, use_cpu: bool = False, progress=None):
-    """批量处理图片文件夹"""
-    if not folder_path or not folder_path.strip():
-        return "❌ 错误: 请输入有效的文件夹路径"
+def _generate_single(image_path: str, max_new_tokens: int, overrides: Optional[dict] = None,
+                     prompt: Optional[str] = None) -> str:
+    """单张图片生成caption (异常由调用方处理)"""
+    # 打开并验证图片 (超出视觉token预算或处于OOM回退时缩小)；视觉编码缓存命中时无需解码
+    max_pixels = _backoff_max_pixels(image_path)
+    plan = _vision_lookup([image_path], max_pixels)
+    image = None
+    if plan is None or plan[0][1] is None:
+        with metrics.stage("decode"):
+            image = _open_image(image_path, max_pixels)
+
+    messages = _build_caption_messages(image_path, prompt)
+
+    # 处理输入
+    text = processor.apply_chat_template(
+        messages,
+        tokenize=False,
+        add_generation_prompt=True
+    )
 
-    folder_path = folder_path.strip()
-    if not os.path.isdir(folder_path):
-        return f"❌ 错误: 路径 '{folder_path}' 不是有效文件夹"
+    # ✅ 核心: 预处理传入PIL Image对象
+    with metrics.stage("preprocess"):
+        inputs = _processor_inputs([text], [image], plan)  # ✅ PIL Image对象
+    inputs.pop("vision_plan", None)
+    inputs = inputs.to(model.device)
+    prompt_len = inputs["input_ids"].shape[1]
+    decoding_kwargs, criteria, timer = _decoding_kwargs(prompt_len, 1, max_new_tokens)
+
+    # 生成
+    start_time = time.perf_counter()
+    with torch.no_grad(), _vision_cache_hook(plan):
+        output = model.generate(
+            **inputs,
+            max_new_tokens=max_new_tokens,
+            **{**GENERATION_KWARGS, **(overrides or {})},
+            **decoding_kwargs
+        )
+    end_time = time.perf_counter()
+    gen_time = end_time - start_time
+    generated = output[:, prompt_len:]
+    _record_generation(generated, start_time, end_time, timer)
 
-    SUPPORTED_FORMATS = {'.jpg', '.jpeg', '.png', '.bmp', '.webp', '.tiff'}
+    # 解码 (只解码新生成的token)
+    with _processor_lock, metrics.stage("postprocess"):
+        caption_clean = _decode_generated(generated, criteria, max_new_tokens)[0]
 
-    image_files = [
-        f for f in os.listdir(folder_path)
-        if os.path.splitext(f.lower())[1] in SUPPORTED_FORMATS and
-           not f.lower().startswith('._')
-    ]
+    print(f"⏱️  生成耗时: {gen_time:.1f}秒 | 长度: {len(caption_clean)}字符 | {_token_rate(generated, gen_time)}")
+    print(f"   描述: {caption_clean[:80]}...")
+    return caption_clean
 
-    if not image_files:
-        return f"⚠️ 警告: 在 '{folder_path}' 中未找到支持的图片文件"
 
-    load_qwen3_model(use_4bit=use_4bit, use_cpu=use_cpu)
+def _generate_prepared(image_paths: List[str], inputs, valid_indices: List[int],
+                       max_new_tokens: int = 300) -> List[Optional[str]]:
+    """对已预处理的批次生成caption
 
-    results = {
-        "total": len(image_files),
-        "success": 0,
-        "failed": 0,
-        "skipped": 0,
-        "details": []
-    }
+    超出memory_governor当前批次上限 (或处于降分辨率回退) 时改为分块重新预处理；
+    整批显存不足时按减半的批次重试，其他错误逐张回退重试。
+    """
+    captions: List[Optional[str]] = [None] * len(image_paths)
+    if inputs is None:
+        return captions
 
-    total = len(image_files)
+    if memory_governor.fits(len(valid_indices)):
+        try:
+            for idx, caption in zip(valid_indices, generate_from_inputs(inputs, max_new_tokens=max_new_tokens)):
+                captions[idx] = caption
+            memory_governor.on_success()
+            return captions
+        except Exception as e:
+            oom, error = is_oom_error(e), str(e)
 
-    for i, filename in enumerate(image_files):
-        if progress:
-            progress(i / total, desc=f"处理中 ({i + 1}/{total}) - {filename}")
+        print(f"⚠️  生成失败 ({len(valid_indices)}张): {error}")
+        del inputs
+        if oom:
+            memory_governor.on_oom(len(valid_indices))
+        else:
+            memory_governor.cleanup()
+            if len(valid_indices) == 1:
+                return captions
+            print("🔄 回退为逐张生成...")
+            for idx in valid_indices:
+                captions[idx] = generate_chinese_caption(image_paths[idx], max_new_tokens=max_new_tokens)
+            return captions
+    else:
+        del inputs
 
-        image_path = os.path.join(folder_path, filename)
-        txt_path = os.path.splitext(image_path)[0] + '.txt'
+    _generate_chunked(image_paths, list(valid_indices), captions, max_new_tokens)
+    return captions
 
-        if os.path.exists(txt_path):
-            results["skipped"] += 1
-            results["details"].append(f"⏭ 跳过: {filename} (已存在描述文件)")
+
+def _generate_chunked(image_paths: List[str], indices: List[int], captions: List[Optional[str]],
+                      max_new_tokens: int):
+    """按memory_governor.batch_limit分块重新预处理并生成，单张时走降分辨率重试路径"""
+    while indices:
+        size = memory_governor.batch_limit or len(indices)
+        chunk, indices = indices[:size], indices[size:]
+        if len(chunk) == 1:
+            captions[chunk[0]] = generate_chinese_caption(image_paths[chunk[0]], max_new_tokens=max_new_tokens)
             continue
 
-        print(f"\n🖼️  处理: {filename}")
-        caption = generate_chinese_caption(image_path)
+        inputs, valid = prepare_caption_inputs([image_paths[idx] for idx in chunk])
+        if inputs is None:
+            continue
+        try:
+            for pos, caption in zip(valid, generate_from_inputs(inputs, max_new_tokens=max_new_tokens)):
+                captions[chunk[pos]] = caption
+            memory_governor.on_success()
+            continue
+        except Exception as e:
+            oom, error = is_oom_error(e), str(e)
 
-        if caption and len(caption) > 30:
-            try:
-                if len(trigger_word.strip()) > 0:
-                    caption = trigger_word.strip() + "," + caption
-                with open(txt_path, 'w', encoding='utf-8') as f:
-                    f.write(caption)
-                results["success"] += 1
-                preview = caption[:70] + "..." if len(caption) > 70 else caption
-                results["details"].append(f"✅ 成功: {filename}\n   {preview}")
-            except Exception as e:
-                results["failed"] += 1
-                results["details"].append(f"❌ 写入失败: {filename}\n   {str(e)}")
+        print(f"⚠️  分块生成失败 ({len(valid)}张): {error}")
+        del inputs
+        if oom:
+            memory_governor.on_oom(len(valid))
+            indices = [chunk[pos] for pos in valid] + indices
         else:
-            results["failed"] += 1
-            results["details"].append(f"❌ 生成失败: {filename}")
+            memory_governor.cleanup()
+            for pos in valid:
+                captions[chunk[pos]] = generate_chinese_caption(image_paths[chunk[pos]], max_new_tokens=max_new_tokens)
+
+
+def prepare_profile_inputs(image_paths: List[str], prompts: List[str]):
+    """多提示词: 一批图片只解码、预处理一次，为每个提示词构造共享同一pixel_values的输入
+
+    返回 (各提示词的inputs列表, valid_indices)，全部图片失败时inputs列表为空。
+    """
+    images, valid_indices = [], []
+    max_pixels = _max_image_pixels()
+    for idx, image_path in enumerate(image_paths):
+        try:
+            with metrics.stage("decode"):
+                images.append(_open_image(image_path, max_pixels))
+        except Exception as e:
+            print(f"❌ 处理 {os.path.basename(image_path)} 时出错: {str(e)}")
+            continue
+        valid_indices.append(idx)
+
+    if not valid_indices:
+        return [], valid_indices
+
+    with metrics.stage("preprocess"):
+        # 图片预处理不加锁，只有tokenizer调用持有_processor_lock
+        image_inputs = processor.image_processor(images=images, return_tensors="pt")
+        grid = image_inputs["image_grid_thw"]
+
+        profile_inputs = []
+        for prompt in prompts:
+            texts = [processor.apply_chat_template(_build_caption_messages(image_paths[idx], prompt),
+                                                   tokenize=False, add_generation_prompt=True)
+                     for idx in valid_indices]
+            inputs = _tokenize(_expand_image_tokens(texts, grid.tolist()))
+            inputs["pixel_values"] = image_inputs["pixel_values"]
+            inputs["image_grid_thw"] = grid
+            profile_inputs.append(inputs)
+    return profile_inputs, valid_indices
+
+
+@contextmanager
+def _shared_image_features():
+    """同一批图片依次按多个提示词生成时，视觉编码只计算一次 (按pixel_values张量缓存get_image_features结果)"""
+    inner = getattr(model, "model", None)
+    original = getattr(inner, "get_image_features", None)
+    if original is None:
+        yield
+        return
+
+    memo = {}
+
+    def cached(pixel_values, *args, **kwargs):
+        key = (pixel_values.data_ptr(), tuple(pixel_values.shape))
+        if key not in memo:
+            memo[key] = original(pixel_values, *args, **kwargs)
+        return memo[key]
+
+    inner.get_image_features = cached
+    try:
+        yield
+    finally:
+        inner.__dict__.pop("get_image_features", None)
+
+
+def generate_profile_captions(image_paths: List[str], prompts: List[str], profile_inputs: list,
+                              valid_indices: List[int], max_new_tokens: int = 300) -> List[List[Optional[str]]]:
+    """对prepare_profile_inputs的结果逐个提示词generate，返回 [提示词][图片] 的caption (失败为None)
+
+    与_generate_prepared一致: 超出memory_governor当前批次上限或整批显存不足 (先记录OOM回退) 时，
+    该提示词改为逐张生成 (单张仍可降分辨率重试)；其他错误同样逐张回退重试。
+    """
+    captions = [[None] * len(image_paths) for _ in prompts]
+    if not profile_inputs:
+        return captions
+
+    # pixel_values只搬运一次到GPU，各提示词的输入引用同一张量，视觉编码缓存按张量命中
+    pixel_values = profile_inputs[0]["pixel_values"].to(model.device)
+    with _shared_image_features():
+        for profile_idx, (prompt, inputs) in enumerate(zip(prompts, profile_inputs)):
+            row = captions[profile_idx]
+            if memory_governor.fits(len(valid_indices)):
+                inputs["pixel_values"] = pixel_values
+                try:
+                    for idx, caption in zip(valid_indices, generate_from_inputs(inputs, max_new_tokens=max_new_tokens)):
+                        row[idx] = caption
+                    memory_governor.on_success()
+                    continue
+                except Exception as e:
+                    oom, error = is_oom_error(e), str(e)
+
+                print(f"⚠️  生成失败 ({len(valid_indices)}张): {error}")
+                if oom:
+                    memory_governor.on_oom(len(valid_indices))
+                else:
+                    memory_governor.cleanup()
+                    if len(valid_indices) == 1:
+                        continue
+                print("🔄 回退为逐张生成...")
+
+            for idx in valid_indices:
+                row[idx] = generate_chinese_caption(image_paths[idx], max_new_tokens=max_new_tokens, prompt=prompt)
+    return captions
+
+
+def generate_chinese_captions_batch(image_paths: List[str], max_new_tokens: int = 300) -> List[Optional[str]]:
+    """批量生成caption: N张图片合并为一次processor + 一次generate调用
+
+    返回与image_paths一一对应的caption列表 (失败为None)。
+    整批生成失败时逐张回退重试，单张坏图不会拖垮整批。
+    """
+    inputs, valid_indices = prepare_caption_inputs(image_paths)
+    captions = _generate_prepared(image_paths, inputs, valid_indices, max_new_tokens=max_new_tokens)
+    return _quality_gate(image_paths, captions, max_new_tokens=max_new_tokens)
+
+
+def _retry_params(reason: str, attempt: int, max_new_tokens: int) -> Tuple[int, dict]:
+    """按质量检查未通过的原因调整重新生成的参数，返回 (max_new_tokens, 采样参数覆盖)"""
+    temperature = GENERATION_KWARGS["temperature"]
+    if reason == "truncated":
+        return int(max_new_tokens * (1 + 0.5 * attempt)), {}
+    if reason == "repetition":
+        return max_new_tokens, {"repetition_penalty": GENERATION_KWARGS["repetition_penalty"] + 0.15 * attempt,
+                                "no_repeat_ngram_size": 6}
+    if reason == "cjk_ratio":
+        return max_new_tokens, {"temperature": round(max(0.2, temperature - 0.15 * attempt), 2), "top_k": 10}
+    # 过短/过长/禁用词: 换一次采样，略降温度
+    return max_new_tokens, {"temperature": round(max(0.2, temperature - 0.1 * attempt), 2)}
+
+
+def _quality_gate(image_paths: List[str], captions: List[Optional[str]], max_new_tokens: int = 300,
+                  prompt: Optional[str] = None):
+    """质量检查: 未通过的图片按调整后的参数单独重新生成，最多global_quality_retries次
+
+    只重新生成未通过的图片；用尽重试次数仍未通过的caption原样返回，由写入时的检查记为失败。
+    prompt为多提示词打标时该配置的提示词 (None为当前系统提示词)。
+    """
+    for idx, caption in enumerate(captions):
+        if caption is None:
+            continue
+        reason = caption_validator.check(caption)
+        attempt = 0
+        while reason and attempt < global_quality_retries:
+            attempt += 1
+            metrics.inc("quality_retries_total", reason=reason)
+            print(f"🔁 质量检查未通过 ({REASON_LABELS[reason]})，调整参数重新生成: "
+                  f"{os.path.basename(image_paths[idx])} (第{attempt}次)")
+            tokens, overrides = _retry_params(reason, attempt, max_new_tokens)
+            retry = generate_chinese_caption(image_paths[idx], max_new_tokens=tokens, overrides=overrides,
+                                             prompt=prompt)
+            if retry is None:
+                break
+            caption, reason = retry, caption_validator.check(retry)
+        captions[idx] = caption
+    return captions
+
+
+def _iter_image_files(folder_path: str, recursive: bool = False, include: Optional[List[str]] = None,
+                      exclude: Optional[List[str]] = None) -> Iterator[str]:
+    """边扫描边产出支持格式的图片 (相对folder_path的路径)"""
+    return iter_image_files(folder_path, SUPPORTED_FORMATS, recursive=recursive, include=include, exclude=exclude)
+
+
+def _filter_shard(image_files: Iterable[str], shard: Optional[Tuple[int, int]]) -> Iterable[str]:
+    """只保留属于本分片的图片 (shard为 (i, N))"""
+    if not shard:
+        return image_files
+    index, count = shard
+    # 统一使用/分隔的相对路径计算hash，不同操作系统的节点分片结果一致
+    return (f for f in image_files if in_shard(f.replace(os.sep, "/"), index, count))
+
+
+def _peek(image_files: Iterable[str]) -> Optional[Iterator[str]]:
+    """预读第一个元素判断是否为空，非空时返回等价的完整迭代器，为空返回None"""
+    it = iter(image_files)
+    for first in it:
+        return chain([first], it)
+    return None
+
+
+def _dedup_image_files(folder_path: str, image_files: Iterable[str], dedup: Optional[str], threshold: int):
+    """近重复预处理: 按感知hash聚类，只保留每组的代表图片，返回 (待打标图片, 分组)
+
+    聚类需要完整的图片列表，开启时会先扫描完整个目录树。
+    """
+    if not dedup:
+        return image_files, []
+    if dedup not in DEDUP_MODES:
+        raise ValueError(f"未知的近重复处理模式: '{dedup}' (可选: {', '.join(DEDUP_MODES)})")
+
+    from dedup import find_near_duplicates
+
+    start = time.time()
+    image_files = list(image_files)
+    groups = find_near_duplicates(folder_path, image_files, threshold=threshold)
+    members = {f for group in groups for f in group[1:]}
+    print(f"🔗 近重复检测: {len(image_files)} 张 -> {len(groups)} 组, 省去 {len(members)} 张 ({time.time() - start:.1f}秒)")
+    return [f for f in image_files if f not in members], groups
+
+
+def _has_caption(txt_path: str) -> bool:
+    """描述文件存在且非空 (非原子写入中断时可能留下空文件，需重新生成)"""
+    try:
+        return os.path.getsize(txt_path) > 0
+    except OSError:
+        return False
+
+
+def _emit_caption(filename: str, txt_path: str, caption: str, results: dict, status: Optional[str] = None) -> None:
+    """写出描述文件: results含 "writes" 时交给主进程写入 (数据并行工作进程)，
+    否则交给后台写入线程，无写入线程时同步原子写入
+
+    status不为None时，在确认写入成功后计入 images_total{status}。
+    """
+    if "writes" in results:
+        results["writes"].append((filename, txt_path, caption, status))
+    elif caption_writer is not None:
+        caption_writer.submit(filename, txt_path, caption, status=status)
+    else:
+        atomic_write_text(txt_path, caption)
+        if status:
+            metrics.inc("images_total", status=status)
+
+
+def _open_writer(metadata_path: Optional[str]) -> CaptionWriter:
+    """启动本次运行的后台caption写入线程"""
+    global caption_writer
+    caption_writer = CaptionWriter(metadata_path=metadata_path)
+    metrics.gauge_fn("write_queue_depth", caption_writer.pending)
+    return caption_writer
+
+
+def _close_writer(results: dict) -> None:
+    """等待后台写入完成并关闭写入线程"""
+    global caption_writer
+    if caption_writer is None:
+        return
+    caption_writer.close()
+    _collect_write_errors(results)
+    caption_writer = None
+
+
+def _collect_write_errors(results: dict) -> None:
+    """将后台写入失败的caption从成功改记为失败 (并追加运行日志记录)"""
+    if caption_writer is None:
+        return
+    for filename, error in caption_writer.drain_errors():
+        results["success"] -= 1
+        results["failed"] += 1
+        results["details"].append(f"❌ 写入失败: {filename}\n   {error}")
+        metrics.inc("write_errors_total")
+        metrics.inc("images_total", status="failed")
+        if "journal" in results:
+            results["journal"].append({"file": filename, "status": "failed", "error": f"写入失败: {error}"})
+
+
+def _finish_duplicates(folder_path: str, groups: List[List[str]], dedup: Optional[str], results: dict,
+                       leases: Optional[LeaseManager] = None):
+    """代表图片打标完成后处理近重复成员: share模式复制代表的caption，flag模式仅在报告中标记
+
+    leases不为None时，复制前先认领成员图片的租约 (其他节点处理中则跳过)，写入完成后释放。
+    """
+    claimed = []
+    for representative, *members in groups:
+        results["total"] += len(members)
+        rep_txt = os.path.splitext(os.path.join(folder_path, representative))[0] + '.txt'
+        for filename in members:
+            txt_path = os.path.splitext(os.path.join(folder_path, filename))[0] + '.txt'
+            if _has_caption(txt_path):
+                results["skipped"] += 1
+                results["details"].append(f"⏭ 跳过: {filename} (已存在描述文件)")
+            elif dedup == "flag":
+                results["deduped"] += 1
+                results["details"].append(f"🔗 近重复: {filename} ≈ {representative} (未打标)")
+            elif not _has_caption(rep_txt):
+                results["failed"] += 1
+                results["details"].append(f"❌ 共享失败: {filename} (代表图片 {representative} 无caption)")
+            elif leases is not None and not leases.claim(filename):
+                results["skipped"] += 1
+                results["details"].append(f"⏭ 跳过: {filename} (其他节点处理中)")
+            else:
+                if leases is not None:
+                    claimed.append(filename)
+                    # 认领前其他节点可能刚好完成
+                    if _has_caption(txt_path):
+                        results["skipped"] += 1
+                        results["details"].append(f"⏭ 跳过: {filename} (已存在描述文件)")
+                        continue
+                try:
+                    with open(rep_txt, 'r', encoding='utf-8') as src:
+                        _emit_caption(filename, txt_path, src.read(), results)
+                    results["deduped"] += 1
+                    results["details"].append(f"🔗 共享caption: {filename} ← {representative}")
+                except Exception as e:
+                    results["failed"] += 1
+                    results["details"].append(f"❌ 写入失败: {filename}\n   {str(e)}")
+
+    if claimed:
+        _release_written(leases, claimed)
+
+
+def _release_written(leases: LeaseManager, filenames: Iterable[str]) -> None:
+    """描述文件落盘后再释放租约，其他节点认领时能看到已存在的描述文件 (而不是重新打标)"""
+    if caption_writer is not None:
+        caption_writer.flush()
+    for filename in filenames:
+        leases.release(filename)
+
+
+def _format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}小时{seconds % 3600 // 60}分"
+    if seconds >= 60:
+        return f"{seconds // 60}分{seconds % 60}秒"
+    return f"{seconds}秒"
+
+
+def _build_progress(results: dict, elapsed: float) -> str:
+    """生成运行中的进度文本: 完成数、吞吐量、预计剩余时间 (按已发现的图片估算) 与最近结果"""
+    done = results["success"] + results["failed"]
+    remaining = max(0, results["total"] - results["skipped"] - done)
+    rate = done / elapsed if elapsed > 0 else 0.0
+    eta = _format_duration(remaining / rate) if rate > 0 else "计算中"
+
+    return (
+            f"⏳ 处理中... 已完成 {done} 张 | 已发现 {results['total']} 张 | 跳过 {results['skipped']}\n"
+            f"✅ 成功: {results['success']} | ❌ 失败: {results['failed']}\n"
+            f"🚀 {rate:.2f} 张/秒 | 已用 {_format_duration(elapsed)} | 预计剩余 {eta}\n\n"
+            f"📋 最近结果:\n" +
+            "\n".join(results["details"][-10:])
+    )
+
+
+def _vision_token_summary(results: dict) -> str:
+    """视觉token与批内padding效率统计行 (无统计数据时为空)"""
+    summary = ""
+    images = results.get("vision_images", 0)
+    if images:
+        budget = f" | 预算 {global_max_vision_tokens}/张" if global_max_vision_tokens > 0 else " | 不限制"
+        summary += f"🎞️ 视觉token: 平均 {results['vision_tokens'] / images:.0f}/张 (共 {results['vision_tokens']}){budget}\n"
+    padded = results.get("padded_tokens", 0)
+    if padded:
+        efficiency = results["real_tokens"] / padded * 100
+        summary += f"🧩 padding效率: {efficiency:.1f}% (有效token {results['real_tokens']}/{padded})\n"
+    return summary
+
+
+def _given_up_note(results: dict) -> str:
+    given_up = results.get("given_up", 0)
+    return f"，其中 {given_up} 张超过重试上限" if given_up else ""
 
-        if i % 3 == 0:
-            if device == "cuda":
-                torch.cuda.empty_cache()
-            gc.collect()
 
-    processed = max(1, results["total"] - results["skipped"])
+def _build_report(results: dict, folder_path: str, timing: str, title: str = "🎉 批量处理完成!") -> str:
+    """生成批量处理报告"""
+    processed = max(1, results["success"] + results["failed"])
     success_rate = results["success"] / processed * 100
 
-    report = (
-            f"🎉 批量处理完成!\n\n"
+    return (
+            f"{title}\n\n"
             f"📊 总计: {results['total']} 张图片\n"
             f"✅ 成功: {results['success']} ({success_rate:.1f}%)\n"
             f"❌ 失败: {results['failed']}\n"
-            f"⏭ 跳过: {results['skipped']} (已存在)\n\n"
+            f"⏭ 跳过: {results['skipped']} (已存在{_given_up_note(results)})\n"
+            f"♻️ 缓存命中: {results.get('cached', 0)}\n"
+            f"🔗 近重复: {results.get('deduped', 0)} (共享caption或仅标记)\n"
+            f"{_vision_token_summary(results)}"
+            f"{timing}\n\n"
             f"📁 结果保存在: {folder_path}\n\n"
             f"📋 详细日志 (最近10条):\n" +
             "\n".join(results["details"][-10:])
     )
 
+
+def _save_caption(filename: str, txt_path: str, caption: Optional[str], trigger_word: str, results: dict,
+                  cached: bool = False, vision_tokens: Optional[int] = None, elapsed: Optional[float] = None) -> bool:
+    """校验并写入caption，更新统计结果，写入成功返回True
+
+    vision_tokens为该图片输入模型的视觉token数 (已知时记入日志与统计)。
+    results含 "journal" 列表时追加一条运行日志记录 (状态/耗时/视觉token数/生成token数/错误)，
+    未知的字段不写入。
+    """
+    generated_tokens = getattr(caption, "tokens", None) if not cached else None
+    saved, error = _write_caption(filename, txt_path, caption, trigger_word, results, cached, vision_tokens)
+    # 成功的caption在确认写入后由_emit_caption计数
+    if not saved:
+        metrics.inc("images_total", status="failed")
+    if "journal" in results:
+        record = {"file": filename, "status": ("cached" if cached else "success") if saved else "failed"}
+        if elapsed is not None:
+            record["elapsed"] = round(elapsed, 3)
+        if vision_tokens:
+            record["vision_tokens"] = vision_tokens
+        if generated_tokens:
+            record["generated_tokens"] = generated_tokens
+        if error:
+            record["error"] = error
+        results["journal"].append(record)
+    return saved
+
+
+def _write_caption(filename: str, txt_path: str, caption: Optional[str], trigger_word: str, results: dict,
+                   cached: bool, vision_tokens: Optional[int]) -> Tuple[bool, Optional[str]]:
+    """写入caption并更新统计结果，返回 (是否成功, 失败原因)"""
+    token_note = ""
+    if vision_tokens:
+        results["vision_tokens"] = results.get("vision_tokens", 0) + vision_tokens
+        results["vision_images"] = results.get("vision_images", 0) + 1
+        token_note = f" (视觉token {vision_tokens})"
+
+    reason = caption_validator.check(caption) if caption else None
+    if caption and reason is None:
+        try:
+            if trigger_word and len(trigger_word.strip()) > 0:
+                caption = trigger_word.strip() + "," + caption
+            _emit_caption(filename, txt_path, caption, results, status="cached" if cached else "success")
+            results["success"] += 1
+            preview = caption[:70] + "..." if len(caption) > 70 else caption
+            if cached:
+                results["cached"] = results.get("cached", 0) + 1
+                results["details"].append(f"♻️ 缓存命中: {filename}\n   {preview}")
+            else:
+                results["details"].append(f"✅ 成功: {filename}{token_note}\n   {preview}")
+            return True, None
+        except Exception as e:
+            results["failed"] += 1
+            results["details"].append(f"❌ 写入失败: {filename}\n   {str(e)}")
+            return False, f"写入失败: {str(e)}"
+
+    results["failed"] += 1
+    if not caption:
+        results["details"].append(f"❌ 生成失败: {filename}{token_note}")
+        return False, "生成失败"
+    error = f"质量检查未通过: {REASON_LABELS[reason]} ({len(caption)}字符)"
+    if reason == "banned":
+        error += f" {','.join(sorted(set(caption_validator.banned_terms(caption))))}"
+    results["details"].append(f"❌ {error}: {filename}{token_note}\n   {caption[:70]}")
+    return False, error
+
+
+def _model_identity() -> str:
+    """模型标识: 模型配置 + 权重文件大小 + 量化方式"""
+    model_dir = Path(model_path)
+    config_file = model_dir / "config.json"
+    return hash_context(
+        config=config_file.read_text(encoding="utf-8") if config_file.exists() else None,
+        weights=sorted((f.name, f.stat().st_size) for f in model_dir.glob("*.safetensors")),
+        use_4bit=global_use_4bit
+    )
+
+
+def _caption_context(model_identity: str) -> str:
+    """caption缓存上下文: prompt + 用户指令 + 生成参数 + 模型标识，任一变化则缓存失效"""
+    return hash_context(
+        prompt=_caption_prompt(),
+        instruction=CAPTION_INSTRUCTION,
+        generation=GENERATION_KWARGS,
+        max_new_tokens=300,
+        max_vision_tokens=global_max_vision_tokens,
+        early_stop=global_early_stop,
+        stop_at_newline=global_early_stop and global_stop_at_newline,
+        validator=caption_validator.settings(),
+        cpu_dtype=global_cpu_dtype if device == "cpu" else None,
+        model=model_identity
+    )
+
+
+def open_caption_cache(model_identity: str) -> Optional[CaptionCache]:
+    """打开caption缓存并设置本次运行的上下文 (禁用时返回None)"""
+    global caption_cache
+
+    if not global_caption_cache_path:
+        return None
+    try:
+        if caption_cache is None or caption_cache.db_path != global_caption_cache_path:
+            caption_cache = CaptionCache(global_caption_cache_path)
+        caption_cache.set_context(_caption_context(model_identity))
+    except Exception as e:
+        print(f"⚠️  caption缓存不可用，已跳过: {str(e)}")
+        caption_cache = None
+    return caption_cache
+
+
+def _lookup_cached(image_paths: List[str]):
+    """查询caption缓存，返回 (hashes, cached)：cached为 {下标: caption}
+
+    未通过当前质量检查的缓存结果 (如在更宽松的规则下写入) 视为未命中，重新生成后覆盖。
+    """
+    hashes: List[Optional[str]] = [None] * len(image_paths)
+    cached = {}
+    if caption_cache is None:
+        return hashes, cached
+
+    for idx, image_path in enumerate(image_paths):
+        try:
+            hashes[idx] = caption_cache.image_hash(image_path)
+        except OSError:
+            continue
+        hit = caption_cache.get(hashes[idx])
+        if hit and caption_validator.check(hit) is None:
+            cached[idx] = hit
+    return hashes, cached
+
+
+def _save_batch(pending: List[Tuple[str, str, str]], captions: List[Optional[str]], hashes: List[Optional[str]],
+                cached: dict, trigger_word: str, results: dict, vision_tokens: Optional[dict] = None,
+                elapsed: Optional[float] = None):
+    """写入一个批次的caption (缓存命中的直接复用)，新生成的caption回写缓存
+
+    vision_tokens为 {下标: 视觉token数}，用于报告中按图片展示；elapsed为批次生成耗时，按张均摊记入运行日志。
+    """
+    vision_tokens = vision_tokens or {}
+    generated = len(pending) - len(cached)
+    per_image = elapsed / generated if elapsed is not None and generated > 0 else None
+    for idx, (filename, _, txt_path) in enumerate(pending):
+        caption = cached.get(idx, captions[idx])
+        saved = _save_caption(filename, txt_path, caption, trigger_word, results, cached=idx in cached,
+                              vision_tokens=vision_tokens.get(idx), elapsed=0.0 if idx in cached else per_image)
+        if saved and idx not in cached and hashes[idx] and caption_cache is not None:
+            try:
+                caption_cache.put(hashes[idx], caption)
+            except Exception as e:
+                print(f"⚠️  caption缓存写入失败: {str(e)}")
+
+
+def estimate_vision_tokens(image_path: str) -> int:
+    """只读取图片头部尺寸 (不解码像素)，按视觉token预算与patch对齐规则估算视觉token数"""
+    try:
+        with Image.open(image_path) as img:
+            width, height = img.size
+    except Exception:
+        return 0
+
+    max_pixels = _max_image_pixels()
+    if max_pixels and width * height > max_pixels:
+        scale = (max_pixels / (width * height)) ** 0.5
+        width, height = width * scale, height * scale
+
+    image_processor = getattr(processor, "image_processor", None)
+    unit = getattr(image_processor, "patch_size", 16) * getattr(image_processor, "merge_size", 2)
+    return max(1, round(height / unit)) * max(1, round(width / unit))
+
+
+def _iter_pending(folder_path: str, image_files: Iterable[str], results: dict,
+                  leases: Optional[LeaseManager] = None, given_up: Optional[dict] = None):
+    """跳过已有描述文件 (及其他节点已认领、已超过重试上限) 的图片，逐个产出 (filename, image_path, txt_path)"""
+    for filename in image_files:
+        results["total"] += 1
+        image_path = os.path.join(folder_path, filename)
+        txt_path = os.path.splitext(image_path)[0] + '.txt'
+
+        if given_up and filename in given_up:
+            entry = given_up[filename]
+            results["skipped"] += 1
+            results["given_up"] = results.get("given_up", 0) + 1
+            results["details"].append(f"⏭ 跳过: {filename} (已失败{entry['failures']}次，超过重试上限: {entry['error']})")
+            continue
+
+        if _has_caption(txt_path):
+            results["skipped"] += 1
+            results["details"].append(f"⏭ 跳过: {filename} (已存在描述文件)")
+            continue
+
+        if leases is not None:
+            if not leases.claim(filename):
+                results["skipped"] += 1
+                results["details"].append(f"⏭ 跳过: {filename} (其他节点处理中)")
+                continue
+            # 认领前其他节点可能刚好完成
+            if _has_caption(txt_path):
+                leases.release(filename)
+                results["skipped"] += 1
+                results["details"].append(f"⏭ 跳过: {filename} (已存在描述文件)")
+                continue
+
+        yield filename, image_path, txt_path
+
+
+def _iter_pending_batches(folder_path: str, image_files: Iterable[str], batch_size: int, results: dict,
+                          leases: Optional[LeaseManager] = None, bucket_window: int = 64,
+                          given_up: Optional[dict] = None):
+    """按batch_size产出待打标批次 [(filename, image_path, txt_path), ...]
+
+    image_files可为边扫描边产出的迭代器，results["total"]随之累加。
+    leases不为None时，只产出本节点成功认领租约的图片。
+    batch_size > 1 且bucket_window > 0 时，每bucket_window张按估计视觉token数排序后组批，减少padding。
+    given_up为续跑时已超过重试上限的图片 ({filename: 历史记录})，直接跳过。
+    """
+    pending = _iter_pending(folder_path, image_files, results, leases=leases, given_up=given_up)
+    if batch_size > 1 and bucket_window > 0:
+        return bucket_batches(pending, batch_size, lambda p: estimate_vision_tokens(p[1]), window=bucket_window)
+    return fixed_batches(pending, batch_size)
+
+
+def _prepare_pending(pending: List[Tuple[str, str, str]]):
+    """预取线程任务: 查询caption缓存，对未命中的图片解码/校验/预处理"""
+    image_paths = [p[1] for p in pending]
+    hashes, cached = _lookup_cached(image_paths)
+
+    run_indices = [idx for idx in range(len(pending)) if idx not in cached]
+    inputs, valid_indices = None, []
+    if run_indices:
+        inputs, valid = prepare_caption_inputs([image_paths[idx] for idx in run_indices])
+        valid_indices = [run_indices[v] for v in valid]
+
+    padding = (0, 0)
+    if inputs is not None:
+        mask = inputs["attention_mask"]
+        padding = (int(mask.sum()), mask.numel())
+
+    return {"inputs": inputs, "valid_indices": valid_indices, "hashes": hashes, "cached": cached,
+            "vision_tokens": dict(zip(valid_indices, vision_token_counts(inputs))), "padding": padding}
+
+
+def _open_journal(folder_path: str, results: dict, use_journal: bool, max_retries: int, run_args: dict):
+    """打开本次运行日志，返回 (journal, given_up)
+
+    启用运行日志时先汇总该文件夹的历史运行日志，最近状态为失败且累计失败超过max_retries次的图片不再重试；
+    已成功的图片本就按描述文件跳过，因此中断后重新运行同一命令即从中断处继续。
+    """
+    journal = None
+    given_up = {}
+    if use_journal:
+        journal_dir = Config.get_journal_dir(folder_path)
+        given_up = exhausted_files(load_history(journal_dir), max_retries)
+        if given_up:
+            print(f"🔁 {len(given_up)} 张图片已超过重试上限 ({max_retries}次)，本次跳过")
+        try:
+            journal = RunJournal(journal_dir)
+            journal.write([run_header(run_args)])
+            results["journal"] = []
+        except OSError as e:
+            print(f"⚠️  运行日志不可用，已跳过: {str(e)}")
+    return journal, given_up
+
+
+def _flush_journal(journal: Optional[RunJournal], results: dict, records: Optional[List[dict]] = None):
+    """将results中累积的日志记录 (及额外records) 写入运行日志"""
+    if journal is None:
+        return
+    pending_records = results.get("journal", []) + (records or [])
+    results["journal"] = []
+    try:
+        journal.write(pending_records)
+    except OSError as e:
+        print(f"⚠️  运行日志写入失败: {str(e)}")
+
+
+def request_cancel() -> str:
+    """请求停止当前批量任务 (协作式: 当前批次完成后停止)"""
+    _cancel_event.set()
+    return "⏹️ 正在停止: 当前批次完成后停止，已完成的结果会保留..."
+
+
+def process_images(folder_path: str, trigger_word: str, use_4bit: bool = False, use_cpu: bool = False,
+                   batch_size: int = 1, prefetch_workers: int = 2, prefetch_depth: int = 4,
+                   shard: Optional[Tuple[int, int]] = None, use_lease: bool = False, lease_ttl: float = 600.0,
+                   dedup: Optional[str] = None, dedup_threshold: int = 6, recursive: bool = False,
+                   include: Optional[List[str]] = None, exclude: Optional[List[str]] = None, bucket_window: int = 64,
+                   use_journal: bool = True, max_retries: int = 2,
+                   metadata_path: Optional[str] = None, progress=None) -> str:
+    """批量处理图片文件夹，返回最终报告 (参数见process_images_stream)"""
+    report = ""
+    for report in process_images_stream(folder_path, trigger_word, use_4bit=use_4bit, use_cpu=use_cpu,
+                                        batch_size=batch_size, prefetch_workers=prefetch_workers,
+                                        prefetch_depth=prefetch_depth, shard=shard, use_lease=use_lease,
+                                        lease_ttl=lease_ttl, dedup=dedup, dedup_threshold=dedup_threshold,
+                                        recursive=recursive, include=include, exclude=exclude,
+                                        bucket_window=bucket_window, use_journal=use_journal,
+                                        max_retries=max_retries, metadata_path=metadata_path,
+                                        progress=progress):
+        pass
+    return report
+
+
+def process_images_stream(folder_path: str, trigger_word: str, use_4bit: bool = False, use_cpu: bool = False,
+                          batch_size: int = 1, prefetch_workers: int = 2, prefetch_depth: int = 4,
+                          shard: Optional[Tuple[int, int]] = None, use_lease: bool = False, lease_ttl: float = 600.0,
+                          dedup: Optional[str] = None, dedup_threshold: int = 6, recursive: bool = False,
+                          include: Optional[List[str]] = None, exclude: Optional[List[str]] = None,
+                          bucket_window: int = 64, use_journal: bool = True, max_retries: int = 2, metadata_path: Optional[str] = None,
+                          progress=None) -> Iterator[str]:
+    """批量处理图片文件夹 (生成器)，每完成一个批次产出进度文本，最后产出完整报告
+
+    batch_size > 1 时将N张图片合并为一次generate调用 (左侧padding)，显著提升GPU利用率。
+    图片解码/校验/预处理由prefetch_workers个后台线程提前完成，最多预取prefetch_depth个批次，
+    主线程只负责generate。
+    多节点共享同一文件夹时，shard=(i, N) 按文件名确定性分片，use_lease=True 按租约文件认领，
+    持有节点失效超过lease_ttl秒后租约可被回收。
+    dedup为 "share"/"flag" 时先按感知hash聚类近重复图片 (汉明距离 <= dedup_threshold)，只为每组代表打标，
+    其余成员复制代表的caption (share) 或仅在报告中标记 (flag)。
+    图片边扫描边打标 (recursive=True 时包含子目录，include/exclude为glob过滤)，无需先列出全部文件。
+    request_cancel() 后在当前批次完成时停止，释放显存并产出已完成部分的报告。
+    batch_size > 1 时每bucket_window张按图片头部尺寸估算视觉token数分桶组批，报告中给出padding效率。
+    每张图片的状态/耗时/视觉token数/生成token数/错误追加写入 cache/journal/ 下该文件夹的运行日志 (use_journal)，
+    历史失败次数超过max_retries的图片不再重试 (中断后重新运行即续跑)。
+    描述文件由后台线程原子写入 (临时文件+改名)；metadata_path不为None时另外汇总写入一份JSONL。
+    """
+    _cancel_event.clear()
+    if not folder_path or not folder_path.strip():
+        yield "❌ 错误: 请输入有效的文件夹路径"
+        return
+
+    folder_path = folder_path.strip()
+    if not os.path.isdir(folder_path):
+        yield f"❌ 错误: 路径 '{folder_path}' 不是有效文件夹"
+        return
+
+    batch_size = max(1, int(batch_size or 1))
+
+    image_files = _peek(_filter_shard(_iter_image_files(folder_path, recursive, include, exclude), shard))
+
+    if image_files is None:
+        yield f"⚠️ 警告: 在 '{folder_path}' 中未找到支持的图片文件"
+        return
+
+    image_files, dup_groups = _dedup_image_files(folder_path, image_files, dedup, dedup_threshold)
+    leases = LeaseManager(folder_path, ttl=lease_ttl) if use_lease else None
+
+    results = {
+        "total": 0,
+        "success": 0,
+        "failed": 0,
+        "skipped": 0,
+        "cached": 0,
+        "deduped": 0,
+        "real_tokens": 0,
+        "padded_tokens": 0,
+        "details": []
+    }
+    journal, given_up = _open_journal(folder_path, results, use_journal, max_retries,
+                                      {"mode": "pipeline", "batch_size": batch_size, "max_retries": max_retries})
+
+    run_start = time.time()
+
+    # 先确认有待打标的图片再加载模型，全部已有描述文件时无需导入torch/transformers
+    pending_batches = _peek(_iter_pending_batches(folder_path, image_files, batch_size, results, leases=leases,
+                                                  bucket_window=bucket_window, given_up=given_up))
+    if pending_batches is None:
+        print("⏭ 没有需要打标的图片，跳过模型加载")
+        pending_batches = iter(())
+    else:
+        yield "⏳ 正在加载模型..."
+        load_qwen3_model(use_4bit=use_4bit, use_cpu=use_cpu)
+        refresh_prompt_cache()
+        open_caption_cache(_model_identity())
+
+    pipeline = PrefetchPipeline(
+        pending_batches,
+        _prepare_pending,
+        num_workers=prefetch_workers,
+        queue_depth=prefetch_depth
+    )
+
+    metrics.gauge_fn("prefetch_queue_depth", pipeline.depth)
+    batches = iter(pipeline)
+    cancelled = False
+    _open_writer(metadata_path)
+    try:
+        for pending, prepared, error in batches:
+            if _cancel_event.is_set():
+                cancelled = True
+                print("\n⏹️  已请求停止，结束批量处理")
+                break
+
+            done = results["success"] + results["failed"] + results["skipped"]
+            if progress:
+                found = results["total"]
+                progress(done / found, desc=f"处理中 ({done + 1}/已发现{found}) - {pending[0][0]}")
+
+            if len(pending) == 1:
+                print(f"\n🖼️  处理: {pending[0][0]}")
+            else:
+                print(f"\n🖼️  批量处理 {len(pending)} 张: {', '.join(p[0] for p in pending)}")
+
+            image_paths = [p[1] for p in pending]
+            gen_start = time.time()
+            if error is not None:
+                print(f"⚠️  预处理失败: {str(error)}")
+                hashes, cached, vision_tokens = [None] * len(pending), {}, {}
+                captions = generate_chinese_captions_batch(image_paths)
+            else:
+                hashes, cached, vision_tokens = prepared["hashes"], prepared["cached"], prepared["vision_tokens"]
+                results["real_tokens"] += prepared["padding"][0]
+                results["padded_tokens"] += prepared["padding"][1]
+                if cached:
+                    print(f"♻️  缓存命中 {len(cached)} 张")
+                captions = _generate_prepared(image_paths, prepared["inputs"], prepared["valid_indices"])
+                captions = _quality_gate(image_paths, captions)
+
+            batch_elapsed = time.time() - gen_start
+            _save_batch(pending, captions, hashes, cached, trigger_word, results, vision_tokens, elapsed=batch_elapsed)
+            metrics.event("batch", images=len(pending), cached=len(cached), elapsed=round(batch_elapsed, 3),
+                          success=results["success"], failed=results["failed"], prefetch_depth=pipeline.depth())
+            _collect_write_errors(results)
+            _flush_journal(journal, results)
+            if leases is not None:
+                _release_written(leases, [p[0] for p in pending])
+                leases.refresh_if_due()
+
+            memory_governor.maybe_cleanup()
+
+            yield _build_progress(results, time.time() - run_start)
+
+        if not cancelled and dup_groups:
+            # 共享caption需读取代表图片的描述文件，先等待后台写入完成
+            caption_writer.flush()
+            _finish_duplicates(folder_path, dup_groups, dedup, results, leases=leases)
+    finally:
+        # 停止后台预取并丢弃已预处理的批次
+        batches.close()
+        _close_writer(results)
+        if leases is not None:
+            leases.release_all()
+        if journal is not None:
+            _flush_journal(journal, results)
+            journal.close()
+
+    run_time = time.time() - run_start
+    stall_pct = pipeline.stall_time / run_time * 100 if run_time > 0 else 0.0
+
+    timing = f"⏱️ 总耗时: {run_time:.1f}秒 | GPU等待输入: {pipeline.stall_time:.1f}秒 ({stall_pct:.1f}%)"
+    timing += memory_governor.summary()
+    if vision_cache is not None:
+        timing += vision_cache.summary()
+    if shard:
+        timing += f" | 分片: {shard[0]}/{shard[1]}"
+    title = "⏹️ 批量处理已停止 (已完成的结果已保存)" if cancelled else "🎉 批量处理完成!"
+    report = _build_report(results, folder_path, timing, title=title)
+
     if device == "cuda":
         torch.cuda.empty_cache()
     gc.collect()
 
+    yield report
+
+
+def _iter_pending_profiles(folder_path: str, image_files: Iterable[str], profile_names: List[str], results: dict):
+    """多提示词模式: 跳过全部提示词描述文件均已存在的图片，产出 (filename, image_path, {名称: txt_path})"""
+    for filename in image_files:
+        image_path = os.path.join(folder_path, filename)
+        stem = os.path.splitext(image_path)[0]
+        txt_paths = {name: f"{stem}.{name}.txt" for name in profile_names}
+        results["total"] += len(txt_paths)
+
+        existing = [name for name, txt_path in txt_paths.items() if _has_caption(txt_path)]
+        results["skipped"] += len(existing)
+        if len(existing) == len(txt_paths):
+            results["details"].append(f"⏭ 跳过: {filename} (已存在全部描述文件)")
+            continue
+        yield filename, image_path, {name: txt_paths[name] for name in profile_names if name not in existing}
+
+
+def _active_profiles(pending: list, profile_names: List[str]) -> List[int]:
+    """批次中至少有一张图片缺少其描述文件的提示词下标 (其余提示词整批跳过，不参与预处理与生成)"""
+    return [i for i, name in enumerate(profile_names) if any(name in txt_paths for _, _, txt_paths in pending)]
+
+
+def process_images_profiles(folder_path: str, trigger_word: str, profiles: List[Tuple[str, str]],
+                            use_4bit: bool = False, use_cpu: bool = False, batch_size: int = 1,
+                            prefetch_workers: int = 2, prefetch_depth: int = 4, recursive: bool = False,
+                            include: Optional[List[str]] = None, exclude: Optional[List[str]] = None,
+                            stub_model: bool = False, metadata_path: Optional[str] = None) -> str:
+    """多提示词一次打标: 每张图片按profiles中的每个 (名称, 提示词) 生成一份描述，写入 <图片名>.<名称>.txt
+
+    图片只解码、预处理一次，视觉编码结果在各提示词间共享，只有文本prefill与解码按提示词重复。
+    统计按描述文件计 (图片数 x 提示词数)，只生成缺失的描述文件: 批内全部图片都已有描述文件的提示词
+    不参与生成，质量检查与重试也只针对将要写入的caption。
+    """
+    if not folder_path or not folder_path.strip():
+        return "❌ 错误: 请输入有效的文件夹路径"
+
+    folder_path = folder_path.strip()
+    if not os.path.isdir(folder_path):
+        return f"❌ 错误: 路径 '{folder_path}' 不是有效文件夹"
+
+    image_files = _peek(_iter_image_files(folder_path, recursive, include, exclude))
+    if image_files is None:
+        return f"⚠️ 警告: 在 '{folder_path}' 中未找到支持的图片文件"
+
+    names = [name for name, _ in profiles]
+    prompts = [prompt for _, prompt in profiles]
+    results = {"total": 0, "success": 0, "failed": 0, "skipped": 0, "details": []}
+    run_start = time.time()
+
+    pending_batches = _peek(fixed_batches(_iter_pending_profiles(folder_path, image_files, names, results),
+                                          max(1, int(batch_size or 1))))
+    stub = None
+    if pending_batches is None:
+        print("⏭ 没有需要打标的图片，跳过模型加载")
+        pending_batches = iter(())
+    elif stub_model:
+        stub = StubCaptioner()
+    else:
+        load_qwen3_model(use_4bit=use_4bit, use_cpu=use_cpu)
+
+    def prepare(pending):
+        if stub is not None:
+            return None
+        return prepare_profile_inputs([p[1] for p in pending], [prompts[i] for i in _active_profiles(pending, names)])
+
+    pipeline = PrefetchPipeline(pending_batches, prepare, num_workers=prefetch_workers, queue_depth=prefetch_depth)
+    batches = iter(pipeline)
+    _open_writer(metadata_path)
+    try:
+        for pending, prepared, error in batches:
+            print(f"\n🖼️  处理 {len(pending)} 张 x {len(names)} 个提示词: {', '.join(p[0] for p in pending)}")
+            image_paths = [p[1] for p in pending]
+            active = _active_profiles(pending, names)
+            captions = [[None] * len(pending) for _ in names]
+            if stub is not None:
+                for i in active:
+                    captions[i] = stub.caption_batch(image_paths)
+            elif error is not None:
+                print(f"⚠️  预处理失败: {str(error)}")
+                for i in active:
+                    captions[i] = [generate_chinese_caption(path, prompt=prompts[i]) if names[i] in txt_paths else None
+                                   for _, path, txt_paths in pending]
+            else:
+                generated = generate_profile_captions(image_paths, [prompts[i] for i in active], *prepared)
+                for i, profile_captions in zip(active, generated):
+                    captions[i] = profile_captions
+
+            for i in active:
+                # 批量生成时已有描述文件的图片也会得到caption，丢弃后不做质量检查
+                captions[i] = [caption if names[i] in txt_paths else None
+                               for caption, (_, _, txt_paths) in zip(captions[i], pending)]
+                if stub is None:
+                    # 质量检查按提示词进行，未通过的图片用该提示词单独重新生成
+                    captions[i] = _quality_gate(image_paths, captions[i], prompt=prompts[i])
+
+            for name, profile_captions in zip(names, captions):
+                for (filename, _, txt_paths), caption in zip(pending, profile_captions):
+                    if name in txt_paths:
+                        _save_caption(f"{filename} [{name}]", txt_paths[name], caption, trigger_word, results)
+            _collect_write_errors(results)
+            memory_governor.maybe_cleanup()
+    finally:
+        batches.close()
+        _close_writer(results)
+
+    timing = f"⏱️ 总耗时: {time.time() - run_start:.1f}秒 | 提示词: {', '.join(names)}"
+    timing += memory_governor.summary()
+    report = _build_report(results, folder_path, timing, title="🎉 多提示词打标完成!")
+
+    if device == "cuda":
+        torch.cuda.empty_cache()
+    gc.collect()
     return report
 
 
+def _dp_worker_init(trigger_word: str, use_4bit: bool, use_cpu: bool, stub_model: bool,
+                    use_prompt_cache: bool = False, caption_cache_path: Optional[str] = None,
+                    verify_full: bool = False, use_snapshot: bool = False, max_vision_tokens: int = 0,
+                    vision_cache_dir: Optional[str] = None, vision_cache_gb: float = 20.0,
+                    early_stop: bool = True, stop_at_newline: bool = False,
+                    draft_model_path: Optional[str] = None, quality_retries: int = 2,
+                    ban_subjective: bool = False, cpu_dtype: str = "float32", cpu_threads: int = 0,
+                    cpu_interop_threads: int = 0, compile_model: bool = False):
+    """数据并行工作进程初始化: 加载本进程的模型副本，返回单批次处理函数"""
+    global global_use_prompt_cache, global_caption_cache_path, global_verify_full, global_use_snapshot
+    global global_max_vision_tokens, global_vision_cache_dir, global_vision_cache_gb, global_early_stop
+    global global_stop_at_newline, global_draft_model_path, global_quality_retries, global_ban_subjective
+    global caption_validator
+    global global_cpu_dtype, global_cpu_threads, global_cpu_interop_threads, global_compile
+    global_use_prompt_cache = use_prompt_cache
+    global_cpu_dtype = cpu_dtype
+    global_cpu_threads = cpu_threads
+    global_cpu_interop_threads = cpu_interop_threads
+    global_compile = compile_model
+    global_quality_retries = quality_retries
+    global_ban_subjective = ban_subjective
+    caption_validator = CaptionValidator(banned_terms=SUBJECTIVE_WORDS if ban_subjective else None)
+    global_early_stop = early_stop
+    global_stop_at_newline = stop_at_newline
+    global_draft_model_path = draft_model_path
+    global_vision_cache_dir = vision_cache_dir
+    global_vision_cache_gb = vision_cache_gb
+    global_max_vision_tokens = max_vision_tokens
+    global_verify_full = verify_full
+    global_use_snapshot = use_snapshot
+    global_caption_cache_path = caption_cache_path
+
+    if stub_model:
+        caption_batch = StubCaptioner().caption_batch
+        open_caption_cache("stub-model")
+    else:
+        load_qwen3_model(use_4bit=use_4bit, use_cpu=use_cpu)
+        caption_batch = generate_chinese_captions_batch
+        open_caption_cache(_model_identity())
+
+    def run_batch(pending: List[Tuple[str, str, str]]) -> dict:
+        batch_results = {"success": 0, "failed": 0, "cached": 0, "details": [], "journal": [], "writes": []}
+        image_paths = [p[1] for p in pending]
+        gen_start = time.time()
+        hashes, cached = _lookup_cached(image_paths)
+
+        captions: List[Optional[str]] = [None] * len(pending)
+        run_indices = [idx for idx in range(len(pending)) if idx not in cached]
+        if run_indices:
+            for idx, caption in zip(run_indices, caption_batch([image_paths[idx] for idx in run_indices])):
+                captions[idx] = caption
+
+        _save_batch(pending, captions, hashes, cached, trigger_word, batch_results,
+                    elapsed=time.time() - gen_start)
+        return batch_results
+
+    return run_batch
+
+
+def process_images_parallel(folder_path: str, trigger_word: str, use_4bit: bool = False, use_cpu: bool = False,
+                            batch_size: int = 1, num_workers: int = 0, stub_model: bool = False,
+                            shard: Optional[Tuple[int, int]] = None, use_lease: bool = False,
+                            lease_ttl: float = 600.0, dedup: Optional[str] = None, dedup_threshold: int = 6,
+                            recursive: bool = False, include: Optional[List[str]] = None,
+                            exclude: Optional[List[str]] = None, bucket_window: int = 64,
+                            use_journal: bool = True, max_retries: int = 2,
+                            metadata_path: Optional[str] = None):
+    """数据并行批量处理: 每个GPU一个工作进程 (各持一份模型副本)，共享同一任务队列
+
+    CPU模式或无GPU时启动num_workers个CPU工作进程 (默认2)；stub_model=True时使用桩模型并按CPU模式运行，
+    无需torch与模型权重即可验证调度流程。描述文件与运行日志由主进程的后台写入线程统一写入。
+    """
+    if not folder_path or not folder_path.strip():
+        return "❌ 错误: 请输入有效的文件夹路径"
+
+    folder_path = folder_path.strip()
+    if not os.path.isdir(folder_path):
+        return f"❌ 错误: 路径 '{folder_path}' 不是有效文件夹"
+
+    batch_size = max(1, int(batch_size or 1))
+
+    image_files = _peek(_filter_shard(_iter_image_files(folder_path, recursive, include, exclude), shard))
+    if image_files is None:
+        return f"⚠️ 警告: 在 '{folder_path}' 中未找到支持的图片文件"
+
+    image_files, dup_groups = _dedup_image_files(folder_path, image_files, dedup, dedup_threshold)
+
+    # 桩模型不需要torch，按CPU工作进程运行
+    gpu_ids = []
+    if not use_cpu and not stub_model:
+        _import_torch()
+        gpu_ids = visible_gpu_ids() if device == "cuda" else []
+    if gpu_ids:
+        devices = gpu_ids[:num_workers] if num_workers > 0 else gpu_ids
+    else:
+        num_workers = num_workers if num_workers > 0 else 2
+        # 真实模型时为每个工作进程划分互不重叠的CPU核 (线程数 = 核数)
+        devices = ["cpu"] * num_workers if stub_model else cpu_worker_devices(num_workers, global_cpu_threads)
+        use_cpu = True
+
+    results = {
+        "total": 0,
+        "success": 0,
+        "failed": 0,
+        "skipped": 0,
+        "cached": 0,
+        "deduped": 0,
+        "details": []
+    }
+    journal, given_up = _open_journal(folder_path, results, use_journal, max_retries,
+                                      {"mode": "data_parallel", "batch_size": batch_size, "workers": len(devices),
+                                       "max_retries": max_retries})
+    leases = LeaseManager(folder_path, ttl=lease_ttl) if use_lease else None
+    batches = _iter_pending_batches(folder_path, image_files, batch_size, results, leases=leases,
+                                    bucket_window=bucket_window, given_up=given_up)
+
+    print(f"🖥️  数据并行: {len(devices)} 个工作进程 ({', '.join('CPU' + d[3:] if d.startswith('cpu') else 'GPU' + d for d in devices)})")
+    run_start = time.time()
+
+    scheduler = DataParallelScheduler(
+        devices,
+        _dp_worker_init,
+        {"trigger_word": trigger_word, "use_4bit": use_4bit, "use_cpu": use_cpu, "stub_model": stub_model,
+         "use_prompt_cache": global_use_prompt_cache, "caption_cache_path": global_caption_cache_path,
+         "verify_full": global_verify_full, "use_snapshot": global_use_snapshot,
+         "max_vision_tokens": global_max_vision_tokens, "vision_cache_dir": global_vision_cache_dir,
+         "vision_cache_gb": global_vision_cache_gb, "early_stop": global_early_stop,
+         "stop_at_newline": global_stop_at_newline,
+         "draft_model_path": global_draft_model_path, "quality_retries": global_quality_retries,
+         "ban_subjective": global_ban_subjective, "cpu_dtype": global_cpu_dtype,
+         "cpu_threads": global_cpu_threads, "cpu_interop_threads": global_cpu_interop_threads,
+         "compile_model": global_compile}
+    )
+    ready = 0
+    _open_writer(metadata_path)
+    try:
+        for kind, wid, pending, payload in scheduler.run(batches):
+            if kind == "ready":
+                ready += 1
+                print(f"✅ 工作进程 {wid} 就绪 ({ready}/{len(devices)})")
+            elif kind == "error":
+                print(f"❌ 工作进程 {wid} 初始化失败: {payload}")
+            elif kind == "result":
+                results["success"] += payload["success"]
+                results["failed"] += payload["failed"]
+                results["cached"] += payload["cached"]
+                results["details"].extend(payload["details"])
+                # 工作进程未启用指标，由主进程按批次结果汇总 (成功/缓存命中在写入线程确认写入后计数)
+                metrics.inc("images_total", payload["failed"], status="failed")
+                metrics.event("batch", worker=wid, images=len(pending), success=payload["success"],
+                              cached=payload["cached"], failed=payload["failed"])
+                for write in payload["writes"]:
+                    caption_writer.submit(*write)
+                _collect_write_errors(results)
+                _flush_journal(journal, results, payload.get("journal"))
+                done = results["success"] + results["failed"]
+                print(f"📦 [worker {wid}] 完成 {len(pending)} 张 | 累计 {done} | 已发现 {results['total']}")
+            elif kind == "failed":
+                results["failed"] += len(pending)
+                metrics.inc("images_total", len(pending), status="failed")
+                results["details"].extend(f"❌ 生成失败: {p[0]} ({payload})" for p in pending)
+                _flush_journal(journal, results, [{"file": p[0], "status": "failed", "error": str(payload)}
+                                                  for p in pending])
+
+            if leases is not None:
+                _release_written(leases, [p[0] for p in pending or []])
+                leases.refresh_if_due()
+
+        if dup_groups:
+            caption_writer.flush()
+            _finish_duplicates(folder_path, dup_groups, dedup, results, leases=leases)
+    finally:
+        _close_writer(results)
+        if leases is not None:
+            leases.release_all()
+        if journal is not None:
+            _flush_journal(journal, results)
+            journal.close()
+
+    run_time = time.time() - run_start
+    processed = results["success"] + results["failed"]
+    throughput = processed / run_time if run_time > 0 else 0.0
+
+    timing = f"⏱️ 总耗时: {run_time:.1f}秒 | 数据并行: {len(devices)} 个工作进程 | {throughput:.2f} 张/秒"
+    if shard:
+        timing += f" | 分片: {shard[0]}/{shard[1]}"
+    return _build_report(results, folder_path, timing)
+
+
+def serve(host: str, port: int, use_4bit: bool = False, use_cpu: bool = False, stub_model: bool = False,
+          max_batch: int = 8, batch_window: float = 0.02, queue_size: int = 64, allowed_root: Optional[str] = None):
+    """无界面HTTP打标服务: 模型常驻，并发请求在batch_window秒内动态合批，队列满时返回429
+
+    与批量打标一样经过质量检查与重试，用尽重试仍未通过的caption返回422。
+    """
+    import uvicorn
+    from server import DynamicBatcher, create_app
+
+    if stub_model:
+        caption_batch = StubCaptioner().caption_batch
+    else:
+        load_qwen3_model(use_4bit=use_4bit, use_cpu=use_cpu)
+        refresh_prompt_cache()
+
+        def caption_batch(image_paths):
+            return _quality_gate(image_paths, generate_chinese_captions_batch(image_paths))
+
+    batcher = DynamicBatcher(caption_batch, max_batch=max_batch, window=batch_window, queue_size=queue_size)
+    print(f"🌐 打标服务: http://{host}:{port} | 合批上限 {batcher.max_batch} | 窗口 {batcher.window * 1000:.0f}ms | "
+          f"队列 {batcher.queue_size}")
+    if metrics.enabled:
+        print(f"📈 指标端点: http://{host}:{port}/metrics")
+    uvicorn.run(create_app(batcher, allowed_root=allowed_root, registry=metrics, validator=caption_validator),
+                host=host, port=port, log_level="warning")
+
+
+def enable_metrics(log_path: Optional[str] = None, port: int = 0, host: str = "127.0.0.1"):
+    """启用指标采集: 注册内存高水位仪表盘，log_path写结构化日志，port > 0 时启动独立 /metrics 端点"""
+    metrics.enable(log_path)
+    metrics.gauge_fn("process_rss_peak_bytes", peak_rss_bytes)
+    metrics.gauge_fn("gpu_memory_peak_bytes",
+                     lambda: torch.cuda.max_memory_allocated() if device == "cuda" else None)
+    metrics.gauge_fn("gpu_memory_allocated_bytes",
+                     lambda: torch.cuda.memory_allocated() if device == "cuda" else None)
+    if port:
+        serve_metrics(port, host=host)
+        print(f"📈 指标端点: http://{host}:{port}/metrics")
+    if log_path:
+        print(f"📝 结构化日志: {log_path}")
+
+
 def get_system_info():
     """获取系统信息"""
+    import platform
+    import psutil
+
     try:
+        _import_torch()
         gpu_info = "未检测到GPU"
         if device == "cuda":
             props = torch.cuda.get_device_properties(0)
@@ -597,6 +2388,8 @@ def get_system_info():
 
 def create_ui():
     """创建Gradio UI界面 (兼容Gradio 3.x/4.x)"""
+    import gradio as gr
+
     with gr.Blocks(title="XXG离线图片中文打标工具 Ver.2.3 (Qwen3-VL)") as demo:
         gr.Markdown("# 🖼️ Qwen3-VL 离线图片中文打标工具")
         gr.Markdown("### 100%中文caption生成 · 隐私安全 · 文生图训练专用")
@@ -633,6 +2426,14 @@ def create_ui():
                                 value=False,
                                 info="无GPU时使用"
                             )
+                            batch_size = gr.Slider(
+                                minimum=1,
+                                maximum=16,
+                                step=1,
+                                value=1,
+                                label="批处理大小",
+                                info="每次generate处理的图片数，显存充足时调大"
+                            )
 
                         output = gr.Textbox(label="📝 处理结果", lines=15, interactive=False)
 
@@ -644,15 +2445,16 @@ def create_ui():
         demo.load(fn=get_system_info, outputs=sys_info)
 
         process_btn.click(
-            fn=process_images,
-            inputs=[folder_input,trigger_word, use_4bit, use_cpu],
+            fn=process_images_stream,
+            inputs=[folder_input, trigger_word, use_4bit, use_cpu, batch_size],
             outputs=output,
-            show_progress="full"
+            show_progress="minimal"
         )
 
         stop_btn.click(
-            fn=lambda: "⏹️ 操作已停止",
-            outputs=output
+            fn=request_cancel,
+            outputs=output,
+            queue=False
         )
 
         gr.Markdown("### 📝 使用指南")
@@ -672,6 +2474,7 @@ def create_ui():
         1. 填写图片文件夹路径
         2. 低显存GPU：勾选"启用4-bit量化"
         3. 点击"🚀 开始生成中文caption"
+        4. 处理结果实时显示吞吐量与预计剩余时间，点击"🛑 停止"将在当前批次完成后停止
         """)
 
         gr.Markdown(
@@ -684,19 +2487,126 @@ def create_ui():
     return demo
 
 
+def _shard_arg(spec: str) -> Tuple[int, int]:
+    """argparse类型: 分片参数格式错误时作为命令行参数错误报告"""
+    try:
+        return parse_shard(spec)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def _profiles_arg(spec: str) -> List[Tuple[str, str]]:
+    """argparse类型: 提示词配置无效或提示文件不存在时作为命令行参数错误报告"""
+    try:
+        return Config.get_prompt_profiles(spec)
+    except (ValueError, OSError) as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
 def main():
     """主函数"""
-    global global_use_4bit
+    global global_use_4bit, global_use_prompt_cache, global_caption_cache_path, global_verify_full, global_use_snapshot
+    global global_max_vision_tokens, global_vision_cache_dir, global_vision_cache_gb, global_early_stop
+    global global_stop_at_newline, global_draft_model_path, global_quality_retries, global_ban_subjective
+    global caption_validator
+    global global_cpu_dtype, global_cpu_threads, global_cpu_interop_threads, global_compile
 
     parser = argparse.ArgumentParser(description='Qwen3-VL离线图片中文打标工具')
     parser.add_argument('--4bit', action='store_true', help='启用4-bit量化')
     parser.add_argument('--cpu', action='store_true', help='强制CPU模式')
-    parser.add_argument('--port', type=int, default=9527, help='Web UI端口')
+    parser.add_argument('--port', type=int, default=9527, help='Web UI端口 (--serve模式下为HTTP服务端口)')
+    parser.add_argument('--serve', action='store_true', help='启动无界面HTTP打标服务 (模型常驻，动态合批)')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='HTTP服务监听地址')
+    parser.add_argument('--max-batch', type=int, default=8, help='HTTP服务单次generate最多合并的请求数')
+    parser.add_argument('--batch-window-ms', type=float, default=20, help='HTTP服务合批等待窗口(毫秒)')
+    parser.add_argument('--queue-size', type=int, default=64, help='HTTP服务请求队列容量，满时返回429')
+    parser.add_argument('--serve-root', type=str, help='限制 /caption 只能访问该目录下的图片')
     parser.add_argument('--folder', type=str, help='直接处理文件夹')
     parser.add_argument('--trigger', type=str, help='默认触发词')
+    parser.add_argument('--batch-size', type=int, default=1, help='批处理大小 (每次generate处理的图片数)')
+    parser.add_argument('--bucket-window', type=int, default=64,
+                        help='按估计视觉token数分桶组批的前瞻窗口 (图片数)，减少padding；0为按扫描顺序组批')
+    parser.add_argument('--prefetch-workers', type=int, default=2, help='后台预处理线程数')
+    parser.add_argument('--prefetch-depth', type=int, default=4, help='预取队列深度 (批次数)')
+    parser.add_argument('--verify-full', action='store_true', help='忽略校验清单，强制深度验证模型文件 (含权重hash)')
+    parser.add_argument('--snapshot', action='store_true',
+                        help='使用模型快照: 首次加载后保存 (含4-bit量化结果)，之后直接从快照加载')
+    parser.add_argument('--max-vision-tokens', type=int, default=0,
+                        help='每张图片的视觉token预算 (如1280)，超出时解码阶段按比例缩小；默认0为不限制')
+    parser.add_argument('--no-early-stop', action='store_true',
+                        help='禁用caption感知停止条件 (句末超长/退化重复时提前结束生成)')
+    parser.add_argument('--stop-at-newline', action='store_true',
+                        help='停止条件额外在描述写满40字后遇到换行时结束 (仅适用于单段落提示词，多行提纲会被截断)')
+    parser.add_argument('--draft-model', type=str,
+                        help='辅助解码 (speculative decoding) 用的小号Qwen3-VL模型目录，需与主模型共用tokenizer；'
+                             '仅支持单张批次')
+    parser.add_argument('--quality-retries', type=int, default=2,
+                        help='caption质量检查 (长度/中文占比/重复/截断) 未通过时，按调整后的参数重新生成的最大次数')
+    parser.add_argument('--ban-subjective', action='store_true', help='质量检查同时拒绝含主观词 (美丽/非常等) 的caption')
+    parser.add_argument('--prompt-cache', action='store_true',
+                        help='启用系统提示词前缀KV缓存 (加载时自检，与完整prefill的贪心输出不一致则自动禁用)')
+    parser.add_argument('--cpu-dtype', choices=CPU_DTYPES, default='float32',
+                        help='CPU模式权重精度: float32 (约32GB内存) / bfloat16 (约16GB) / int8 (文本解码器动态量化)')
+    parser.add_argument('--cpu-threads', type=int, default=0,
+                        help='CPU intra-op线程数 (数据并行时为每个工作进程的线程数并绑定到独立的核；0为默认)')
+    parser.add_argument('--cpu-interop-threads', type=int, default=0, help='CPU inter-op线程数 (0为默认)')
+    parser.add_argument('--compile', action='store_true', help='使用torch.compile编译模型前向 (失败时自动回退)')
+    parser.add_argument('--data-parallel', action='store_true', help='数据并行: 每个GPU一个工作进程 (需配合--folder)')
+    parser.add_argument('--dp-workers', type=int, default=0, help='数据并行工作进程数 (默认: 全部可见GPU；CPU模式默认2)')
+    parser.add_argument('--stub-model', action='store_true', help='使用桩模型 (无需权重，用于测试调度流程)')
+    parser.add_argument('--caption-cache', type=str, default=Config.get_caption_cache_path(),
+                        help='caption缓存数据库路径 (按图片内容+prompt+参数+模型去重)')
+    parser.add_argument('--no-caption-cache', action='store_true', help='禁用caption缓存')
+    parser.add_argument('--vision-cache', type=str, nargs='?', const=Config.get_vision_cache_dir(),
+                        help='启用视觉编码缓存 (可指定目录): 换提示词/生成参数重新打标时跳过图片预处理与视觉编码')
+    parser.add_argument('--vision-cache-gb', type=float, default=20.0, help='视觉编码缓存容量上限(GB)，超出按最近使用淘汰')
+    parser.add_argument('--dedup', choices=DEDUP_MODES,
+                        help='近重复图片预处理: share=每组只打标代表图片并复制caption, flag=只打标代表图片并在报告中标记其余')
+    parser.add_argument('--dedup-threshold', type=int, default=6, help='近重复判定阈值 (64位感知hash汉明距离)')
+    parser.add_argument('--recursive', action='store_true', help='递归处理子目录 (边扫描边打标)')
+    parser.add_argument('--include', action='append', help='只处理匹配的文件 (glob，匹配相对路径或文件名，可重复)')
+    parser.add_argument('--exclude', action='append', help='排除匹配的文件/目录 (glob，可重复)')
+    parser.add_argument('--shard', type=_shard_arg, help='多节点分片 i/N (按文件名hash确定性划分，i从0开始)')
+    parser.add_argument('--lease', action='store_true', help='多节点租约认领 (共享文件系统上按图片认领，互不重复)')
+    parser.add_argument('--lease-ttl', type=float, default=600, help='租约过期时间(秒)，超时未心跳的租约可被回收')
+    parser.add_argument('--max-retries', type=int, default=2,
+                        help='按运行日志，单张图片跨运行的最大重试次数 (超过后不再重试)')
+    parser.add_argument('--no-journal', action='store_true', help='不读写运行日志 (cache/journal/)，失败的图片每次都重试')
+    parser.add_argument('--profiles', type=_profiles_arg,
+                        help='多提示词一次打标 (需配合--folder): 内置 general/font/logo 或 名称=提示词文件，逗号分隔；'
+                             '描述写入 <图片名>.<名称>.txt')
+    parser.add_argument('--metadata-jsonl', type=str,
+                        help='另外将本次生成的caption汇总追加写入该JSONL文件 ({"file", "caption"}每行一条)')
+    parser.add_argument('--metrics', action='store_true',
+                        help='启用指标采集 (--serve模式下在服务端口提供 /metrics)')
+    parser.add_argument('--metrics-port', type=int, default=0,
+                        help='在该端口启动独立的 /metrics 端点 (Prometheus文本格式，适用于界面/批处理模式)')
+    parser.add_argument('--metrics-log', type=str, help='结构化日志 (JSONL) 输出路径')
     args = parser.parse_args()
 
     global_use_4bit = args.__dict__['4bit']
+    global_use_prompt_cache = args.prompt_cache
+    global_verify_full = args.verify_full
+    global_use_snapshot = args.snapshot
+    global_max_vision_tokens = args.max_vision_tokens
+    global_caption_cache_path = None if args.no_caption_cache else args.caption_cache
+    global_vision_cache_dir = args.vision_cache
+    global_early_stop = not args.no_early_stop
+    global_stop_at_newline = args.stop_at_newline
+    global_draft_model_path = args.draft_model
+    global_quality_retries = max(0, args.quality_retries)
+    global_ban_subjective = args.ban_subjective
+    global_cpu_dtype = args.cpu_dtype
+    global_cpu_threads = max(0, args.cpu_threads)
+    global_cpu_interop_threads = max(0, args.cpu_interop_threads)
+    global_compile = args.compile
+    if args.ban_subjective:
+        caption_validator = CaptionValidator(banned_terms=SUBJECTIVE_WORDS)
+    if args.draft_model and (args.batch_size > 1 or args.max_batch > 1):
+        print("⚠️  辅助解码仅支持单张批次，批处理大小与HTTP服务合批上限设为1")
+        args.batch_size = args.max_batch = 1
+    global_vision_cache_gb = args.vision_cache_gb
+    shard = args.shard
 
     if args.__dict__['4bit']:
         print("⚡ 启动4-bit量化模式")
@@ -710,14 +2620,55 @@ def main():
     print("✅ 100%中文caption生成 | ✅ 本地模型化")
     print("=" * 70)
 
-    check_system_resources()
+    if args.metrics or args.metrics_port or args.metrics_log:
+        enable_metrics(args.metrics_log, port=args.metrics_port, host=args.host)
+
+    if args.serve:
+        serve(args.host, args.port, use_4bit=args.__dict__['4bit'], use_cpu=args.cpu, stub_model=args.stub_model,
+              max_batch=args.max_batch, batch_window=args.batch_window_ms / 1000, queue_size=args.queue_size,
+              allowed_root=args.serve_root)
+        return
+
+    if args.folder and args.profiles:
+        profiles = args.profiles
+        print(f"\n📁 多提示词处理文件夹: {args.folder} ({', '.join(name for name, _ in profiles)})")
+        result = process_images_profiles(args.folder, args.trigger, profiles, use_4bit=args.__dict__['4bit'],
+                                         use_cpu=args.cpu, batch_size=args.batch_size,
+                                         prefetch_workers=args.prefetch_workers, prefetch_depth=args.prefetch_depth,
+                                         recursive=args.recursive, include=args.include, exclude=args.exclude,
+                                         stub_model=args.stub_model, metadata_path=args.metadata_jsonl)
+        print("\n" + result)
+        return
+
+    if args.folder and (args.data_parallel or args.stub_model):
+        print(f"\n📁 数据并行处理文件夹: {args.folder}")
+        result = process_images_parallel(args.folder, args.trigger, use_4bit=args.__dict__['4bit'], use_cpu=args.cpu,
+                                         batch_size=args.batch_size, num_workers=args.dp_workers,
+                                         stub_model=args.stub_model, shard=shard, use_lease=args.lease,
+                                         lease_ttl=args.lease_ttl, dedup=args.dedup,
+                                         dedup_threshold=args.dedup_threshold, recursive=args.recursive,
+                                         include=args.include, exclude=args.exclude, bucket_window=args.bucket_window,
+                                         use_journal=not args.no_journal,
+                                         max_retries=args.max_retries, metadata_path=args.metadata_jsonl)
+        print("\n" + result)
+        return
 
     if args.folder:
         print(f"\n📁 直接处理文件夹: {args.folder}")
-        result = process_images(args.folder,args.trigger, use_4bit=args.__dict__['4bit'], use_cpu=args.cpu)
+        result = process_images(args.folder, args.trigger, use_4bit=args.__dict__['4bit'], use_cpu=args.cpu,
+                                batch_size=args.batch_size, prefetch_workers=args.prefetch_workers,
+                                prefetch_depth=args.prefetch_depth, shard=shard, use_lease=args.lease,
+                                lease_ttl=args.lease_ttl, dedup=args.dedup, dedup_threshold=args.dedup_threshold,
+                                recursive=args.recursive, include=args.include, exclude=args.exclude,
+                                bucket_window=args.bucket_window, use_journal=not args.no_journal,
+                                max_retries=args.max_retries,
+                                metadata_path=args.metadata_jsonl)
         print("\n" + result)
         return
 
+    import gradio as gr
+
+    check_system_resources()
     demo = create_ui()
     demo.launch(
         server_name="127.0.0.1",
@@ -0,0 +1,480 @@
+# bench_caption.py
+"""打标吞吐/延迟基准: 固定工作负载，输出分阶段耗时、吞吐量、延迟分位数与峰值内存
+
+    python bench_caption.py --dataset datasets/demo --batch-size 4 --output bench.json
+    python bench_caption.py --synthetic 32 --sizes 512x512,1920x1080 --stub-model --cpu
+    python bench_caption.py --synthetic 4 --sizes 256x256 --cpu --skip-verify \
+        --model-path tiny_models/target --draft-model tiny_models/draft
+
+批次经由与批量打标相同的预取流水线、显存调控、质量检查与后台写入线程处理，分阶段耗时取自
+metrics.stage: decode (图片解码) / preprocess (processor) / generate (prefill+逐token生成) /
+postprocess (解码+清洗) / write (原子写入描述文件)；generate再拆为 prefill (至首个token的logits) 与
+decode_tokens (其余token)，解码速度按 (新token数-1)/decode_tokens耗时 计算，不受prompt长度影响。
+结果以JSON输出 (--output)，便于跨版本对比回归；--stub-model 使用桩模型，无需模型权重。
+caption缓存、运行日志等默认写入临时缓存目录 (结束后删除)，--cache-dir 可指定保留的目录。
+指定 --draft-model 时同一工作负载先后以普通解码与辅助解码各跑一遍，分别给出tokens/秒与加速比
+(可用 tiny_model.py 生成的随机小模型在CPU上验证流程)。
+--cpu-configs 在独立子进程中依次测量多种CPU配置 (精度/线程数/torch.compile)，汇总对比:
+
+    python bench_caption.py --cpu-configs float32:32,bfloat16:32,int8:32,int8:32:compile --output cpu.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+STAGES = ("decode", "preprocess", "prefill", "decode_tokens", "generate", "postprocess", "write")
+
+
+def _parse_sizes(spec: str) -> List[tuple]:
+    try:
+        return [tuple(int(v) for v in size.lower().split("x")) for size in spec.split(",") if size.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"尺寸格式错误: '{spec}'，应为 WxH[,WxH...]，例如 512x512,1920x1080")
+
+
+def make_synthetic_dataset(num_images: int, sizes: List[tuple]) -> str:
+    """生成确定性的合成JPEG数据集 (Mandelbrot纹理 + 渐变，内容固定可复现)"""
+    from PIL import Image
+
+    folder = tempfile.mkdtemp(prefix="bench_caption_")
+    for i in range(num_images):
+        width, height = sizes[i % len(sizes)]
+        extent = (-2.0 + 0.01 * i, -1.2, 0.8, 1.2)
+        texture = Image.effect_mandelbrot((width, height), extent, 64)
+        red = Image.linear_gradient("L").resize((width, height))
+        blue = Image.radial_gradient("L").resize((width, height))
+        Image.merge("RGB", (red, texture, blue)).save(os.path.join(folder, f"{i:05d}.jpg"), quality=90)
+    return folder
+
+
+def _list_images(folder: str, limit: int) -> List[str]:
+    import app
+
+    names = sorted(app._iter_image_files(folder))
+    if limit > 0:
+        names = names[:limit]
+    return [os.path.join(folder, name) for name in names]
+
+
+def _parse_cpu_configs(spec: str) -> List[dict]:
+    """ "int8:16:compile,bfloat16:32" -> [{"dtype", "threads", "compile"}, ...]"""
+    from cpu_backend import CPU_DTYPES
+
+    configs = []
+    for item in (part.strip() for part in spec.split(",")):
+        if not item:
+            continue
+        fields = item.split(":")
+        if fields[0] not in CPU_DTYPES or len(fields) > 3 or (len(fields) == 3 and fields[2] != "compile"):
+            raise argparse.ArgumentTypeError(f"CPU配置格式错误: '{item}'，应为 精度[:线程数][:compile]，精度为 {'/'.join(CPU_DTYPES)}")
+        try:
+            threads = int(fields[1]) if len(fields) > 1 and fields[1] else 0
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"CPU配置线程数错误: '{item}'")
+        configs.append({"dtype": fields[0], "threads": threads, "compile": len(fields) == 3})
+    return configs
+
+
+def _without_options(argv: List[str], names: tuple) -> List[str]:
+    """从命令行参数中去掉指定的带值选项 (--name value 或 --name=value)"""
+    result, skip = [], False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg in names:
+            skip = True
+        elif arg.split("=", 1)[0] not in names:
+            result.append(arg)
+    return result
+
+
+def compare_cpu_configs(configs: List[dict], argv: List[str]) -> dict:
+    """每种CPU配置在独立子进程中运行一次基准 (内存峰值与inter-op线程数互不影响)，返回汇总"""
+    base = [sys.executable, os.path.abspath(__file__)] + _without_options(argv, ("--cpu-configs", "--output"))
+    entries = []
+    for config in configs:
+        fd, out_path = tempfile.mkstemp(prefix="bench_cpu_", suffix=".json")
+        os.close(fd)
+        cmd = base + ["--cpu", "--cpu-dtype", config["dtype"], "--cpu-threads", str(config["threads"]),
+                      "--output", out_path] + (["--compile"] if config["compile"] else [])
+        label = f"{config['dtype']}:{config['threads'] or '默认'}{':compile' if config['compile'] else ''}"
+        print(f"\n🧪 CPU配置 {label}")
+        try:
+            proc = subprocess.run(cmd)
+            if proc.returncode != 0:
+                entries.append({"config": config, "error": f"退出码 {proc.returncode}"})
+                continue
+            with open(out_path, encoding="utf-8") as f:
+                report = json.load(f)
+        finally:
+            os.remove(out_path)
+        entries.append({"config": config, "results": report["results"], "peak_memory": report["peak_memory"],
+                        "environment": report["environment"]})
+    return {"benchmark": "caption_cpu_configs", "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "configs": entries}
+
+
+def _percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    pos = (len(ordered) - 1) * pct / 100
+    low = int(pos)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (pos - low)
+
+
+def _peak_memory(torch_module) -> Dict[str, Optional[float]]:
+    """峰值内存 (MB): 进程常驻内存与GPU已分配显存"""
+    peak = {"rss_mb": None, "gpu_mb": None}
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux单位为KB，macOS为字节
+        peak["rss_mb"] = round(rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024, 1)
+    except ImportError:
+        pass
+    if torch_module is not None and torch_module.cuda.is_available():
+        peak["gpu_mb"] = round(torch_module.cuda.max_memory_allocated() / 1024 / 1024, 1)
+    return peak
+
+
+class _Runner:
+    """按批执行一次完整打标，走与批量打标相同的路径:
+
+    后台预取 (_prepare_pending: 解码/预处理/视觉缓存查询) -> _generate_prepared (显存调控、前缀KV缓存) ->
+    _quality_gate -> _save_batch (校验后交给后台写入线程)。分阶段耗时取自metrics.stage的记录。
+    """
+
+    def __init__(self, args, write_dir: str):
+        import app
+
+        self.app = app
+        self.write_dir = write_dir
+        self.max_new_tokens = args.max_new_tokens
+        self.prefetch_workers = args.prefetch_workers
+        self.prefetch_depth = args.prefetch_depth
+        self.stub = None
+        self.torch = None
+        app.metrics.enable()
+        if args.stub_model:
+            from stub_model import StubCaptioner
+            self.stub = StubCaptioner(delay=args.stub_delay)
+        else:
+            app.load_qwen3_model(use_4bit=args.__dict__['4bit'], use_cpu=args.cpu)
+            app.refresh_prompt_cache()
+            self.torch = app.torch
+            self.torch.manual_seed(args.seed)
+            if app.device == "cuda":
+                self.torch.cuda.reset_peak_memory_stats()
+
+    def _prepare(self, pending: List[tuple]):
+        start = time.perf_counter()
+        if self.stub is not None:
+            # 桩模型自行读取图片，只需计入解码耗时
+            max_pixels = self.app._max_image_pixels()
+            for _, path, _ in pending:
+                with self.app.metrics.stage("decode"):
+                    self.app._open_image(path, max_pixels)
+            return start, None
+        return start, self.app._prepare_pending(pending)
+
+    def _caption(self, image_paths: List[str], prepared, error) -> tuple:
+        """返回 (captions, hashes, cached)"""
+        app = self.app
+        if self.stub is not None:
+            with app.metrics.stage("generate"):
+                captions = self.stub.caption_batch(image_paths)
+            return captions, [None] * len(image_paths), {}
+        if error is not None:
+            print(f"⚠️  预处理失败: {str(error)}")
+            captions = app.generate_chinese_captions_batch(image_paths, max_new_tokens=self.max_new_tokens)
+            return captions, [None] * len(image_paths), {}
+        captions = app._generate_prepared(image_paths, prepared["inputs"], prepared["valid_indices"],
+                                          max_new_tokens=self.max_new_tokens)
+        captions = app._quality_gate(image_paths, captions, max_new_tokens=self.max_new_tokens)
+        return captions, prepared["hashes"], prepared["cached"]
+
+    def run(self, batches: List[List[str]]) -> List[dict]:
+        """依次处理全部批次并等待写入完成，返回每批记录 (延迟为开始预处理到提交写入)"""
+        app = self.app
+        pending_batches = [[(os.path.basename(path), path,
+                             os.path.join(self.write_dir, os.path.splitext(os.path.basename(path))[0] + ".txt"))
+                            for path in batch] for batch in batches]
+        results = {"success": 0, "failed": 0, "details": []}
+        records = []
+        pipeline = app.PrefetchPipeline(pending_batches, self._prepare, num_workers=self.prefetch_workers,
+                                        queue_depth=self.prefetch_depth)
+        app._open_writer(None)
+        try:
+            for pending, prepared, error in pipeline:
+                start, prepared = prepared if error is None else (time.perf_counter(), None)
+                failed = results["failed"]
+                captions, hashes, cached = self._caption([p[1] for p in pending], prepared, error)
+                app._save_batch(pending, captions, hashes, cached, "", results)
+                app._collect_write_errors(results)
+                records.append({"images": len(pending), "failed": results["failed"] - failed,
+                                "latency": time.perf_counter() - start})
+        finally:
+            app._close_writer(results)
+        # 关闭写入线程时才发现的写入失败计入最后一批
+        if records:
+            records[-1]["failed"] += results["failed"] - sum(r["failed"] for r in records)
+        return records
+
+    def totals(self) -> dict:
+        """当前累计的各阶段耗时、生成token数、生成样本数与prefill次数 (测量前后相减得到本次测量的值)"""
+        metrics = self.app.metrics
+        stages = {stage: metrics.histogram_total("stage_seconds", stage=stage)[1] for stage in STAGES}
+        rows, tokens = metrics.histogram_total("generated_tokens")
+        return {"stages": stages, "tokens": int(tokens), "rows": rows,
+                "prefills": metrics.histogram_total("stage_seconds", stage="prefill")[0]}
+
+
+def summarize(records: List[dict], wall_time: float, stage_times: Dict[str, float], tokens: int,
+              rows: int = 0, prefills: int = 0) -> dict:
+    """汇总各批次记录: 吞吐量、单图延迟分位数、各阶段耗时与生成速度
+
+    rows为生成的样本数 (每个样本的首个token计入prefill)，prefills为记录到首token时间的generate次数；
+    桩模型不经过generate，两者为0，解码速度与prefill耗时为None。
+    """
+    images = sum(r["images"] for r in records)
+    # 同批图片共同经历整批延迟
+    latencies = [r["latency"] for r in records for _ in range(r["images"])]
+    stages = {}
+    for stage in STAGES:
+        total = stage_times[stage]
+        stages[stage] = {"total_s": round(total, 4), "per_image_ms": round(total / images * 1000, 2) if images else None}
+    generate_time = stage_times["generate"]
+    decode_time = stage_times["decode_tokens"]
+    decode_tokens = tokens - rows
+    return {
+        "images": images,
+        "failed": sum(r["failed"] for r in records),
+        "batches": len(records),
+        "wall_time_s": round(wall_time, 4),
+        "images_per_sec": round(images / wall_time, 3) if wall_time > 0 else None,
+        "latency_ms": {f"p{p}": round(_percentile(latencies, p) * 1000, 2) if latencies else None
+                       for p in (50, 95, 99)},
+        "generated_tokens": tokens,
+        "tokens_per_sec": round(tokens / generate_time, 2) if tokens and generate_time > 0 else None,
+        "decode_tokens_per_sec": round(decode_tokens / decode_time, 2) if rows and decode_tokens > 0 and decode_time > 0 else None,
+        "prefill_ms_mean": round(stage_times["prefill"] / prefills * 1000, 2) if prefills else None,
+        "stages": stages,
+    }
+
+
+def _measure(runner: _Runner, batches: List[List[str]], warmup: int, repeat: int) -> dict:
+    if warmup > 0:
+        runner.run((batches * warmup)[:warmup])
+
+    before = runner.totals()
+    start = time.perf_counter()
+    records = runner.run(batches * max(1, repeat))
+    wall_time = time.perf_counter() - start
+    after = runner.totals()
+    stage_times = {stage: after["stages"][stage] - before["stages"][stage] for stage in STAGES}
+    return summarize(records, wall_time, stage_times, after["tokens"] - before["tokens"],
+                     after["rows"] - before["rows"], after["prefills"] - before["prefills"])
+
+
+def _environment(runner: _Runner, args) -> dict:
+    import app
+
+    env = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "model": "stub" if args.stub_model else app.model_path,
+        "device": "cpu" if args.stub_model else app.device,
+    }
+    if runner.torch is not None:
+        env["torch"] = runner.torch.__version__
+        if app.device == "cuda":
+            env["gpu"] = runner.torch.cuda.get_device_properties(0).name
+    try:
+        import transformers
+        env["transformers"] = transformers.__version__
+    except ImportError:
+        pass
+    return env
+
+
+def _print_cpu_comparison(summary: dict, output: Optional[str]):
+    print(f"\n{'配置':<24}{'张/秒':>10}{'解码tokens/秒':>14}{'prefill(ms)':>13}{'p50(ms)':>12}{'RSS峰值(MB)':>14}")
+    for entry in summary["configs"]:
+        config = entry["config"]
+        label = f"{config['dtype']}:{config['threads'] or '默认'}{':compile' if config['compile'] else ''}"
+        if "error" in entry:
+            print(f"{label:<24}{entry['error']:>10}")
+            continue
+        results = entry["results"]
+        print(f"{label:<24}{str(results['images_per_sec']):>10}{str(results['decode_tokens_per_sec']):>14}"
+              f"{str(results['prefill_ms_mean']):>13}{str(results['latency_ms']['p50']):>12}"
+              f"{str(entry['peak_memory']['rss_mb']):>14}")
+
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        print(f"💾 结果已保存: {output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="打标吞吐/延迟基准")
+    parser.add_argument("--dataset", type=str, default=os.path.join("datasets", "demo"), help="图片文件夹")
+    parser.add_argument("--synthetic", type=int, default=0, help="改用N张合成图片 (确定性内容)")
+    parser.add_argument("--sizes", type=_parse_sizes, default=[(1024, 1024)],
+                        help="合成图片尺寸 WxH[,WxH...]，按顺序循环使用")
+    parser.add_argument("--limit", type=int, default=0, help="最多使用的图片数 (0为全部)")
+    parser.add_argument("--batch-size", type=int, default=1, help="每次generate的图片数")
+    parser.add_argument("--prefetch-workers", type=int, default=2, help="后台预处理线程数")
+    parser.add_argument("--prefetch-depth", type=int, default=4, help="预取队列深度 (批次)")
+    parser.add_argument("--warmup", type=int, default=1, help="预热批次数 (不计入结果)")
+    parser.add_argument("--repeat", type=int, default=1, help="完整遍历数据集的次数")
+    parser.add_argument("--max-new-tokens", type=int, default=300, help="生成token上限")
+    parser.add_argument("--max-vision-tokens", type=int, default=0, help="每张图片的视觉token预算 (默认0为不限制)")
+    parser.add_argument("--seed", type=int, default=0, help="采样随机种子")
+    parser.add_argument("--4bit", action="store_true", help="启用4-bit量化")
+    parser.add_argument("--cpu", action="store_true", help="强制使用CPU")
+    parser.add_argument("--stub-model", action="store_true", help="使用桩模型 (无需权重，CPU即可运行)")
+    parser.add_argument("--stub-delay", type=float, default=0.05, help="桩模型每张图片的模拟生成耗时(秒)")
+    parser.add_argument("--model-path", type=str, help="模型目录 (默认使用app.py的模型目录)")
+    parser.add_argument("--draft-model", type=str, help="辅助解码草稿模型目录: 额外以辅助解码再跑一遍并对比")
+    parser.add_argument("--skip-verify", action="store_true", help="跳过模型文件完整性验证 (随机初始化的小模型)")
+    parser.add_argument("--no-early-stop", action="store_true", help="禁用caption感知停止条件")
+    parser.add_argument("--prompt-cache", action="store_true", help="启用系统提示词前缀KV缓存")
+    parser.add_argument("--stop-at-newline", action="store_true", help="停止条件额外在段落换行处结束")
+    parser.add_argument("--cpu-dtype", choices=("float32", "bfloat16", "int8"), default="float32",
+                        help="CPU模式权重精度")
+    parser.add_argument("--cpu-threads", type=int, default=0, help="CPU intra-op线程数 (0为默认)")
+    parser.add_argument("--cpu-interop-threads", type=int, default=0, help="CPU inter-op线程数 (0为默认)")
+    parser.add_argument("--compile", action="store_true", help="使用torch.compile编译模型前向")
+    parser.add_argument("--cpu-configs", type=_parse_cpu_configs,
+                        help="依次对比多种CPU配置: 精度[:线程数][:compile]，逗号分隔 (每种配置独立子进程)")
+    parser.add_argument("--output", type=str, help="结果JSON输出路径 (默认只打印到stdout)")
+    parser.add_argument("--cache-dir", type=str, help="缓存目录 (默认使用临时目录，结束后删除)")
+    args = parser.parse_args()
+
+    if args.cpu_configs:
+        _print_cpu_comparison(compare_cpu_configs(args.cpu_configs, sys.argv[1:]), args.output)
+        return
+
+    # 须在导入app (及config) 之前设置
+    cache_dir = args.cache_dir or tempfile.mkdtemp(prefix="bench_caption_cache_")
+    os.environ["CAPTION_CACHE_DIR"] = cache_dir
+    import app
+
+    app.global_cpu_dtype = args.cpu_dtype
+    app.global_cpu_threads = args.cpu_threads
+    app.global_cpu_interop_threads = args.cpu_interop_threads
+    app.global_compile = args.compile
+
+    app.global_max_vision_tokens = args.max_vision_tokens
+    app.global_skip_verify = args.skip_verify
+    app.global_early_stop = not args.no_early_stop
+    app.global_stop_at_newline = args.stop_at_newline
+    app.global_use_prompt_cache = args.prompt_cache
+    if args.model_path:
+        app.model_path = args.model_path
+    if args.draft_model and not args.stub_model:
+        app.global_draft_model_path = args.draft_model
+        if args.batch_size > 1:
+            print("⚠️  辅助解码仅支持单张批次，batch_size设为1")
+            args.batch_size = 1
+    if args.cpu:
+        app.device = "cpu"
+
+    synthetic_dir = make_synthetic_dataset(args.synthetic, args.sizes) if args.synthetic > 0 else None
+    write_dir = tempfile.mkdtemp(prefix="bench_caption_out_")
+    try:
+        paths = _list_images(synthetic_dir or args.dataset, args.limit)
+        if not paths:
+            print(f"❌ 未找到图片: {synthetic_dir or args.dataset}")
+            sys.exit(1)
+
+        batch_size = max(1, args.batch_size)
+        batches = [paths[i:i + batch_size] for i in range(0, len(paths), batch_size)]
+        runner = _Runner(args, write_dir)
+
+        # 先以普通解码测量，加载了草稿模型时再以辅助解码测量同一工作负载
+        draft = app.draft_model
+        app.draft_model = None
+        results = _measure(runner, batches, args.warmup, args.repeat)
+        assisted = None
+        if draft is not None:
+            app.draft_model = draft
+            if runner.torch is not None:
+                runner.torch.manual_seed(args.seed)
+            assisted = _measure(runner, batches, args.warmup, args.repeat)
+            # 辅助解码只加速prefill之后的逐token生成，加速比按解码速度计算
+            base_rate, rate = results["decode_tokens_per_sec"], assisted["decode_tokens_per_sec"]
+            assisted["speedup"] = round(rate / base_rate, 3) if base_rate and rate else None
+
+        report = {
+            "benchmark": "caption",
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "config": {
+                "dataset": "synthetic" if synthetic_dir else args.dataset,
+                "sizes": [f"{w}x{h}" for w, h in args.sizes] if synthetic_dir else None,
+                "images": len(paths),
+                "batch_size": batch_size,
+                "prefetch_workers": args.prefetch_workers,
+                "prefetch_depth": args.prefetch_depth,
+                "warmup": args.warmup,
+                "repeat": args.repeat,
+                "max_new_tokens": args.max_new_tokens,
+                "max_vision_tokens": args.max_vision_tokens,
+                "seed": args.seed,
+                "use_4bit": args.__dict__['4bit'],
+                "early_stop": app.global_early_stop,
+                "stop_at_newline": app.global_stop_at_newline,
+                "prompt_cache": args.prompt_cache,
+                "cpu_dtype": args.cpu_dtype if app.device == "cpu" else None,
+                "cpu_threads": runner.torch.get_num_threads() if runner.torch is not None and app.device == "cpu" else None,
+                "compile": args.compile,
+                "draft_model": args.draft_model if assisted is not None else None,
+            },
+            "environment": _environment(runner, args),
+            "results": results,
+            "assisted": assisted,
+            "peak_memory": _peak_memory(runner.torch),
+        }
+    finally:
+        shutil.rmtree(write_dir, ignore_errors=True)
+        if synthetic_dir:
+            shutil.rmtree(synthetic_dir, ignore_errors=True)
+        if not args.cache_dir:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+    results = report["results"]
+    print(f"\n📊 {results['images']} 张 | {results['batches']} 批 | 吞吐量 {results['images_per_sec']} 张/秒")
+    latency = results["latency_ms"]
+    print(f"⏱️ 延迟: p50 {latency['p50']}ms | p95 {latency['p95']}ms | p99 {latency['p99']}ms")
+    if results["tokens_per_sec"]:
+        print(f"🔤 生成速度: {results['tokens_per_sec']} tokens/秒 ({results['generated_tokens']} tokens)")
+    if results["decode_tokens_per_sec"]:
+        print(f"⚡ prefill: 平均 {results['prefill_ms_mean']} ms/批 | 解码速度: {results['decode_tokens_per_sec']} tokens/秒")
+    assisted = report["assisted"]
+    if assisted is not None:
+        print(f"🚀 辅助解码: {assisted['decode_tokens_per_sec']} tokens/秒 ({assisted['generated_tokens']} tokens) | "
+              f"加速比 {assisted['speedup']} | 吞吐量 {assisted['images_per_sec']} 张/秒")
+    for stage, stat in results["stages"].items():
+        print(f"   {stage:<14} {stat['per_image_ms']:>10} ms/张")
+    peak = report["peak_memory"]
+    print(f"🧠 峰值内存: RSS {peak['rss_mb']} MB | GPU {peak['gpu_mb']} MB")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 结果已保存: {args.output}")
+    else:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# bench_startup.py
+"""启动耗时基准: 跟踪 --help、import app 与"全部已有描述文件"的 --folder 运行耗时
+
+    python bench_startup.py --repeat 5 --max-seconds 1.5
+
+同时检查 import app 后是否意外导入了重量级依赖 (torch/transformers/gradio等)，
+任一项超出 --max-seconds 或出现重量级导入时以非零状态退出，可用于CI回归检查。
+子进程的缓存目录 (CAPTION_CACHE_DIR) 指向临时目录，运行日志等不写入项目的 cache/。
+"""
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+HEAVY_MODULES = ("torch", "transformers", "gradio", "fastapi", "uvicorn", "huggingface_hub", "numpy", "psutil")
+
+
+def _time_command(args, repeat: int, env: dict) -> float:
+    """运行命令repeat次，返回耗时中位数 (秒)"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(args, cwd=APP_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def _heavy_imports(env: dict) -> list:
+    """import app 后已加载的重量级模块"""
+    code = f"import sys, app; print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    out = subprocess.run([sys.executable, "-c", code], cwd=APP_DIR, env=env, capture_output=True, text=True,
+                         check=True)
+    return [m for m in out.stdout.strip().split(",") if m]
+
+
+def _make_captioned_folder(num_images: int) -> str:
+    """构造一个所有图片都已有描述文件的临时数据集"""
+    from PIL import Image
+
+    folder = tempfile.mkdtemp(prefix="bench_startup_")
+    for i in range(num_images):
+        Image.new("RGB", (64, 64), (i % 256, 0, 0)).save(os.path.join(folder, f"{i:05d}.png"))
+        with open(os.path.join(folder, f"{i:05d}.txt"), "w", encoding="utf-8") as f:
+            f.write("已存在的描述")
+    return folder
+
+
+def main():
+    parser = argparse.ArgumentParser(description="启动耗时基准")
+    parser.add_argument("--repeat", type=int, default=5, help="每项重复次数 (取中位数)")
+    parser.add_argument("--images", type=int, default=200, help="--folder场景的图片数")
+    parser.add_argument("--max-seconds", type=float, default=0, help="任一项中位耗时超过该值则失败 (0为不检查)")
+    args = parser.parse_args()
+
+    folder = _make_captioned_folder(args.images)
+    cache_dir = tempfile.mkdtemp(prefix="bench_startup_cache_")
+    env = {**os.environ, "CAPTION_CACHE_DIR": cache_dir}
+    try:
+        results = {
+            "python -c pass (基线)": _time_command([sys.executable, "-c", "pass"], args.repeat, env),
+            "import app": _time_command([sys.executable, "-c", "import app"], args.repeat, env),
+            "app.py --help": _time_command([sys.executable, "app.py", "--help"], args.repeat, env),
+            f"app.py --folder (全部已打标, {args.images}张)": _time_command(
+                [sys.executable, "app.py", "--folder", folder, "--no-caption-cache"], args.repeat, env),
+        }
+        heavy = _heavy_imports(env)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    failed = False
+    for name, seconds in results.items():
+        over = args.max_seconds > 0 and seconds > args.max_seconds
+        failed |= over
+        print(f"{'❌' if over else '✅'} {name:<40} {seconds * 1000:8.0f} ms")
+
+    if heavy:
+        failed = True
+        print(f"❌ import app 导入了重量级依赖: {', '.join(heavy)}")
+    else:
+        print("✅ import app 未导入重量级依赖")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+# bucketing.py
+from typing import Any, Callable, Iterable, Iterator, List
+
+
+def fixed_batches(items: Iterable[Any], batch_size: int) -> Iterator[List[Any]]:
+    """按到达顺序每batch_size个组成一批"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def bucket_batches(items: Iterable[Any], batch_size: int, cost_fn: Callable[[Any], int],
+                   window: int = 64) -> Iterator[List[Any]]:
+    """按估计长度分桶组批，减少批内padding
+
+    每积累window个元素按cost_fn排序，相邻 (长度相近) 的元素组成一批；
+    不足一批的剩余元素留到下一窗口继续参与排序，输入结束时全部产出。
+    window限制了前瞻数量，对边扫描边产出的输入同样适用。
+    """
+    window = max(batch_size, int(window))
+    buffer = []
+    for item in items:
+        buffer.append((cost_fn(item), item))
+        if len(buffer) < window:
+            continue
+
+        buffer.sort(key=lambda x: x[0])
+        full = len(buffer) - len(buffer) % batch_size
+        for start in range(0, full, batch_size):
+            yield [item for _, item in buffer[start:start + batch_size]]
+        buffer = buffer[full:]
+
+    buffer.sort(key=lambda x: x[0])
+    for start in range(0, len(buffer), batch_size):
+        yield [item for _, item in buffer[start:start + batch_size]]
@@ -0,0 +1,108 @@
+# caption_cache.py
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def hash_file(path: str) -> str:
+    """计算文件内容hash (blake2b)"""
+    h = hashlib.blake2b(digest_size=32)
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def hash_context(**parts) -> str:
+    """对生成上下文 (prompt/生成参数/模型标识等) 计算稳定hash"""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CaptionCache:
+    """持久化内容寻址caption缓存 (SQLite)
+
+    键为 图片内容hash + 生成上下文hash (prompt/生成参数/模型标识)，
+    同一张图片被重命名、复制到其他数据集后仍可直接命中；prompt或参数变化则自然失效。
+    文件路径+大小+mtime到内容hash的映射也一并缓存，未改动的文件无需重复计算hash。
+    可被多个线程/进程同时使用 (WAL模式)。
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.context = ""
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS captions ("
+            "image_hash TEXT NOT NULL, context TEXT NOT NULL, caption TEXT NOT NULL, created_at REAL NOT NULL, "
+            "PRIMARY KEY (image_hash, context))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS file_hashes ("
+            "path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, image_hash TEXT NOT NULL)"
+        )
+
+    def set_context(self, context: str) -> None:
+        """设置当前生成上下文hash (每次运行开始时调用)"""
+        self.context = context
+
+    def image_hash(self, path: str) -> str:
+        """获取图片内容hash，文件未变化时直接复用已记录的hash"""
+        abs_path = os.path.abspath(path)
+        st = os.stat(abs_path)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT image_hash FROM file_hashes WHERE path = ? AND size = ? AND mtime_ns = ?",
+                (abs_path, st.st_size, st.st_mtime_ns)
+            ).fetchone()
+        if row:
+            return row[0]
+
+        image_hash = hash_file(abs_path)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO file_hashes (path, size, mtime_ns, image_hash) VALUES (?, ?, ?, ?)",
+                (abs_path, st.st_size, st.st_mtime_ns, image_hash)
+            )
+        return image_hash
+
+    def get(self, image_hash: str) -> Optional[str]:
+        """查询缓存caption，未命中返回None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT caption FROM captions WHERE image_hash = ? AND context = ?",
+                (image_hash, self.context)
+            ).fetchone()
+            if row:
+                self.hits += 1
+                return row[0]
+            self.misses += 1
+            return None
+
+    def put(self, image_hash: str, caption: str) -> None:
+        """写入caption (不含触发词)"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO captions (image_hash, context, caption, created_at) VALUES (?, ?, ?, ?)",
+                (image_hash, self.context, caption, time.time())
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
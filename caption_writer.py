@@ -0,0 +1,153 @@
+# caption_writer.py
+import json
+import os
+import queue
+import tempfile
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from metrics import metrics
+
+_FLUSH = object()
+
+
+def atomic_write_text(path: str, text: str, fsync: bool = True) -> None:
+    """先写同目录临时文件再原子改名: 任何时刻path要么不存在，要么是完整内容"""
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(prefix="." + os.path.basename(path) + ".", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def fsync_dir(directory: str) -> None:
+    """fsync目录，使其中的改名/新建持久化 (Windows不支持目录fsync，跳过)"""
+    if os.name == "nt":
+        return
+    fd = os.open(directory or ".", os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class CaptionWriter:
+    """后台caption写入线程: 原子写入描述文件，不占用生成线程
+
+    submit放入有界队列 (队列满时阻塞，形成背压)；写入失败记录在errors中，由主线程drain_errors取回。
+    submit指定status时，写入成功后才计入 images_total{status}，写入失败的caption不会被记为成功。
+    文件内容在改名前fsync，目录fsync按fsync_every个文件或fsync_interval秒批量执行。
+    metadata_path不为None时，同时追加写一份汇总JSONL ({"file", "caption"})，供偏好单文件的训练流程使用。
+    """
+
+    def __init__(self, metadata_path: Optional[str] = None, fsync_every: int = 256, fsync_interval: float = 5.0,
+                 queue_size: int = 1024):
+        self.fsync_every = max(1, int(fsync_every))
+        self.fsync_interval = fsync_interval
+        self.written = 0
+        self._queue = queue.Queue(maxsize=max(1, int(queue_size)))
+        self._errors: List[Tuple[str, str]] = []
+        self._errors_lock = threading.Lock()
+        self._dirty_dirs = set()
+        self._unsynced = 0
+        self._last_sync = time.time()
+        self._metadata = None
+        if metadata_path:
+            os.makedirs(os.path.dirname(os.path.abspath(metadata_path)), exist_ok=True)
+            self._metadata = open(metadata_path, "a", encoding="utf-8")
+        self._thread = threading.Thread(target=self._loop, name="caption-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, filename: str, txt_path: str, text: str, status: Optional[str] = None) -> None:
+        self._queue.put((filename, txt_path, text, status))
+
+    def pending(self) -> int:
+        """队列中等待写入的caption数"""
+        return self._queue.qsize()
+
+    def flush(self) -> None:
+        """等待已提交的caption全部写入并持久化"""
+        self._queue.put(_FLUSH)
+        self._queue.join()
+
+    def drain_errors(self) -> List[Tuple[str, str]]:
+        """取回 (filename, 错误信息) 列表并清空"""
+        with self._errors_lock:
+            errors, self._errors = self._errors, []
+        return errors
+
+    def close(self) -> None:
+        if not self._thread.is_alive():
+            return
+        self._queue.put(None)
+        self._thread.join()
+        if self._metadata is not None:
+            self._metadata.close()
+
+    def _loop(self) -> None:
+        while True:
+            try:
+                item = self._queue.get(timeout=self.fsync_interval)
+            except queue.Empty:
+                self._sync()
+                continue
+            try:
+                if item is None or item is _FLUSH:
+                    self._sync()
+                    if item is None:
+                        return
+                else:
+                    self._write(*item)
+            finally:
+                self._queue.task_done()
+
+    def _write(self, filename: str, txt_path: str, text: str, status: Optional[str]) -> None:
+        try:
+            with metrics.stage("write"):
+                atomic_write_text(txt_path, text)
+        except Exception as e:
+            with self._errors_lock:
+                self._errors.append((filename, str(e)))
+            return
+
+        self.written += 1
+        if status:
+            metrics.inc("images_total", status=status)
+        self._dirty_dirs.add(os.path.dirname(txt_path))
+        if self._metadata is not None:
+            try:
+                self._metadata.write(json.dumps({"file": filename, "caption": text}, ensure_ascii=False) + "\n")
+            except OSError as e:
+                print(f"⚠️  汇总文件写入失败: {str(e)}")
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_every or time.time() - self._last_sync >= self.fsync_interval:
+            self._sync()
+
+    def _sync(self) -> None:
+        if not self._unsynced:
+            return
+        if self._metadata is not None:
+            try:
+                self._metadata.flush()
+                os.fsync(self._metadata.fileno())
+            except OSError as e:
+                print(f"⚠️  汇总文件同步失败: {str(e)}")
+        for directory in self._dirty_dirs:
+            try:
+                fsync_dir(directory)
+            except OSError as e:
+                print(f"⚠️  目录同步失败 {directory}: {str(e)}")
+        self._dirty_dirs.clear()
+        self._unsynced = 0
+        self._last_sync = time.time()
@@ -1,17 +1,81 @@
 # config.py
+import hashlib
 import os
 
 
 class Config:
     """配置管理类"""
     BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+    PROMPT_FILE = 'prompt_cn_font.txt'
+    # 多提示词模式的内置配置: 名称 -> 提示词文件
+    PROMPT_PROFILES = {
+        'general': 'prompt.txt',
+        'font': 'prompt_cn_font.txt',
+        'logo': 'prompt_cn_logo.txt',
+    }
+    # 环境变量CAPTION_CACHE_DIR可改用其他缓存目录 (测试与基准脚本指向临时目录，不污染项目缓存)
+    CACHE_DIR = os.environ.get('CAPTION_CACHE_DIR') or os.path.join(BASE_DIR, 'cache')
+
+    @classmethod
+    def get_caption_prompt_path(cls):
+        """获取CAPTION_PROMPT文件路径"""
+        return os.path.join(cls.BASE_DIR, cls.PROMPT_FILE)
 
     @classmethod
     def get_caption_prompt(cls):
         """获取CAPTION_PROMPT"""
-        prompt_path = os.path.join(cls.BASE_DIR, 'prompt_cn_font.txt')
+        prompt_path = cls.get_caption_prompt_path()
         if not os.path.exists(prompt_path):
             raise FileNotFoundError(f"提示文件 {prompt_path} 不存在")
 
         with open(prompt_path, 'r', encoding='utf-8') as f:
-            return f.read()
\ No newline at end of file
+            return f.read()
+
+    @classmethod
+    def get_prompt_profiles(cls, spec):
+        """解析提示词配置列表 "font,logo" 或 "名称=文件路径"，返回 [(名称, 提示词)]"""
+        profiles = []
+        for item in (part.strip() for part in spec.split(',')):
+            if not item:
+                continue
+            if '=' in item:
+                name, path = (x.strip() for x in item.split('=', 1))
+            elif item in cls.PROMPT_PROFILES:
+                name, path = item, cls.PROMPT_PROFILES[item]
+            else:
+                raise ValueError(f"未知的提示词配置: '{item}' (内置: {', '.join(cls.PROMPT_PROFILES)}，或使用 名称=文件路径)")
+            if not name or any(c in name for c in '/\\.'):
+                raise ValueError(f"提示词配置名称无效: '{name}'")
+            if any(name == existing for existing, _ in profiles):
+                raise ValueError(f"提示词配置名称重复: '{name}'")
+
+            prompt_path = path if os.path.isabs(path) or os.path.exists(path) else os.path.join(cls.BASE_DIR, path)
+            if not os.path.exists(prompt_path):
+                raise FileNotFoundError(f"提示文件 {prompt_path} 不存在")
+            with open(prompt_path, 'r', encoding='utf-8') as f:
+                profiles.append((name, f.read()))
+        if not profiles:
+            raise ValueError("至少需要一个提示词配置")
+        return profiles
+
+    @classmethod
+    def get_caption_cache_path(cls):
+        """获取caption缓存数据库路径"""
+        return os.path.join(cls.CACHE_DIR, 'captions.sqlite')
+
+    @classmethod
+    def get_vision_cache_dir(cls):
+        """获取视觉编码缓存目录"""
+        return os.path.join(cls.CACHE_DIR, 'vision')
+
+    @classmethod
+    def get_journal_dir(cls, folder_path):
+        """获取图片文件夹对应的运行日志目录 (按文件夹绝对路径区分，不写入数据集目录)"""
+        real_path = os.path.realpath(folder_path)
+        digest = hashlib.sha1(real_path.encode('utf-8')).hexdigest()[:12]
+        return os.path.join(cls.CACHE_DIR, 'journal', f"{os.path.basename(real_path) or 'root'}-{digest}")
+
+    @classmethod
+    def get_model_manifest_path(cls):
+        """获取模型校验清单路径"""
+        return os.path.join(cls.CACHE_DIR, 'model_manifest.json')
@@ -0,0 +1,110 @@
+# cpu_backend.py
+import os
+from typing import List, Optional
+
+from memory_governor import is_oom_error
+
+CPU_DTYPES = ("float32", "bfloat16", "int8")
+
+
+def available_cores() -> List[int]:
+    """当前进程可用的CPU核编号 (遵循taskset/cgroup限制)"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def cpu_worker_devices(num_workers: int, threads: int = 0) -> List[str]:
+    """为CPU数据并行划分互不重叠的核: 返回 "cpu:<核列表>" 设备名 (DataParallelScheduler据此绑核)
+
+    threads为每个工作进程的线程数，0为平均分配全部可用核；可用核不足时不绑核，返回 "cpu"。
+    """
+    cores = available_cores()
+    per_worker = threads if threads > 0 else max(1, len(cores) // num_workers)
+    if per_worker * num_workers > len(cores):
+        print(f"⚠️  可用CPU核 ({len(cores)}) 不足 {num_workers}x{per_worker}，工作进程不绑核")
+        return ["cpu"] * num_workers
+    return ["cpu:" + ",".join(str(c) for c in cores[i * per_worker:(i + 1) * per_worker]) for i in range(num_workers)]
+
+
+def parse_cpu_device(dev: str) -> Optional[List[int]]:
+    """ "cpu:0,1,2" -> [0, 1, 2]；"cpu" 或非CPU设备返回None"""
+    if not dev.startswith("cpu:"):
+        return None
+    return [int(c) for c in dev[4:].split(",") if c]
+
+
+def configure_threads(intra_op: int = 0, inter_op: int = 0) -> str:
+    """设置torch的intra-op/inter-op线程数 (0为保持默认)，返回当前配置描述
+
+    inter-op线程池只能在首次并行计算前设置，之后设置失败时保持原值。
+    """
+    import torch
+
+    if intra_op > 0:
+        torch.set_num_threads(intra_op)
+    if inter_op > 0:
+        try:
+            torch.set_num_interop_threads(inter_op)
+        except RuntimeError:
+            print("⚠️  inter-op线程数只能在首次并行计算前设置，保持当前值")
+    return f"intra-op {torch.get_num_threads()} / inter-op {torch.get_num_interop_threads()}"
+
+
+def quantize_int8(model):
+    """对文本解码器的Linear层做int8动态量化 (权重int8，激活按批动态量化)
+
+    模型以bfloat16加载，逐层转为float32后立即量化，峰值内存不超过bfloat16模型加一层float32；
+    量化算子只接受float32激活，因此embedding/norm/lm_head转为float32。
+    视觉塔每张图片只运行一次，保持bfloat16 (输出在合入文本序列时转换精度)。
+    """
+    import torch
+
+    language_model = model.model.language_model
+    for layer in language_model.layers:
+        layer.float()
+        torch.ao.quantization.quantize_dynamic(layer, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    language_model.float()
+    model.lm_head.float()
+    return model
+
+
+def _compile_errors() -> tuple:
+    """torch.compile自身的异常类型 (dynamo追踪/后端编译失败)，随torch版本存在与否"""
+    errors = []
+    try:
+        from torch._dynamo.exc import TorchDynamoException
+        errors.append(TorchDynamoException)
+    except ImportError:
+        pass
+    try:
+        from torch._inductor.exc import InductorError
+        errors.append(InductorError)
+    except ImportError:
+        pass
+    return tuple(errors)
+
+
+def compile_forward(model):
+    """torch.compile包装model.forward (动态形状)；编译失败时自动回退为eager模式
+
+    只有dynamo/inductor的编译错误才永久回退；内存不足、输入错误等运行时异常照常抛出，由调用方处理。
+    """
+    import torch
+
+    eager = model.forward
+    compile_errors = _compile_errors()
+    state = {"forward": torch.compile(eager, dynamic=True)}
+
+    def forward(*args, **kwargs):
+        try:
+            return state["forward"](*args, **kwargs)
+        except compile_errors as e:
+            if state["forward"] is eager or is_oom_error(e):
+                raise
+            print(f"⚠️  torch.compile失败，回退为eager模式: {str(e).splitlines()[0] if str(e) else type(e).__name__}")
+            state["forward"] = eager
+            return eager(*args, **kwargs)
+
+    model.forward = forward
+    return model
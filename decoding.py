@@ -0,0 +1,125 @@
+# decoding.py
+import time
+from typing import Callable, List, Optional
+
+SENTENCE_ENDS = ("。", "！", "？", ".", "!", "?")
+# 中文caption约每个字一个token: 软上限取max_new_tokens的该比例，留出收尾一句的余量
+SOFT_LIMIT_RATIO = 0.75
+
+
+def soft_char_limit(max_new_tokens: int, min_chars: int = 40) -> int:
+    """按max_new_tokens推算的软字符上限 (固定值会与token上限相当，生成满被截断前几乎不会触发)"""
+    return max(min_chars, int(max_new_tokens * SOFT_LIMIT_RATIO))
+
+
+def repetition_period(tokens: List[int], max_period: int = 16, min_span: int = 24, min_repeats: int = 3) -> int:
+    """序列末尾是否陷入循环: 返回重复周期 (token数)，未检测到返回0
+
+    周期p的片段需在末尾连续出现至少min_repeats次，且重复部分总长不少于min_span个token
+    (避免把"哈哈哈"之类的短叠词误判为退化)。
+    """
+    n = len(tokens)
+    for period in range(1, max_period + 1):
+        repeats = max(min_repeats, -(-min_span // period))
+        span = period * repeats
+        if span > n:
+            break
+        tail = tokens[n - span:]
+        if tail == tail[:period] * repeats:
+            return period
+    return 0
+
+
+class FirstTokenTimer:
+    """作为logits processor挂入generate，记录首次调用的时间 (prefill完成、即将选出第一个新token)
+
+    sync在记录前同步设备 (GPU异步执行时，否则记录的只是排队时间)。
+    """
+
+    def __init__(self, sync: Optional[Callable[[], None]] = None):
+        self.sync = sync
+        self.time: Optional[float] = None
+
+    def __call__(self, input_ids, scores):
+        if self.time is None:
+            if self.sync is not None:
+                self.sync()
+            self.time = time.perf_counter()
+        return scores
+
+
+class CaptionStoppingCriteria:
+    """caption感知的停止条件 (作为stopping_criteria挂入generate，按行判断)
+
+    - 超过soft_max_chars个字符后遇到句末标点: 在完整句子处停止，不再等max_new_tokens截断
+      (soft_max_chars应明显小于max_new_tokens，见soft_char_limit)
+    - 末尾token陷入循环 (repetition_period): 退化重复，停止
+    - stop_at_newline=True 时 (默认关闭，多行提纲式提示词会被截成一行)，已生成至少min_chars个字符后
+      出现换行即视为描述段落完整，停止
+    字符数按行增量解码统计: 从上次完整解码的位置起解码尾部全部token，结尾为不完整字符 (U+FFFD，
+    一个汉字被拆成多个字节级token) 时暂不计入，等后续token补全。
+    各行停止原因记录在row_reasons，并计入reasons。
+    """
+
+    def __init__(self, tokenizer, prompt_len: int, min_chars: int = 40, soft_max_chars: int = 300,
+                 max_period: int = 16, min_span: int = 24, min_repeats: int = 3, stop_at_newline: bool = False):
+        self.tokenizer = tokenizer
+        self.prompt_len = prompt_len
+        self.min_chars = min_chars
+        self.soft_max_chars = soft_max_chars
+        self.max_period = max_period
+        self.min_span = min_span
+        self.min_repeats = min_repeats
+        self.stop_at_newline = stop_at_newline
+        self.reasons = {"complete": 0, "length": 0, "repetition": 0}
+        self._seen = prompt_len
+        self.row_reasons: List[Optional[str]] = []
+        self._chars: List[int] = []
+        self._pending: List[List[int]] = []
+
+    def __call__(self, input_ids, scores, **kwargs):
+        import torch
+
+        rows = input_ids.shape[0]
+        if not self._chars:
+            self._chars = [0] * rows
+            self._pending = [[] for _ in range(rows)]
+            self.row_reasons = [None] * rows
+
+        new_tokens = input_ids[:, self._seen:].tolist()
+        self._seen = input_ids.shape[1]
+        window = max(self.min_span + self.max_period, self.max_period * self.min_repeats)
+        tails = input_ids[:, max(self.prompt_len, input_ids.shape[1] - window):].tolist()
+
+        for row in range(rows):
+            if self.row_reasons[row] is not None:
+                continue
+            reason = self._check(row, new_tokens[row], tails[row])
+            if reason:
+                self.row_reasons[row] = reason
+                self.reasons[reason] += 1
+        return torch.tensor([reason is not None for reason in self.row_reasons], dtype=torch.bool,
+                            device=input_ids.device)
+
+    def _check(self, row: int, tokens: List[int], tail: List[int]) -> Optional[str]:
+        # 辅助解码一步可能接受多个token；尾部解码出完整字符后才计入字符数
+        pending = self._pending[row]
+        pending.extend(tokens)
+        text = self.tokenizer.decode(pending, skip_special_tokens=True)
+        if not text.endswith("\ufffd"):
+            pending.clear()
+            before = self._chars[row]
+            self._chars[row] += len(text)
+            if self.stop_at_newline and "\n" in text and before + text.index("\n") >= self.min_chars:
+                return "complete"
+            if self._chars[row] >= self.soft_max_chars and text.rstrip().endswith(SENTENCE_ENDS):
+                return "length"
+        if repetition_period(tail, self.max_period, self.min_span, self.min_repeats):
+            return "repetition"
+        return None
+
+    def trim(self, row: int, text: str) -> str:
+        """去掉停止时多生成的部分: 段落完整停止时丢弃最后一个换行之后的内容"""
+        if self.row_reasons and self.row_reasons[row] == "complete" and "\n" in text:
+            return text.rsplit("\n", 1)[0]
+        return text
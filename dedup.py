@@ -0,0 +1,130 @@
+# dedup.py
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+HASH_SIZE = 8
+HASH_SAMPLE = 32
+HASH_CHUNK = 256
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    """正交DCT-II变换矩阵"""
+    k = np.arange(n)[:, None]
+    x = np.arange(n)[None, :]
+    mat = np.cos(np.pi * (2 * x + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    mat[0] /= np.sqrt(2.0)
+    return mat.astype(np.float32)
+
+
+_DCT = _dct_matrix(HASH_SAMPLE)
+_BIT_WEIGHTS = (1 << np.arange(HASH_SIZE * HASH_SIZE - 1, -1, -1, dtype=np.uint64)).astype(np.uint64)
+
+
+def _load_thumbnail(path: str) -> Optional[Tuple[np.ndarray, int]]:
+    """解码并缩放为32x32灰度图，返回 (像素, 原图面积)；无法解码返回None"""
+    try:
+        with Image.open(path) as img:
+            area = img.size[0] * img.size[1]
+            # JPEG按1/2~1/8比例直接解码，避免完整解码大图
+            img.draft("L", (HASH_SAMPLE * 4, HASH_SAMPLE * 4))
+            thumb = img.convert("L").resize((HASH_SAMPLE, HASH_SAMPLE), Image.BILINEAR)
+            return np.asarray(thumb, dtype=np.float32), area
+    except Exception:
+        return None
+
+
+def phash_pixels(pixels: np.ndarray) -> np.ndarray:
+    """对 (N, 32, 32) 灰度图批量计算64位DCT感知hash，返回uint64数组"""
+    coeffs = _DCT @ pixels @ _DCT.T
+    low = coeffs[:, :HASH_SIZE, :HASH_SIZE].reshape(len(pixels), -1)
+    # 中位数不含直流分量，避免整体亮度主导
+    median = np.median(low[:, 1:], axis=1, keepdims=True)
+    bits = (low > median).astype(np.uint64)
+    return (bits * _BIT_WEIGHTS).sum(axis=1, dtype=np.uint64)
+
+
+def compute_phashes(paths: List[str], num_workers: int = 0) -> Dict[str, Tuple[int, int]]:
+    """并行解码 + 批量向量化DCT，返回 {path: (phash, 原图面积)}，无法解码的图片不包含在内"""
+    num_workers = num_workers if num_workers > 0 else min(32, os.cpu_count() or 4)
+    hashes = {}
+    with ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="phash") as executor:
+        for start in range(0, len(paths), HASH_CHUNK):
+            chunk = paths[start:start + HASH_CHUNK]
+            loaded = [(p, r) for p, r in zip(chunk, executor.map(_load_thumbnail, chunk)) if r is not None]
+            if not loaded:
+                continue
+            pixels = np.stack([r[0] for _, r in loaded])
+            for (path, (_, area)), value in zip(loaded, phash_pixels(pixels)):
+                hashes[path] = (int(value), area)
+    return hashes
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class BKTree:
+    """汉明距离BK树: 按三角不等式剪枝，半径查询无需两两比较"""
+
+    def __init__(self):
+        self.root = None
+
+    def add(self, value: int, item) -> None:
+        if self.root is None:
+            self.root = (value, item, {})
+            return
+        node = self.root
+        while True:
+            dist = hamming(value, node[0])
+            child = node[2].get(dist)
+            if child is None:
+                node[2][dist] = (value, item, {})
+                return
+            node = child
+
+    def search(self, value: int, radius: int) -> list:
+        """返回与value距离 <= radius 的全部item"""
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node_value, item, children = stack.pop()
+            dist = hamming(value, node_value)
+            if dist <= radius:
+                found.append(item)
+            for child_dist, child in children.items():
+                if dist - radius <= child_dist <= dist + radius:
+                    stack.append(child)
+        return found
+
+
+def find_near_duplicates(folder_path: str, image_files: List[str], threshold: int = 6,
+                         num_workers: int = 0) -> List[List[str]]:
+    """对image_files做近重复聚类: 每张图片与所属组的代表图片感知hash汉明距离 <= threshold
+
+    按分辨率从高到低 (同分辨率按文件名) 依次处理，与已有代表的距离均超过threshold的图片成为新代表，
+    否则归入距离最近的代表 (不做传递闭包，A≈B≈C 时A与C相距较远不会被并入同一组)。
+    返回成员数 >= 2 的分组，每组第一个为代表图片。
+    """
+    paths = {f: os.path.join(folder_path, f) for f in image_files}
+    hashes = compute_phashes(list(paths.values()), num_workers=num_workers)
+
+    ordered = sorted((f for f in image_files if paths[f] in hashes), key=lambda f: (-hashes[paths[f]][1], f))
+    tree = BKTree()
+    clusters: Dict[str, List[str]] = {}
+    for filename in ordered:
+        value = hashes[paths[filename]][0]
+        nearby = tree.search(value, threshold)
+        if nearby:
+            representative = min(nearby, key=lambda r: (hamming(value, hashes[paths[r]][0]), r))
+            clusters[representative].append(filename)
+        else:
+            clusters[filename] = [filename]
+            tree.add(value, filename)
+
+    groups = [members for members in clusters.values() if len(members) >= 2]
+    groups.sort(key=lambda g: g[0])
+    return groups
@@ -0,0 +1,95 @@
+# journal.py
+import json
+import os
+import socket
+import time
+import uuid
+from typing import Dict, List, Optional
+
+class RunJournal:
+    """单次运行的追加写JSONL日志: 每张图片的状态、耗时、视觉token数、生成token数与错误
+
+    位于 <journal_dir>/<run_id>.jsonl (默认 cache/journal/<文件夹>-<hash>/)，每个节点/进程各写各的文件。
+    每批记录写入后立即flush到操作系统 (进程被kill也不丢失)，
+    fsync按fsync_every条或fsync_interval秒批量执行，避免每张图片一次磁盘同步。
+    """
+
+    def __init__(self, journal_dir: str, fsync_every: int = 64, fsync_interval: float = 5.0):
+        self.run_id = time.strftime("%Y%m%d-%H%M%S") + f"-{socket.gethostname()}-{uuid.uuid4().hex[:6]}"
+        self.journal_dir = journal_dir
+        self.path = os.path.join(self.journal_dir, f"{self.run_id}.jsonl")
+        self.fsync_every = max(1, int(fsync_every))
+        self.fsync_interval = fsync_interval
+        self._unsynced = 0
+        self._last_sync = time.time()
+        os.makedirs(self.journal_dir, exist_ok=True)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def write(self, records: List[dict]) -> None:
+        """追加一批记录"""
+        if not records:
+            return
+        now = time.time()
+        for record in records:
+            self._file.write(json.dumps({"run": self.run_id, "ts": now, **record}, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+        self._unsynced += len(records)
+        if self._unsynced >= self.fsync_every or now - self._last_sync >= self.fsync_interval:
+            self._sync()
+
+    def _sync(self) -> None:
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.time()
+
+    def close(self) -> None:
+        if self._file.closed:
+            return
+        self._file.flush()
+        self._sync()
+        self._file.close()
+
+
+def load_history(journal_dir: str) -> Dict[str, dict]:
+    """汇总日志目录内所有历史运行日志: {filename: {"status": 最近状态, "failures": 累计失败次数, "error": 最近错误}}
+
+    崩溃时写到一半的末行会被忽略。
+    """
+    history: Dict[str, dict] = {}
+    if not os.path.isdir(journal_dir):
+        return history
+
+    records = []
+    for name in os.listdir(journal_dir):
+        if not name.endswith(".jsonl"):
+            continue
+        with open(os.path.join(journal_dir, name), "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if "file" in record and "status" in record:
+                    records.append(record)
+
+    for record in sorted(records, key=lambda r: r.get("ts", 0)):
+        entry = history.setdefault(record["file"], {"status": None, "failures": 0, "error": None})
+        entry["status"] = record["status"]
+        if record["status"] == "failed":
+            entry["failures"] += 1
+            entry["error"] = record.get("error")
+    return history
+
+
+def exhausted_files(history: Dict[str, dict], max_retries: int) -> Dict[str, dict]:
+    """最近状态仍为失败且已重试max_retries次 (累计失败次数超过max_retries) 的图片"""
+    return {
+        name: entry for name, entry in history.items()
+        if entry["status"] == "failed" and entry["failures"] > max_retries
+    }
+
+
+def run_header(args: Optional[dict] = None) -> dict:
+    """运行开始记录 (不含file字段，load_history会忽略)"""
+    return {"event": "run_start", "pid": os.getpid(), "args": args or {}}
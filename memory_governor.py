@@ -0,0 +1,120 @@
+# memory_governor.py
+import gc
+from typing import Optional
+
+MIN_VISION_SCALE = 0.25
+
+
+def is_oom_error(error: BaseException) -> bool:
+    """是否为显存/内存不足错误 (torch.cuda.OutOfMemoryError 或 CUDA/CPU分配失败)"""
+    if isinstance(error, MemoryError) or type(error).__name__ == "OutOfMemoryError":
+        return True
+    return "out of memory" in str(error).lower()
+
+
+class MemoryGovernor:
+    """显存调节器: 按分配器统计按需清理，OOM时先减小批次再降低分辨率，连续成功后逐步恢复
+
+    batch_limit为当前允许的单次generate图片数 (None为不限制)；
+    vision_scale为单张图片像素预算的缩放系数 (1.0为不缩小，最低MIN_VISION_SCALE)。
+    连续ramp_after次生成成功后，先恢复分辨率，再将batch_limit翻倍直到恢复为不限制。
+    """
+
+    # 已在最低分辨率时，每张图片清理缓存后仍重试的次数 (碎片化导致的OOM在empty_cache后常可成功)
+    FLOOR_RETRIES = 1
+
+    def __init__(self, device: Optional[str] = None, high_watermark: float = 0.90, fragmentation: float = 0.25,
+                 ramp_after: int = 16):
+        self.device = device
+        self.high_watermark = high_watermark
+        self.fragmentation = fragmentation
+        self.ramp_after = max(1, int(ramp_after))
+        self.batch_limit: Optional[int] = None
+        self.vision_scale = 1.0
+        self.oom_count = 0
+        self.cleanups = 0
+        self._streak = 0
+        self._batch_ceiling: Optional[int] = None
+
+    def _cuda(self):
+        if self.device != "cuda":
+            return None
+        import torch
+        return torch.cuda
+
+    def cleanup(self) -> None:
+        cuda = self._cuda()
+        gc.collect()
+        if cuda is not None:
+            cuda.empty_cache()
+        self.cleanups += 1
+
+    def maybe_cleanup(self) -> bool:
+        """仅在显存接近占满、且缓存分配器中有较多空闲块时清理，返回是否执行了清理"""
+        cuda = self._cuda()
+        if cuda is None:
+            return False
+        free, total = cuda.mem_get_info()
+        reserved = cuda.memory_reserved()
+        idle = reserved - cuda.memory_allocated()
+        near_full = total and (total - free) / total >= self.high_watermark
+        if near_full and reserved and idle / reserved >= self.fragmentation:
+            self.cleanup()
+            return True
+        return False
+
+    def fits(self, batch_len: int) -> bool:
+        """当前状态下能否直接按batch_len张、原始分辨率生成"""
+        return self.vision_scale >= 1.0 and (self.batch_limit is None or batch_len <= self.batch_limit)
+
+    def on_oom(self, batch_len: int) -> None:
+        """OOM后回退: 多张时批次减半，单张时分辨率减半"""
+        self.oom_count += 1
+        self._streak = 0
+        if batch_len > 1:
+            self.batch_limit = max(1, batch_len // 2)
+            self._batch_ceiling = max(self._batch_ceiling or 0, batch_len)
+            print(f"🧠 显存不足，批次上限降为 {self.batch_limit}")
+        elif self.at_floor:
+            self.batch_limit = 1
+            print(f"🧠 显存不足，图片像素预算已是最低 {self.vision_scale:.0%}")
+        else:
+            self.batch_limit = 1
+            self.vision_scale = max(MIN_VISION_SCALE, self.vision_scale / 2)
+            print(f"🧠 显存不足，图片像素预算降为 {self.vision_scale:.0%}")
+        self.cleanup()
+
+    @property
+    def at_floor(self) -> bool:
+        """分辨率已降到MIN_VISION_SCALE，OOM后无法再缩小"""
+        return self.vision_scale <= MIN_VISION_SCALE
+
+    def can_retry(self, floor_attempts: int = 0) -> bool:
+        """单张图片OOM后能否重试: 还能降低分辨率时可以；已在最低分辨率时，清理后再重试FLOOR_RETRIES次
+
+        floor_attempts为该图片在最低分辨率下已重试的次数。
+        """
+        return not self.at_floor or floor_attempts < self.FLOOR_RETRIES
+
+    def on_success(self) -> None:
+        """连续成功ramp_after次后恢复一级 (先分辨率后批次)"""
+        if self.batch_limit is None and self.vision_scale >= 1.0:
+            return
+        self._streak += 1
+        if self._streak < self.ramp_after:
+            return
+        self._streak = 0
+        if self.vision_scale < 1.0:
+            self.vision_scale = min(1.0, self.vision_scale * 2)
+            print(f"🧠 显存恢复，图片像素预算升至 {self.vision_scale:.0%}")
+        elif self._batch_ceiling is None or self.batch_limit * 2 >= self._batch_ceiling:
+            self.batch_limit = None
+            print("🧠 显存恢复，取消批次上限")
+        else:
+            self.batch_limit *= 2
+            print(f"🧠 显存恢复，批次上限升至 {self.batch_limit}")
+
+    def summary(self) -> str:
+        if not self.oom_count and not self.cleanups:
+            return ""
+        return f" | 显存: OOM回退 {self.oom_count} 次, 清理 {self.cleanups} 次"
@@ -0,0 +1,204 @@
+# metrics.py
+import json
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, Optional, Tuple
+
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (16, 32, 64, 96, 128, 192, 256, 384, 512)
+
+_NULL_CONTEXT = nullcontext()
+
+
+def _fmt(value: float) -> str:
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+class MetricsRegistry:
+    """进程内指标: 计数器、直方图、仪表盘 (含按需求值的回调仪表盘)，输出Prometheus文本格式
+
+    未启用时所有记录方法在第一行返回，埋点几乎零开销。
+    enable(log_path) 指定日志文件时，event() 以JSON行写入结构化日志。
+    """
+
+    def __init__(self, prefix: str = "caption"):
+        self.prefix = prefix
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, tuple], float] = {}
+        self._histograms: Dict[Tuple[str, tuple], list] = {}
+        self._buckets: Dict[str, tuple] = {}
+        self._gauges: Dict[Tuple[str, tuple], float] = {}
+        self._gauge_fns: Dict[str, Callable[[], Optional[float]]] = {}
+        self._help: Dict[str, str] = {}
+        self._log = None
+        self._log_lock = threading.Lock()
+
+    def enable(self, log_path: Optional[str] = None) -> None:
+        self.enabled = True
+        if log_path and self._log is None:
+            self._log = open(log_path, "a", encoding="utf-8")
+
+    def describe(self, name: str, text: str, buckets: Optional[tuple] = None) -> None:
+        self._help[name] = text
+        if buckets is not None:
+            self._buckets[name] = tuple(buckets)
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        if not self.enabled:
+            return
+        buckets = self._buckets.get(name, DEFAULT_BUCKETS)
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            state = self._histograms.get(key)
+            if state is None:
+                # [各桶计数..., +Inf计数, 总和]
+                state = self._histograms[key] = [0] * (len(buckets) + 1) + [0.0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[len(buckets)] += 1
+            state[-1] += value
+
+    def histogram_total(self, name: str, **labels) -> Tuple[int, float]:
+        """直方图的 (观测次数, 总和)，尚无记录时为 (0, 0.0)"""
+        buckets = self._buckets.get(name, DEFAULT_BUCKETS)
+        with self._lock:
+            state = self._histograms.get((name, tuple(sorted(labels.items()))))
+            return (state[len(buckets)], state[-1]) if state else (0, 0.0)
+
+    def set_gauge(self, name: str, value: float, **labels) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def gauge_fn(self, name: str, fn: Callable[[], Optional[float]]) -> None:
+        """注册回调仪表盘 (如队列深度、内存峰值)，只在输出指标时求值"""
+        self._gauge_fns[name] = fn
+
+    def stage(self, name: str, **labels):
+        """计时上下文: 记录到 stage_seconds{stage=name} 直方图"""
+        if not self.enabled:
+            return _NULL_CONTEXT
+        return self._timed(name, labels)
+
+    @contextmanager
+    def _timed(self, name: str, labels: dict):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("stage_seconds", time.perf_counter() - start, stage=name, **labels)
+
+    def event(self, event: str, **fields) -> None:
+        """写一条结构化日志 (JSON行)"""
+        if not self.enabled or self._log is None:
+            return
+        line = json.dumps({"ts": round(time.time(), 3), "event": event, **fields}, ensure_ascii=False)
+        with self._log_lock:
+            self._log.write(line + "\n")
+            self._log.flush()
+
+    def _series(self, name: str, labels: tuple, extra: tuple = ()) -> str:
+        items = labels + extra
+        label_text = ",".join(f'{k}="{str(v)}"' for k, v in items)
+        full = f"{self.prefix}_{name}"
+        return f"{full}{{{label_text}}}" if label_text else full
+
+    def _header(self, lines: list, name: str, kind: str, seen: set) -> None:
+        if name in seen:
+            return
+        seen.add(name)
+        if name in self._help:
+            lines.append(f"# HELP {self.prefix}_{name} {self._help[name]}")
+        lines.append(f"# TYPE {self.prefix}_{name} {kind}")
+
+    def render(self) -> str:
+        """Prometheus文本格式"""
+        lines, seen = [], set()
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((k, list(v)) for k, v in self._histograms.items())
+            gauges = sorted(self._gauges.items())
+
+        for (name, labels), value in counters:
+            self._header(lines, name, "counter", seen)
+            lines.append(f"{self._series(name, labels)} {_fmt(value)}")
+
+        for (name, labels), state in histograms:
+            self._header(lines, name, "histogram", seen)
+            buckets = self._buckets.get(name, DEFAULT_BUCKETS)
+            for bound, count in zip(buckets, state):
+                lines.append(f"{self._series(name + '_bucket', labels, (('le', f'{bound:g}'),))} {count}")
+            lines.append(f"{self._series(name + '_bucket', labels, (('le', '+Inf'),))} {state[len(buckets)]}")
+            lines.append(f"{self._series(name + '_count', labels)} {state[len(buckets)]}")
+            lines.append(f"{self._series(name + '_sum', labels)} {_fmt(state[-1])}")
+
+        for (name, labels), value in gauges:
+            self._header(lines, name, "gauge", seen)
+            lines.append(f"{self._series(name, labels)} {_fmt(value)}")
+
+        for name, fn in sorted(self._gauge_fns.items()):
+            try:
+                value = fn()
+            except Exception:
+                continue
+            if value is None:
+                continue
+            self._header(lines, name, "gauge", seen)
+            lines.append(f"{self._series(name, ())} {_fmt(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def peak_rss_bytes() -> Optional[float]:
+    """进程常驻内存峰值 (字节)，不支持resource模块的平台返回None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    import sys
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux单位为KB，macOS为字节
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+metrics = MetricsRegistry()
+metrics.describe("images_total", "按结果统计的图片数 (success/cached/failed)")
+metrics.describe("stage_seconds", "各阶段耗时 (秒)")
+metrics.describe("generated_tokens", "每张图片生成的token数", buckets=TOKEN_BUCKETS)
+metrics.describe("batches_total", "已完成的generate批次数")
+metrics.describe("requests_total", "HTTP打标请求数 (ok/failed/rejected)")
+
+
+def serve_metrics(port: int, host: str = "127.0.0.1", registry: MetricsRegistry = metrics):
+    """后台线程启动 /metrics HTTP端点 (标准库实现，UI与命令行批处理模式均可使用)"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
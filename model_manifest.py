@@ -0,0 +1,76 @@
+# model_manifest.py
+import json
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from caption_cache import hash_file
+
+
+def file_signature(model_dir: Path, files: List[Path]) -> Dict[str, List[int]]:
+    """文件签名: {文件名: [大小, mtime_ns]}，只需stat调用"""
+    signature = {}
+    for f in files:
+        st = f.stat()
+        signature[f.relative_to(model_dir).as_posix()] = [st.st_size, st.st_mtime_ns]
+    return signature
+
+
+class ModelManifest:
+    """模型校验清单: 记录验证通过时的文件大小/mtime、词表大小及可选的权重内容hash
+
+    文件签名与清单一致时视为模型未变化，跳过tokenizer加载等深度验证；
+    任一文件新增、删除或改动后清单失效，需重新深度验证。
+    深度验证 (--verify-full) 时权重hash与上次记录比较，内容不一致即判定损坏。
+    """
+
+    def __init__(self, manifest_path: str):
+        self.manifest_path = manifest_path
+
+    def _load_all(self) -> dict:
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def lookup(self, model_dir: Path, signature: Dict[str, List[int]]) -> Optional[dict]:
+        """返回与当前文件签名一致的清单记录，不一致或不存在时返回None"""
+        entry = self._load_all().get(str(model_dir.resolve()))
+        if entry and entry.get("files") == signature:
+            return entry
+        return None
+
+    def hash_weights(self, model_dir: Path, weight_files: List[Path]) -> Dict[str, str]:
+        """计算权重文件内容hash: {文件名: hash}"""
+        return {f.relative_to(model_dir).as_posix(): hash_file(str(f)) for f in weight_files}
+
+    def recorded_hashes(self, model_dir: Path) -> Dict[str, str]:
+        """上次深度验证记录的权重hash (无记录时为空)"""
+        entry = self._load_all().get(str(model_dir.resolve())) or {}
+        return entry.get("hashes") or {}
+
+    def mismatched_hashes(self, model_dir: Path, hashes: Dict[str, str]) -> List[str]:
+        """与上次深度验证记录的hash比较，返回内容不一致的文件名 (无历史记录的文件不比较)"""
+        recorded = self.recorded_hashes(model_dir)
+        return sorted(name for name, digest in hashes.items() if name in recorded and recorded[name] != digest)
+
+    def record(self, model_dir: Path, signature: Dict[str, List[int]], vocab_size: int,
+               hashes: Optional[Dict[str, str]] = None) -> dict:
+        """写入验证结果；未传入hashes时保留上次深度验证记录的权重hash，作为之后比较的基准"""
+        manifests = self._load_all()
+        key = str(model_dir.resolve())
+        entry = {"files": signature, "vocab_size": vocab_size, "verified_at": time.time()}
+        previous = (manifests.get(key) or {}).get("hashes")
+        if hashes or previous:
+            entry["hashes"] = hashes or previous
+
+        manifests[key] = entry
+        os.makedirs(os.path.dirname(os.path.abspath(self.manifest_path)), exist_ok=True)
+        # 先写临时文件再替换，多个工作进程同时写入时不会读到半截文件
+        tmp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifests, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+        return entry
@@ -0,0 +1,115 @@
+# model_snapshot.py
+import json
+import os
+import shutil
+import time
+from importlib import metadata
+from pathlib import Path
+from typing import Dict, Optional
+
+from model_manifest import file_signature
+
+SNAPSHOT_META = "snapshot_meta.json"
+VERSION_PACKAGES = ("torch", "transformers", "accelerate", "bitsandbytes", "safetensors")
+LOCK_TIMEOUT = 3600
+
+
+def runtime_versions() -> Dict[str, Optional[str]]:
+    """影响快照可用性的依赖版本 (未安装为None)"""
+    versions = {}
+    for name in VERSION_PACKAGES:
+        try:
+            versions[name] = metadata.version(name)
+        except metadata.PackageNotFoundError:
+            versions[name] = None
+    return versions
+
+
+def snapshot_variant(quantized: bool, device: str, dtype) -> str:
+    """快照变体名: 量化方式/设备/精度不同的模型各自保存，例如 4bit-nf4-cuda、bfloat16-cuda、float32-cpu"""
+    precision = "4bit-nf4" if quantized else str(dtype).replace("torch.", "")
+    return f"{precision}-{device}"
+
+
+class ModelSnapshot:
+    """已加载模型的本地快照 (save_pretrained格式，与量化方式/精度无关)
+
+    快照位于 <模型目录>_snapshots/<variant>/，snapshot_meta.json 记录源模型文件签名与依赖版本，
+    两者任一不一致时快照失效 (调用方回退为从原始权重加载)。
+    meta文件最后写入，中途中断的快照不会被使用。
+    """
+
+    def __init__(self, model_path: str, variant: str):
+        self.model_dir = Path(model_path)
+        self.variant = variant
+        self.path = Path(f"{self.model_dir.resolve()}_snapshots") / variant
+
+    def _source_signature(self) -> Dict[str, list]:
+        files = sorted(f for f in self.model_dir.iterdir() if f.is_file())
+        return file_signature(self.model_dir, files)
+
+    def _expected_meta(self) -> dict:
+        return {"variant": self.variant, "source": self._source_signature(), "versions": runtime_versions()}
+
+    def is_valid(self) -> bool:
+        """快照存在且源模型与依赖版本均未变化"""
+        try:
+            with open(self.path / SNAPSHOT_META, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return False
+        expected = self._expected_meta()
+        return all(meta.get(k) == v for k, v in expected.items())
+
+    def mismatch_reason(self) -> str:
+        """快照不可用的原因 (用于日志)"""
+        try:
+            with open(self.path / SNAPSHOT_META, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return "快照不存在"
+        if meta.get("source") != self._source_signature():
+            return "源模型文件已变化"
+        if meta.get("versions") != runtime_versions():
+            return f"依赖版本不一致 (快照: {meta.get('versions')})"
+        return "快照元数据不一致"
+
+    def save(self, model) -> bool:
+        """保存模型快照: 持有锁文件时写入本进程的临时目录，完成后再替换；返回是否实际写入
+
+        数据并行的多个工作进程首次运行时会同时尝试保存: 只有取得 <variant>.lock 的进程写入，
+        其余进程跳过；取得锁后若快照已由其他进程写好也跳过。
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        lock_path = self.path.with_name(f"{self.variant}.lock")
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            # 保存中的进程崩溃会遗留锁文件，超过LOCK_TIMEOUT后清理，下次运行重新保存
+            try:
+                if time.time() - lock_path.stat().st_mtime > LOCK_TIMEOUT:
+                    lock_path.unlink()
+            except FileNotFoundError:
+                pass
+            return False
+        os.close(fd)
+
+        tmp_path = self.path.with_name(f"{self.variant}.{os.getpid()}.tmp")
+        try:
+            if self.is_valid():
+                return False
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            tmp_path.mkdir()
+
+            model.save_pretrained(tmp_path, safe_serialization=True)
+            meta = self._expected_meta()
+            meta["created_at"] = time.time()
+            with open(tmp_path / SNAPSHOT_META, 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False, indent=2)
+
+            shutil.rmtree(self.path, ignore_errors=True)
+            os.replace(tmp_path, self.path)
+            return True
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            lock_path.unlink()
@@ -0,0 +1,195 @@
+# parallel.py
+import multiprocessing as mp
+import os
+import queue
+import traceback
+from itertools import chain
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from cpu_backend import parse_cpu_device
+
+_SPAWN_ENV = ("CUDA_VISIBLE_DEVICES", "OMP_NUM_THREADS", "MKL_NUM_THREADS")
+
+
+def _worker_loop(worker_id: int, init_fn: Callable, init_kwargs: Dict[str, Any],
+                 task_queue, result_queue, cores: Optional[List[int]] = None):
+    """工作进程主循环: 初始化模型副本后从共享队列领取批次，直到收到None
+
+    cores不为空时先将本进程绑定到这些核，再执行init_fn (之后导入torch创建的计算线程继承该亲和性)。
+    """
+    if cores and hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(0, cores)
+        except OSError as e:
+            print(f"⚠️  工作进程 {worker_id} 绑核失败: {str(e)}")
+    try:
+        run_batch = init_fn(**init_kwargs)
+    except BaseException as e:
+        traceback.print_exc()
+        result_queue.put(("error", worker_id, None, f"{type(e).__name__}: {e}"))
+        return
+
+    result_queue.put(("ready", worker_id, None, None))
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+
+        task_id, batch = task
+        result_queue.put(("take", worker_id, task_id, None))
+        try:
+            payload = run_batch(batch)
+            result_queue.put(("result", worker_id, task_id, payload))
+        except Exception as e:
+            traceback.print_exc()
+            result_queue.put(("failed", worker_id, task_id, f"{type(e).__name__}: {e}"))
+
+    result_queue.put(("done", worker_id, None, None))
+
+
+def visible_gpu_ids() -> List[str]:
+    """当前进程可见的GPU编号 (遵循CUDA_VISIBLE_DEVICES)"""
+    env = os.environ.get("CUDA_VISIBLE_DEVICES")
+    if env is not None:
+        return [d.strip() for d in env.split(",") if d.strip() and d.strip() != "-1"]
+
+    import torch
+    return [str(i) for i in range(torch.cuda.device_count())]
+
+
+class DataParallelScheduler:
+    """数据并行调度器: 每个设备一个工作进程，各自持有模型副本，从共享队列领取批次
+
+    devices为设备列表，GPU用编号字符串 ("0", "1", ...)，CPU用 "cpu" 或 "cpu:<核列表>" (如 "cpu:0,1,2,3")。
+    每个工作进程通过spawn启动，启动时CUDA_VISIBLE_DEVICES只暴露自己的GPU；
+    指定核列表的CPU工作进程按核数设置OMP/MKL线程数，并绑定到这些核上。
+    init_fn(**init_kwargs) 在工作进程内执行，返回 run_batch(batch) -> payload 可调用对象；
+    init_fn必须是模块级函数 (可被pickle)。
+    """
+
+    def __init__(self, devices: List[str], init_fn: Callable, init_kwargs: Dict[str, Any] = None):
+        if not devices:
+            raise ValueError("数据并行至少需要一个设备")
+        self.devices = list(devices)
+        self.init_fn = init_fn
+        self.init_kwargs = init_kwargs or {}
+
+    def _start_workers(self, ctx, task_queue, result_queue) -> List[Any]:
+        workers = []
+        saved_env = {name: os.environ.get(name) for name in _SPAWN_ENV}
+        try:
+            for worker_id, dev in enumerate(self.devices):
+                # spawn子进程在start时继承环境变量，import torch前即只可见指定GPU / 使用指定线程数
+                cores = parse_cpu_device(dev)
+                os.environ["CUDA_VISIBLE_DEVICES"] = "" if dev.startswith("cpu") else dev
+                for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+                    if cores:
+                        os.environ[name] = str(len(cores))
+                    elif saved_env[name] is None:
+                        os.environ.pop(name, None)
+                    else:
+                        os.environ[name] = saved_env[name]
+                p = ctx.Process(
+                    target=_worker_loop,
+                    args=(worker_id, self.init_fn, self.init_kwargs, task_queue, result_queue, cores),
+                    name=f"caption-worker-{worker_id}",
+                    daemon=True
+                )
+                p.start()
+                workers.append(p)
+        finally:
+            for name, value in saved_env.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+        return workers
+
+    def run(self, batches: Iterable[Any]) -> Iterator[Tuple[str, int, Any, Any]]:
+        """按需分发批次，按完成顺序产出事件
+
+        batches按需惰性读取 (队列中最多保留2倍工作进程数的批次)，
+        因此批次生成器中的认领/过滤逻辑会随处理进度逐步执行。
+        事件为 (kind, worker_id, batch, payload)：
+          ("ready", wid, None, None)      工作进程初始化完成
+          ("result", wid, batch, payload) 批次完成
+          ("failed", wid, batch, error)   批次失败 (含工作进程异常退出时未完成的批次)
+          ("error", wid, None, error)     工作进程初始化失败
+        """
+        ctx = mp.get_context("spawn")
+        task_queue = ctx.Queue()
+        result_queue = ctx.Queue()
+
+        # 没有任何批次时不启动工作进程 (避免无谓的模型加载)
+        batch_iter = iter(batches)
+        for first in batch_iter:
+            batch_iter = chain([first], batch_iter)
+            break
+        else:
+            return
+
+        tasks: Dict[int, Any] = {}
+        state = {"next_id": 0, "exhausted": False}
+
+        def feed(n: int):
+            while n > 0 and not state["exhausted"]:
+                try:
+                    batch = next(batch_iter)
+                except StopIteration:
+                    state["exhausted"] = True
+                    for _ in self.devices:
+                        task_queue.put(None)
+                    return
+                task_id = state["next_id"]
+                state["next_id"] += 1
+                tasks[task_id] = batch
+                task_queue.put((task_id, batch))
+                n -= 1
+
+        workers = self._start_workers(ctx, task_queue, result_queue)
+        feed(2 * len(workers))
+
+        finished = set()
+        in_flight: Dict[int, int] = {}
+        done_ids = set()
+
+        try:
+            while len(finished) < len(workers) and (len(done_ids) < len(tasks) or not state["exhausted"]):
+                try:
+                    kind, wid, task_id, payload = result_queue.get(timeout=1.0)
+                except queue.Empty:
+                    # 检测异常退出的工作进程，其领取中的批次记为失败
+                    for wid, p in enumerate(workers):
+                        if wid not in finished and not p.is_alive():
+                            finished.add(wid)
+                            lost = in_flight.pop(wid, None)
+                            if lost is not None and lost not in done_ids:
+                                done_ids.add(lost)
+                                yield "failed", wid, tasks[lost], f"工作进程异常退出 (exitcode={p.exitcode})"
+                    continue
+
+                if kind == "take":
+                    in_flight[wid] = task_id
+                elif kind in ("result", "failed"):
+                    in_flight.pop(wid, None)
+                    done_ids.add(task_id)
+                    feed(1)
+                    yield kind, wid, tasks[task_id], payload
+                elif kind == "ready":
+                    yield kind, wid, None, None
+                elif kind == "error":
+                    finished.add(wid)
+                    yield kind, wid, None, payload
+                elif kind == "done":
+                    finished.add(wid)
+
+            # 所有工作进程均已退出但仍有未处理批次
+            for task_id in [t for t in tasks if t not in done_ids]:
+                yield "failed", -1, tasks[task_id], "没有可用的工作进程"
+            for batch in batch_iter:
+                yield "failed", -1, batch, "没有可用的工作进程"
+        finally:
+            for p in workers:
+                p.join(timeout=5)
+                if p.is_alive():
+                    p.terminate()
@@ -0,0 +1,61 @@
+# pipeline.py
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Iterator, Optional, Tuple
+
+
+class PrefetchPipeline:
+    """后台预取流水线 (生产者/消费者)
+
+    线程池在后台对即将处理的任务执行prepare_fn (解码/校验/预处理)，
+    结果放入有界预取队列；主线程按原顺序取出后只负责generate。
+    stall_time 记录主线程等待输入的累计时间 (即GPU空等时间)。
+    """
+
+    def __init__(self, items: Iterable[Any], prepare_fn: Callable[[Any], Any],
+                 num_workers: int = 2, queue_depth: int = 4):
+        self.items = iter(items)
+        self.prepare_fn = prepare_fn
+        self.num_workers = max(1, int(num_workers))
+        self.queue_depth = max(1, int(queue_depth))
+        self.stall_time = 0.0
+        self.prepared_count = 0
+        self._queue: deque = deque()
+
+    def depth(self) -> int:
+        """当前预取队列中的批次数"""
+        return len(self._queue)
+
+    def _fill(self, executor: ThreadPoolExecutor, queue: deque) -> None:
+        """补满预取队列"""
+        while len(queue) < self.queue_depth:
+            try:
+                item = next(self.items)
+            except StopIteration:
+                return
+            queue.append((item, executor.submit(self.prepare_fn, item)))
+
+    def __iter__(self) -> Iterator[Tuple[Any, Any, Optional[Exception]]]:
+        """按提交顺序产出 (item, prepared, error)"""
+        queue = self._queue
+        with ThreadPoolExecutor(max_workers=self.num_workers, thread_name_prefix="prefetch") as executor:
+            try:
+                self._fill(executor, queue)
+                while queue:
+                    item, future = queue.popleft()
+
+                    wait_start = time.time()
+                    try:
+                        prepared, error = future.result(), None
+                    except Exception as e:
+                        prepared, error = None, e
+                    self.stall_time += time.time() - wait_start
+                    self.prepared_count += 1
+
+                    # 先补队列再交给主线程，保证generate期间后台持续预处理
+                    self._fill(executor, queue)
+                    yield item, prepared, error
+            finally:
+                for _, future in queue:
+                    future.cancel()
@@ -0,0 +1,132 @@
+# prompt_cache.py
+import copy
+import hashlib
+import os
+
+
+def reset_rope_deltas(model):
+    """清除Qwen3-VL缓存的M-RoPE偏移，复用前缀KV时必须按完整输入重新计算位置编码"""
+    inner = getattr(model, "model", None)
+    if inner is not None and hasattr(inner, "rope_deltas"):
+        inner.rope_deltas = None
+
+
+class PromptPrefixCache:
+    """系统提示词前缀KV缓存
+
+    CAPTION_PROMPT作为system轮固定位于每条输入最前面，只需prefill一次；
+    之后每次generate复用其KV缓存，prefill只覆盖图片与用户指令部分 (见prepare)。
+    提示词文件变化 (mtime/大小) 时 is_stale() 返回True，需要重新build。
+    """
+
+    def __init__(self, prompt_path: str):
+        self.prompt_path = prompt_path
+        self.prompt_hash = None
+        self.prefix_ids = None
+        self.past_key_values = None
+        self.enabled = True
+        self._stat = None
+
+    def _file_stat(self):
+        st = os.stat(self.prompt_path)
+        return st.st_mtime_ns, st.st_size
+
+    def is_stale(self) -> bool:
+        """提示词文件是否已变化 (或尚未构建)"""
+        if self.past_key_values is None:
+            return True
+        try:
+            return self._file_stat() != self._stat
+        except OSError:
+            return True
+
+    def build(self, model, processor, system_prompt: str) -> int:
+        """编码system轮并prefill得到KV缓存，返回前缀token数"""
+        self._stat = self._file_stat()
+        self.prompt_hash = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()[:16]
+
+        prefix_text = processor.apply_chat_template(
+            [{"role": "system", "content": system_prompt}],
+            tokenize=False,
+            add_generation_prompt=False
+        )
+        self.prefix_ids = processor.tokenizer(prefix_text, return_tensors="pt")["input_ids"].to(model.device)
+
+        import torch
+
+        reset_rope_deltas(model)
+        with torch.no_grad():
+            self.past_key_values = model(input_ids=self.prefix_ids, use_cache=True).past_key_values
+        return self.prefix_ids.shape[1]
+
+    def matches(self, inputs) -> bool:
+        """输入是否可复用前缀缓存: 无padding且开头token与前缀完全一致"""
+        if not self.enabled or self.past_key_values is None:
+            return False
+
+        input_ids = inputs["input_ids"]
+        prefix_len = self.prefix_ids.shape[1]
+        if input_ids.shape[1] <= prefix_len:
+            return False
+
+        # 左侧padding会平移前缀位置，只有无padding的批次可以复用
+        attention_mask = inputs.get("attention_mask")
+        if attention_mask is not None and not bool(attention_mask.all()):
+            return False
+
+        prefix = self.prefix_ids[0].to(input_ids.device)
+        return bool((input_ids[:, :prefix_len] == prefix).all())
+
+    def get(self, batch_size: int = 1):
+        """返回前缀KV缓存的独立副本 (generate会原地追加，不能共享)"""
+        past_key_values = copy.deepcopy(self.past_key_values)
+        if batch_size > 1:
+            past_key_values.batch_repeat_interleave(batch_size)
+        return past_key_values
+
+    def prepare(self, model, inputs) -> dict:
+        """在前缀KV之后prefill图片与用户指令部分，返回generate的输入 (ids + 已填充到倒数第二个token的KV缓存)
+
+        Qwen3-VL的generate在cache_position[0]不为0时会丢弃pixel_values，并按截断后的ids从0计算M-RoPE位置，
+        因此不能直接把前缀缓存交给generate: 这里按完整输入计算position_ids/rope_deltas，
+        用合并了图片特征的inputs_embeds (及deepstack视觉特征) 手动prefill后缀，
+        并把rope_deltas留在模型上，generate之后的步骤据此计算位置。最后一个token留给generate。
+        """
+        import torch
+
+        inner = model.model
+        input_ids = inputs["input_ids"]
+        attention_mask = inputs.get("attention_mask")
+        grid = inputs.get("image_grid_thw")
+        prefix_len = self.prefix_ids.shape[1]
+        end = input_ids.shape[1] - 1
+
+        position_ids, rope_deltas = inner.get_rope_index(input_ids, grid, None, attention_mask=attention_mask)
+        embeds = inner.get_input_embeddings()(input_ids)
+        visual_pos_masks, deepstack = None, None
+        if grid is not None and inputs.get("pixel_values") is not None:
+            image_embeds, deepstack = inner.get_image_features(inputs["pixel_values"], grid)
+            image_embeds = torch.cat(list(image_embeds), dim=0).to(embeds.device, embeds.dtype)
+            visual_pos_masks = input_ids == model.config.image_token_id
+            embeds = embeds.masked_scatter(visual_pos_masks.unsqueeze(-1).expand_as(embeds), image_embeds)
+            visual_pos_masks = visual_pos_masks[:, prefix_len:end]
+
+        past_key_values = self.get(input_ids.shape[0])
+        inner.language_model(
+            inputs_embeds=embeds[:, prefix_len:end],
+            attention_mask=attention_mask[:, :end] if attention_mask is not None else None,
+            position_ids=position_ids[:, :, prefix_len:end],
+            past_key_values=past_key_values,
+            use_cache=True,
+            cache_position=torch.arange(prefix_len, end, device=input_ids.device),
+            visual_pos_masks=visual_pos_masks,
+            deepstack_visual_embeds=deepstack,
+        )
+        inner.rope_deltas = rope_deltas
+        return {"input_ids": input_ids, "attention_mask": attention_mask, "past_key_values": past_key_values}
+
+    def clear(self):
+        """释放缓存"""
+        self.past_key_values = None
+        self.prefix_ids = None
+        self._stat = None
@@ -0,0 +1,87 @@
+# quality.py
+import re
+from typing import Iterable, List, Optional
+
+# 引号内的文字 (图片中的英文字样、品牌名等) 不计入中文占比
+_QUOTED = re.compile(r"“[^”]*”|「[^」]*」|『[^』]*』|\"[^\"]*\"|'[^']*'")
+
+REASON_LABELS = {
+    "too_short": "过短",
+    "too_long": "过长",
+    "cjk_ratio": "英文过多",
+    "repetition": "重复循环",
+    "truncated": "被截断",
+    "banned": "含禁用词",
+}
+
+
+class GeneratedCaption(str):
+    """模型新生成的caption (内容与str相同)，tokens为生成的token数 (记入运行日志)"""
+    tokens: Optional[int] = None
+
+
+class TruncatedCaption(GeneratedCaption):
+    """生成达到max_new_tokens上限仍未结束的caption (内容与str相同，仅作为截断标记)"""
+
+
+class CaptionValidator:
+    """caption质量检查: 长度范围、中文占比、字符n-gram重复、截断，以及可选的禁用词
+
+    中文占比与n-gram统计在码点数组上以numpy向量化计算；禁用词编译为单个正则 (最长优先的多模式匹配)。
+    check返回未通过的原因代码 (见REASON_LABELS)，通过时返回None。
+    """
+
+    def __init__(self, min_chars: int = 31, max_chars: int = 1000, min_cjk_ratio: float = 0.7, ngram: int = 8,
+                 max_ngram_repeats: int = 3, banned_terms: Optional[Iterable[str]] = None):
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self.min_cjk_ratio = min_cjk_ratio
+        self.ngram = ngram
+        self.max_ngram_repeats = max_ngram_repeats
+        terms = sorted(set(banned_terms or ()), key=len, reverse=True)
+        self._terms = terms
+        self._banned = re.compile("|".join(map(re.escape, terms))) if terms else None
+
+    def settings(self) -> dict:
+        """全部检查参数 (用于缓存上下文: 规则变化后旧缓存结果需重新检查/生成)"""
+        return {"min_chars": self.min_chars, "max_chars": self.max_chars, "min_cjk_ratio": self.min_cjk_ratio,
+                "ngram": self.ngram, "max_ngram_repeats": self.max_ngram_repeats, "banned_terms": sorted(self._terms)}
+
+    def check(self, caption: Optional[str]) -> Optional[str]:
+        import numpy as np
+
+        if not caption or len(caption) < self.min_chars:
+            return "too_short"
+        if len(caption) > self.max_chars:
+            return "too_long"
+        if isinstance(caption, TruncatedCaption):
+            return "truncated"
+
+        codes = np.frombuffer(_QUOTED.sub("", caption).encode("utf-32-le"), dtype=np.uint32)
+        cjk = int(np.count_nonzero(((codes >= 0x4E00) & (codes <= 0x9FFF)) | ((codes >= 0x3400) & (codes <= 0x4DBF))))
+        latin = int(np.count_nonzero(((codes | 0x20) >= 0x61) & ((codes | 0x20) <= 0x7A)))
+        if cjk + latin and cjk / (cjk + latin) < self.min_cjk_ratio:
+            return "cjk_ratio"
+
+        if self._max_ngram_count(codes) > self.max_ngram_repeats:
+            return "repetition"
+        if self._banned is not None and self._banned.search(caption):
+            return "banned"
+        return None
+
+    def check_batch(self, captions: List[Optional[str]]) -> List[Optional[str]]:
+        return [self.check(caption) for caption in captions]
+
+    def _max_ngram_count(self, codes) -> int:
+        import numpy as np
+
+        if len(codes) < self.ngram:
+            return 0
+        # 每个位置的n-gram编码为一行，统计完全相同的行出现的最大次数
+        windows = np.lib.stride_tricks.sliding_window_view(codes, self.ngram)
+        _, counts = np.unique(windows, axis=0, return_counts=True)
+        return int(counts.max())
+
+    def banned_terms(self, caption: str) -> List[str]:
+        """caption中出现的禁用词 (用于日志)"""
+        return self._banned.findall(caption) if self._banned is not None else []
@@ -18,7 +18,7 @@ set HF_HUB_DOWNLOAD_TIMEOUT=300
 set TRANSFORMERS_NO_ADVISORY_WARNINGS=1
 set TOKENIZERS_PARALLELISM=false
 set PYTORCH_CUDA_ALLOC_CONF=max_split_size_mb:128
-set CUDA_VISIBLE_DEVICES=0
+if not defined CUDA_VISIBLE_DEVICES set CUDA_VISIBLE_DEVICES=0
 
 REM 颜色输出 (Windows 10+ 支持ANSI)
 for /F "tokens=1,2 delims=#" %%a in ('"prompt #$H#$E# & echo on & for %%b in (1) do rem"') do set "ESC=%%a"
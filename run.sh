@@ -15,7 +15,7 @@ export HF_HUB_DOWNLOAD_TIMEOUT=300
 export TRANSFORMERS_NO_ADVISORY_WARNINGS=1
 export TOKENIZERS_PARALLELISM=false
 export PYTORCH_CUDA_ALLOC_CONF=max_split_size_mb:128
-export CUDA_VISIBLE_DEVICES=0
+export CUDA_VISIBLE_DEVICES=${CUDA_VISIBLE_DEVICES:-0}
 
 # 检查Python 3.10
 if ! command -v python3.10 &> /dev/null; then
@@ -0,0 +1,58 @@
+# scan.py
+import fnmatch
+import os
+from typing import Iterable, Iterator, Optional, Sequence
+
+
+def _matches(rel_path: str, patterns: Sequence[str]) -> bool:
+    """rel_path (以/分隔) 或其文件名匹配任一glob"""
+    name = rel_path.rsplit("/", 1)[-1]
+    return any(fnmatch.fnmatch(rel_path, p) or fnmatch.fnmatch(name, p) for p in patterns)
+
+
+def iter_image_files(folder_path: str, formats: Iterable[str], recursive: bool = False,
+                     include: Optional[Sequence[str]] = None,
+                     exclude: Optional[Sequence[str]] = None) -> Iterator[str]:
+    """基于os.scandir边扫描边产出图片相对路径，无需先列出整个目录树
+
+    recursive=True 时深度优先进入子目录 (不跟随目录符号链接，跳过隐藏目录)。
+    include/exclude 为glob列表，匹配相对路径或文件名；exclude匹配的目录整体跳过。
+    """
+    formats = {f.lower() for f in formats}
+    include = list(include or [])
+    exclude = list(exclude or [])
+
+    stack = [""]
+    while stack:
+        rel_dir = stack.pop()
+        try:
+            it = os.scandir(os.path.join(folder_path, rel_dir) if rel_dir else folder_path)
+        except OSError as e:
+            print(f"⚠️  无法读取目录 {rel_dir or folder_path}: {str(e)}")
+            continue
+
+        subdirs = []
+        with it:
+            for entry in it:
+                name = entry.name
+                rel_path = f"{rel_dir}/{name}" if rel_dir else name
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                except OSError:
+                    continue
+
+                if is_dir:
+                    if recursive and not name.startswith('.') and not _matches(rel_path, exclude):
+                        subdirs.append(rel_path)
+                    continue
+
+                if os.path.splitext(name.lower())[1] not in formats or name.startswith('._'):
+                    continue
+                if include and not _matches(rel_path, include):
+                    continue
+                if exclude and _matches(rel_path, exclude):
+                    continue
+                yield rel_path.replace("/", os.sep)
+
+        # 逆序压栈，按目录列举顺序深度优先
+        stack.extend(reversed(subdirs))
@@ -0,0 +1,193 @@
+# server.py
+import asyncio
+import os
+import queue
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import asynccontextmanager
+from typing import Callable, List, Optional
+
+from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel
+
+from quality import REASON_LABELS
+
+
+class DynamicBatcher:
+    """动态批处理: 在window秒内收集并发请求，合并为一次caption_batch调用
+
+    请求进入容量为queue_size的有界队列，队列满时submit抛出queue.Full (由HTTP层返回429)。
+    只有一个后台线程调用caption_batch，模型调用天然串行。
+    """
+
+    def __init__(self, caption_batch: Callable[[List[str]], List[Optional[str]]], max_batch: int = 8,
+                 window: float = 0.02, queue_size: int = 64):
+        self.caption_batch = caption_batch
+        self.max_batch = max(1, int(max_batch))
+        self.window = max(0.0, float(window))
+        self.queue_size = max(1, int(queue_size))
+        self.batches = 0
+        self.processed = 0
+        self._queue = queue.Queue(maxsize=self.queue_size)
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._loop, name="caption-batcher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def submit(self, image_path: str) -> Future:
+        """提交一张图片，返回Future (结果为caption或None)；队列满时抛出queue.Full"""
+        future = Future()
+        self._queue.put_nowait((image_path, future))
+        return future
+
+    def _collect(self) -> list:
+        """阻塞等待第一个请求，随后在window内继续收集，最多max_batch个"""
+        while not self._stopped.is_set():
+            try:
+                batch = [self._queue.get(timeout=0.5)]
+                break
+            except queue.Empty:
+                continue
+        else:
+            return []
+
+        deadline = time.time() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.time()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self) -> None:
+        while not self._stopped.is_set():
+            batch = self._collect()
+            if not batch:
+                continue
+            try:
+                captions = self.caption_batch([path for path, _ in batch])
+                for (_, future), caption in zip(batch, captions):
+                    future.set_result(caption)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            self.batches += 1
+            self.processed += len(batch)
+
+
+class CaptionRequest(BaseModel):
+    path: str
+    trigger_word: Optional[str] = None
+
+
+def _with_trigger(caption: str, trigger_word: Optional[str]) -> str:
+    if trigger_word and trigger_word.strip():
+        return trigger_word.strip() + "," + caption
+    return caption
+
+
+def _is_within(root: str, path: str) -> bool:
+    try:
+        return os.path.commonpath([root, path]) == root
+    except ValueError:
+        # Windows下不同盘符的路径没有公共前缀
+        return False
+
+
+def create_app(batcher: DynamicBatcher, allowed_root: Optional[str] = None, registry=None,
+               validator=None) -> FastAPI:
+    """创建HTTP服务: POST /caption (本地路径)、POST /caption/upload (上传图片)、GET /health
+
+    allowed_root不为None时，/caption只允许访问该目录下的文件。
+    registry (metrics.MetricsRegistry) 已启用时提供 GET /metrics (Prometheus文本格式) 并记录请求指标。
+    validator (quality.CaptionValidator) 不为None时，未通过质量检查的caption与生成失败一样返回422。
+    """
+    @asynccontextmanager
+    async def lifespan(_app):
+        batcher.start()
+        yield
+        batcher.stop()
+
+    app = FastAPI(title="Qwen3-VL中文打标服务", lifespan=lifespan)
+    root = os.path.realpath(allowed_root) if allowed_root else None
+
+    async def _caption(image_path: str, trigger_word: Optional[str]) -> dict:
+        try:
+            future = batcher.submit(image_path)
+        except queue.Full:
+            _record("rejected")
+            raise HTTPException(status_code=429, detail="请求队列已满，请稍后重试")
+
+        start = time.time()
+        caption = await asyncio.wrap_future(future)
+        elapsed = time.time() - start
+        if not caption:
+            _record("failed", elapsed)
+            raise HTTPException(status_code=422, detail="caption生成失败")
+        reason = validator.check(caption) if validator is not None else None
+        if reason:
+            _record("failed", elapsed)
+            raise HTTPException(status_code=422, detail=f"caption未通过质量检查: {REASON_LABELS[reason]}")
+        _record("ok", elapsed)
+        return {"caption": _with_trigger(caption, trigger_word), "elapsed": round(elapsed, 3)}
+
+    def _record(status: str, elapsed: Optional[float] = None) -> None:
+        if registry is None:
+            return
+        registry.inc("requests_total", status=status)
+        if elapsed is not None:
+            registry.observe("stage_seconds", elapsed, stage="request")
+
+    @app.get("/health")
+    def health():
+        return {
+            "status": "ok",
+            "pending": batcher.pending(),
+            "queue_size": batcher.queue_size,
+            "batches": batcher.batches,
+            "processed": batcher.processed
+        }
+
+    if registry is not None and registry.enabled:
+        registry.gauge_fn("request_queue_depth", batcher.pending)
+
+        @app.get("/metrics", response_class=PlainTextResponse)
+        def prometheus_metrics():
+            return registry.render()
+
+    @app.post("/caption")
+    async def caption_path(req: CaptionRequest):
+        image_path = os.path.realpath(req.path)
+        if root and not _is_within(root, image_path):
+            raise HTTPException(status_code=403, detail="路径不在允许的目录内")
+        if not os.path.isfile(image_path):
+            raise HTTPException(status_code=404, detail=f"文件不存在: {req.path}")
+        return await _caption(image_path, req.trigger_word)
+
+    @app.post("/caption/upload")
+    async def caption_upload(file: UploadFile = File(...), trigger_word: Optional[str] = Form(None)):
+        suffix = os.path.splitext(file.filename or "")[1] or ".img"
+        fd, tmp_path = tempfile.mkstemp(prefix="caption_", suffix=suffix)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(await file.read())
+            return await _caption(tmp_path, trigger_word)
+        finally:
+            os.remove(tmp_path)
+
+    return app
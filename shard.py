@@ -0,0 +1,139 @@
+# shard.py
+import hashlib
+import json
+import os
+import socket
+import time
+import uuid
+import zlib
+from typing import Dict, Tuple
+
+LEASE_DIR_NAME = ".caption_leases"
+
+
+def parse_shard(spec: str) -> Tuple[int, int]:
+    """解析分片参数 "i/N" (i从0开始)"""
+    try:
+        index, count = (int(x) for x in spec.split("/"))
+    except ValueError:
+        raise ValueError(f"分片格式错误: '{spec}'，应为 i/N，例如 0/4")
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"分片编号超出范围: '{spec}' (要求 0 <= i < N)")
+    return index, count
+
+
+def in_shard(name: str, index: int, count: int) -> bool:
+    """按文件名稳定hash确定所属分片，与目录列举顺序及节点无关"""
+    return zlib.crc32(name.encode("utf-8")) % count == index
+
+
+class LeaseManager:
+    """基于租约文件的分布式任务认领
+
+    每张图片对应 <folder>/.caption_leases/<相对路径hash>.lease，通过O_EXCL原子创建完成认领，
+    多个节点/进程在共享文件系统上互不重复处理。持有者定期刷新租约mtime；
+    超过ttl未刷新的租约视为持有节点已失效，可被其他节点回收重新认领。
+    """
+
+    def __init__(self, folder_path: str, ttl: float = 600.0):
+        self.lease_dir = os.path.join(folder_path, LEASE_DIR_NAME)
+        self.ttl = ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.held: Dict[str, str] = {}
+        self._last_refresh = time.time()
+        os.makedirs(self.lease_dir, exist_ok=True)
+
+    def _lease_path(self, name: str) -> str:
+        # 按/分隔的相对路径hash命名，不同目录层级的同名拼接不会冲突，各操作系统的节点结果一致
+        digest = hashlib.sha1(name.replace(os.sep, "/").encode("utf-8")).hexdigest()
+        return os.path.join(self.lease_dir, digest + ".lease")
+
+    def _stale_stat(self, path: str):
+        """租约已过期时返回其stat结果，未过期或不存在返回None"""
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return st if time.time() - st.st_mtime > self.ttl else None
+
+    def _break_stale(self, path: str, seen) -> None:
+        """回收过期租约: 持有 <租约>.breaking 锁 (O_EXCL创建) 时才删除，并发回收时只有一个节点删除
+
+        持锁后再次确认租约仍是判定过期时的同一文件 (inode/mtime未变)，
+        期间被其他节点回收并重新创建的新租约不会被误删。
+        """
+        lock = path + ".breaking"
+        try:
+            fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            # 回收中的节点崩溃会遗留锁文件，超过ttl后清理，由下一次认领重新回收
+            if self._stale_stat(lock) is not None:
+                try:
+                    os.remove(lock)
+                except FileNotFoundError:
+                    pass
+            return
+        os.close(fd)
+        try:
+            current = self._stale_stat(path)
+            if current is not None and (current.st_ino, current.st_mtime) == (seen.st_ino, seen.st_mtime):
+                os.remove(path)
+        finally:
+            os.remove(lock)
+
+    def claim(self, name: str) -> bool:
+        """尝试认领任务，成功返回True"""
+        path = self._lease_path(name)
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                seen = self._stale_stat(path)
+                if seen is None:
+                    return False
+                self._break_stale(path, seen)
+                continue
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"owner": self.owner, "name": name, "claimed_at": time.time()}, f)
+            self.held[name] = path
+            return True
+        return False
+
+    def release(self, name: str) -> None:
+        """释放租约 (完成或放弃任务后调用)"""
+        path = self.held.pop(name, None)
+        if path is None or self._owner_of(path) != self.owner:
+            return
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def refresh_if_due(self, force: bool = False) -> None:
+        """距上次刷新超过ttl/3时刷新所有持有租约的mtime (心跳)"""
+        now = time.time()
+        if not force and now - self._last_refresh < self.ttl / 3:
+            return
+        self._last_refresh = now
+        for name, path in list(self.held.items()):
+            if self._owner_of(path) != self.owner:
+                # 租约已被其他节点回收 (本节点心跳过慢)，放弃持有
+                self.held.pop(name, None)
+                continue
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                self.held.pop(name, None)
+
+    @staticmethod
+    def _owner_of(path: str):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f).get("owner")
+        except (OSError, ValueError):
+            return None
+
+    def release_all(self) -> None:
+        """释放全部持有的租约"""
+        for name in list(self.held):
+            self.release(name)
@@ -0,0 +1,41 @@
+# stub_model.py
+import os
+import time
+from typing import List, Optional
+
+from PIL import Image
+
+
+class StubCaptioner:
+    """桩模型: 不加载权重，按图片尺寸生成确定性中文caption
+
+    用于在无GPU/无模型权重的环境下测试调度、服务与基准流程。
+    delay模拟每张图片的生成耗时 (秒)。
+    """
+
+    def __init__(self, delay: float = 0.05):
+        self.delay = delay
+
+    def caption(self, image_path: str) -> Optional[str]:
+        """生成单张图片的caption，图片无法解码时返回None"""
+        try:
+            with Image.open(image_path) as img:
+                img.load()
+                width, height = img.size
+                mode = img.mode
+        except Exception as e:
+            print(f"❌ 处理 {os.path.basename(image_path)} 时出错: {str(e)}")
+            return None
+
+        if self.delay > 0:
+            time.sleep(self.delay)
+
+        orientation = "横向" if width > height else ("竖向" if height > width else "方形")
+        return (
+            f"一张{orientation}构图的测试图片,画面尺寸为{width}x{height}像素,色彩模式为{mode},"
+            f"文件名为{os.path.basename(image_path)},由桩模型生成的占位中文描述"
+        )
+
+    def caption_batch(self, image_paths: List[str]) -> List[Optional[str]]:
+        """批量接口，与generate_chinese_captions_batch保持一致"""
+        return [self.caption(image_path) for image_path in image_paths]
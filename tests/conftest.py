@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pytest
+
+# 测试直接导入仓库根目录下的模块
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope="session")
+def tiny_models(tmp_path_factory):
+    """tiny_model.py生成的随机小模型 (target, draft) 目录；缺少torch/transformers或源模型配置时跳过
+
+    源模型目录 (只读取config与tokenizer/预处理配置) 默认为 qwen3_vl_models/，可用 TINY_MODEL_SOURCE 指定。
+    """
+    pytest.importorskip("torch")
+    pytest.importorskip("transformers")
+    source = os.environ.get("TINY_MODEL_SOURCE", os.path.join(ROOT, "qwen3_vl_models"))
+    if not os.path.exists(os.path.join(source, "config.json")):
+        pytest.skip(f"缺少源模型配置: {source}")
+
+    from tiny_model import make_tiny_checkpoint
+
+    output = tmp_path_factory.mktemp("tiny_models")
+    target = make_tiny_checkpoint(source, str(output / "target"), num_layers=2)
+    draft = make_tiny_checkpoint(source, str(output / "draft"), num_layers=1, seed=1)
+    return target, draft
@@ -0,0 +1,20 @@
+from bench_caption import STAGES, summarize
+
+
+def test_decode_rate_excludes_prefill_token():
+    stage_times = dict.fromkeys(STAGES, 0.0)
+    stage_times.update(prefill=0.5, decode_tokens=2.0, generate=2.5)
+    records = [{"images": 2, "failed": 0, "latency": 1.0}]
+    # 2个样本各生成21个token: 首token归入prefill，其余40个token耗时2秒
+    result = summarize(records, 3.0, stage_times, tokens=42, rows=2, prefills=1)
+    assert result["decode_tokens_per_sec"] == 20.0
+    assert result["prefill_ms_mean"] == 500.0
+    assert result["tokens_per_sec"] == round(42 / 2.5, 2)
+
+
+def test_stub_run_has_no_decode_rate():
+    stage_times = dict.fromkeys(STAGES, 0.0)
+    records = [{"images": 1, "failed": 0, "latency": 0.1}]
+    result = summarize(records, 0.1, stage_times, tokens=0)
+    assert result["decode_tokens_per_sec"] is None
+    assert result["prefill_ms_mean"] is None
@@ -0,0 +1,38 @@
+from bucketing import bucket_batches, fixed_batches
+
+# 三种尺寸交替到达 (视觉token数估计值)
+COSTS = (64, 256, 1024)
+
+
+def _items(count):
+    return [(i, COSTS[i % len(COSTS)]) for i in range(count)]
+
+
+def _cost(item):
+    return item[1]
+
+
+def test_batches_are_homogeneous_and_cover_every_item():
+    items = _items(24)
+    batches = list(bucket_batches(iter(items), 4, _cost, window=12))
+
+    assert all(len({_cost(item) for item in batch}) == 1 for batch in batches)
+    assert sorted(item for batch in batches for item in batch) == items
+
+
+def test_leftovers_carry_over_and_are_flushed_at_end():
+    items = _items(10)
+    batches = list(bucket_batches(iter(items), 4, _cost, window=4))
+
+    assert [len(batch) for batch in batches[:-1]] == [4] * (len(batches) - 1)
+    assert 0 < len(batches[-1]) <= 4
+    assert sorted(item for batch in batches for item in batch) == items
+
+
+def test_bucketing_reduces_padding():
+    items = _items(48)
+
+    def padded(batches):
+        return sum(max(map(_cost, batch)) * len(batch) for batch in batches)
+
+    assert padded(bucket_batches(items, 4, _cost, window=48)) < padded(fixed_batches(items, 4))
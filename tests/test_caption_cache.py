@@ -0,0 +1,26 @@
+from PIL import Image
+
+import app
+from caption_cache import CaptionCache
+
+GOOD = "一只橘色的猫趴在木质窗台上晒太阳，毛色橙白相间，眼睛半闭，身后是浅色的窗帘与明亮的室外光线，画面温暖安静。"
+
+
+def test_cached_caption_failing_validation_is_a_miss(tmp_path, monkeypatch):
+    paths = []
+    for i in range(2):
+        path = str(tmp_path / f"img_{i}.png")
+        Image.new("RGB", (32 + i, 32)).save(path)
+        paths.append(path)
+
+    cache = CaptionCache(str(tmp_path / "captions.sqlite"))
+    cache.set_context("test")
+    monkeypatch.setattr(app, "caption_cache", cache)
+    # 旧规则 (长度 > 30) 下写入的短caption
+    cache.put(cache.image_hash(paths[0]), "一只猫" * 4)
+    cache.put(cache.image_hash(paths[1]), GOOD)
+
+    hashes, cached = app._lookup_cached(paths)
+    cache.close()
+    assert all(hashes)
+    assert cached == {1: GOOD}
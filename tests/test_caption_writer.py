@@ -0,0 +1,23 @@
+import os
+
+import caption_writer
+from caption_writer import CaptionWriter
+from metrics import MetricsRegistry
+
+
+def test_success_counted_only_after_write(tmp_path, monkeypatch):
+    registry = MetricsRegistry()
+    registry.enable()
+    monkeypatch.setattr(caption_writer, "metrics", registry)
+
+    writer = CaptionWriter()
+    writer.submit("ok.png", str(tmp_path / "ok.txt"), "描述", status="success")
+    writer.submit("cached.png", str(tmp_path / "cached.txt"), "描述", status="cached")
+    writer.submit("bad.png", str(tmp_path / "missing" / "bad.txt"), "描述", status="success")
+    writer.close()
+
+    assert os.path.exists(tmp_path / "ok.txt")
+    assert [name for name, _ in writer.drain_errors()] == ["bad.png"]
+    rendered = registry.render()
+    assert 'caption_images_total{status="success"} 1' in rendered
+    assert 'caption_images_total{status="cached"} 1' in rendered
@@ -0,0 +1,58 @@
+from decoding import CaptionStoppingCriteria, FirstTokenTimer, soft_char_limit
+
+
+class _ByteTokenizer:
+    """每个token为UTF-8的一个字节 (模拟字节级BPE把汉字拆成多个token)"""
+
+    def decode(self, tokens, skip_special_tokens=True):
+        return bytes(tokens).decode("utf-8", errors="replace")
+
+
+def _feed(criteria, text, step=1):
+    data = list(text.encode("utf-8"))
+    for i in range(0, len(data), step):
+        reason = criteria._check(0, data[i:i + step], [])
+        if reason:
+            return reason
+    return None
+
+
+def _criteria(**kwargs):
+    criteria = CaptionStoppingCriteria(_ByteTokenizer(), prompt_len=0, **kwargs)
+    criteria._chars, criteria._pending, criteria.row_reasons = [0], [[]], [None]
+    return criteria
+
+
+def test_split_cjk_characters_counted_once():
+    criteria = _criteria()
+    assert _feed(criteria, "一只橘猫趴在窗台上") is None
+    assert criteria._chars[0] == 9
+
+
+def test_newline_rule_is_opt_in():
+    outline = "主体: 一只橘猫趴在窗台上晒太阳，毛色橙白相间，眼睛半闭，神态慵懒放松，看起来十分惬意舒适。\n背景: 木质窗框"
+    assert _feed(_criteria(), outline) is None
+    assert _feed(_criteria(stop_at_newline=True), outline) == "complete"
+
+
+def test_sentence_end_after_soft_max():
+    criteria = _criteria(soft_max_chars=10)
+    assert _feed(criteria, "一只橘猫趴在窗台上晒太阳。", step=2) == "length"
+
+
+def test_first_token_timer_records_only_first_call():
+    synced = []
+    timer = FirstTokenTimer(sync=lambda: synced.append(1))
+    scores = object()
+    assert timer(None, scores) is scores
+    first = timer.time
+    timer(None, scores)
+    assert first is not None and timer.time == first
+    assert synced == [1]
+
+
+def test_soft_limit_leaves_room_before_max_new_tokens():
+    # 中文约每字一个token: 软上限等于max_new_tokens时，触发前就已生成满被截断
+    assert soft_char_limit(300) < 300
+    assert soft_char_limit(450) > soft_char_limit(300)
+    assert soft_char_limit(16) == 40
@@ -0,0 +1,10 @@
+import dedup
+
+
+def test_clusters_are_anchored_to_representative(monkeypatch):
+    # A-B、B-C 均相距3位，A-C相距6位: 阈值3时C不能经由B并入A所在的组
+    hashes = {"A.png": (0, 300), "B.png": (0b111, 200), "C.png": (0b111111, 100), "D.png": (0b111110, 90)}
+    monkeypatch.setattr(dedup, "compute_phashes",
+                        lambda paths, num_workers=0: {p: hashes[p.rsplit("/", 1)[-1]] for p in paths})
+
+    assert dedup.find_near_duplicates("/data", list(hashes), threshold=3) == [["A.png", "B.png"], ["C.png", "D.png"]]
@@ -0,0 +1,72 @@
+import glob
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+from PIL import Image
+
+from config import Config
+from conftest import ROOT
+
+
+def _run(folder, *extra):
+    return [sys.executable, "app.py", "--folder", str(folder), "--stub-model", "--dp-workers", "1",
+            "--no-caption-cache", *extra]
+
+
+def _app(folder, cache_dir, *extra):
+    """运行到结束 (运行日志写入cache_dir，不污染项目缓存)"""
+    subprocess.run(_run(folder, *extra), cwd=ROOT, env={**os.environ, "CAPTION_CACHE_DIR": cache_dir}, check=True,
+                   stdout=subprocess.DEVNULL, timeout=300)
+
+
+def _journal_records(journal_dir, known=()):
+    """新增运行日志中的逐张记录 (跳过known中已读过的日志文件)"""
+    records = []
+    for path in sorted(set(glob.glob(os.path.join(journal_dir, "*.jsonl"))) - set(known)):
+        with open(path, encoding="utf-8") as f:
+            records += [r for r in map(json.loads, f) if "file" in r]
+    return records
+
+
+def test_interrupted_run_resumes_where_it_stopped(tmp_path, monkeypatch):
+    folder = tmp_path / "images"
+    folder.mkdir()
+    names = [f"img_{i:02d}.png" for i in range(40)]
+    for i, name in enumerate(names):
+        Image.new("RGB", (32 + i, 32)).save(folder / name)
+    (folder / "broken.png").write_bytes(b"not an image")
+    cache_dir = str(tmp_path / "cache")
+    monkeypatch.setattr(Config, "CACHE_DIR", cache_dir)
+    journal_dir = Config.get_journal_dir(str(folder))
+
+    def captioned():
+        return {name for name in names if os.path.exists(folder / (os.path.splitext(name)[0] + ".txt"))}
+
+    # 桩模型每张0.05秒: 写出几张描述后强制结束整个进程组 (模拟被调度器kill)
+    proc = subprocess.Popen(_run(folder), cwd=ROOT, env={**os.environ, "CAPTION_CACHE_DIR": cache_dir},
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+    deadline = time.time() + 60
+    while len(captioned()) < 5 and time.time() < deadline:
+        time.sleep(0.02)
+    os.killpg(proc.pid, signal.SIGKILL)
+    proc.wait(timeout=30)
+    done = captioned()
+    assert 5 <= len(done) < len(names)
+
+    # 重新运行同一命令: 只为剩余图片打标，已写出的描述不再生成
+    first_runs = glob.glob(os.path.join(journal_dir, "*.jsonl"))
+    _app(folder, cache_dir, "--max-retries", "1")
+    records = _journal_records(journal_dir, first_runs)
+    assert sorted(r["file"] for r in records if r["status"] == "success") == sorted(set(names) - done)
+    assert captioned() == set(names)
+
+    # 坏图每次运行都失败: 中断前的运行未必记录到它，再跑到累计失败超过上限后不再重试
+    for _ in range(2):
+        _app(folder, cache_dir, "--max-retries", "1")
+    known = glob.glob(os.path.join(journal_dir, "*.jsonl"))
+    _app(folder, cache_dir, "--max-retries", "1")
+    assert _journal_records(journal_dir, known) == []
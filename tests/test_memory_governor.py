@@ -0,0 +1,68 @@
+import app
+from memory_governor import MIN_VISION_SCALE, MemoryGovernor
+
+
+def _succeed(governor, times):
+    for _ in range(times):
+        governor.on_success()
+
+
+def test_backoff_halves_batch_then_resolution():
+    governor = MemoryGovernor()
+    governor.on_oom(8)
+    assert governor.batch_limit == 4 and governor.fits(4) and not governor.fits(8)
+    governor.on_oom(4)
+    assert governor.batch_limit == 2
+
+    scales = []
+    for _ in range(4):
+        governor.on_oom(1)
+        scales.append(governor.vision_scale)
+    assert scales == [0.5, MIN_VISION_SCALE, MIN_VISION_SCALE, MIN_VISION_SCALE]
+    assert governor.batch_limit == 1 and governor.at_floor and not governor.fits(1)
+
+
+def test_ramp_up_restores_resolution_then_batch():
+    governor = MemoryGovernor(ramp_after=16)
+    governor.on_oom(8)
+    governor.on_oom(4)
+    governor.on_oom(1)
+
+    _succeed(governor, 15)
+    assert governor.vision_scale == 0.5
+    _succeed(governor, 1)
+    assert governor.vision_scale == 1.0 and governor.batch_limit == 1
+
+    limits = []
+    for _ in range(3):
+        _succeed(governor, 16)
+        limits.append(governor.batch_limit)
+    # 翻倍直到达到OOM前的批次 (8) 时取消上限
+    assert limits == [2, 4, None] and governor.fits(8)
+
+
+def test_oom_resets_success_streak():
+    governor = MemoryGovernor(ramp_after=16)
+    governor.on_oom(1)
+    _succeed(governor, 15)
+    governor.on_oom(1)
+    _succeed(governor, 15)
+    assert governor.vision_scale == MIN_VISION_SCALE
+
+
+def test_single_image_retries_once_at_floor(monkeypatch):
+    governor = MemoryGovernor()
+    for _ in range(2):
+        governor.on_oom(1)
+    assert governor.at_floor
+    calls = []
+
+    def oom(*args):
+        calls.append(governor.vision_scale)
+        raise MemoryError("out of memory")
+
+    monkeypatch.setattr(app, "memory_governor", governor)
+    monkeypatch.setattr(app, "_generate_single", oom)
+    assert app.generate_chinese_caption("img.png") is None
+    # 已在最低分辨率: 清理后仍重试一次，而不是第一次OOM就放弃
+    assert calls == [MIN_VISION_SCALE, MIN_VISION_SCALE]
@@ -0,0 +1,52 @@
+import os
+import time
+
+from model_snapshot import ModelSnapshot, snapshot_variant
+
+
+class _Weights:
+    """只实现save_pretrained的模型 (验证快照的元数据与失效判断)"""
+
+    def save_pretrained(self, path, safe_serialization=True):
+        with open(os.path.join(path, "model.safetensors"), "wb") as f:
+            f.write(b"weights")
+
+
+def test_snapshot_invalidated_when_source_changes(tmp_path):
+    source = tmp_path / "model"
+    source.mkdir()
+    (source / "config.json").write_text("{}", encoding="utf-8")
+    snapshot = ModelSnapshot(str(source), "float32-cpu")
+    assert not snapshot.is_valid()
+
+    assert snapshot.save(_Weights())
+    assert snapshot.is_valid() and (snapshot.path / "model.safetensors").exists()
+    # 已有有效快照时不重复写入
+    assert not snapshot.save(_Weights())
+
+    later = time.time() + 10
+    os.utime(source / "config.json", (later, later))
+    assert not snapshot.is_valid()
+    assert snapshot.mismatch_reason() == "源模型文件已变化"
+
+
+def test_tiny_model_snapshot_round_trip(tiny_models):
+    import torch
+    from PIL import Image
+    from transformers import AutoProcessor, Qwen3VLForConditionalGeneration
+
+    path = tiny_models[0]
+    model = Qwen3VLForConditionalGeneration.from_pretrained(path, torch_dtype=torch.float32).eval()
+    processor = AutoProcessor.from_pretrained(path)
+    snapshot = ModelSnapshot(path, snapshot_variant(False, "cpu", torch.float32))
+    assert snapshot.save(model) and snapshot.is_valid()
+    restored = Qwen3VLForConditionalGeneration.from_pretrained(str(snapshot.path), torch_dtype=torch.float32).eval()
+
+    messages = [{"role": "user", "content": [{"type": "image"}, {"type": "text", "text": "描述这张图片"}]}]
+    text = processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+    image = Image.radial_gradient("L").convert("RGB").resize((64, 64))
+    inputs = processor(text=[text], images=[image], return_tensors="pt")
+    with torch.no_grad():
+        reference = model.generate(**inputs, max_new_tokens=16, do_sample=False)
+        loaded = restored.generate(**inputs, max_new_tokens=16, do_sample=False)
+    assert torch.equal(reference, loaded)
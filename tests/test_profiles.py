@@ -0,0 +1,37 @@
+import os
+
+from PIL import Image
+
+import app
+
+GOOD = "一张横向构图的测试图片,画面中央是一只橘色的猫趴在木质窗台上,背景是模糊的绿色植物与柔和的自然光线"
+
+
+def test_existing_profile_files_skip_generation_and_retries(tmp_path, monkeypatch):
+    for i in range(2):
+        Image.new("RGB", (32, 32)).save(tmp_path / f"img_{i}.png")
+    # img_0已有short描述: 批内仍有img_1缺少，short照常生成，但img_0的结果不做质量检查与重试
+    (tmp_path / "img_0.short.txt").write_text("已有描述", encoding="utf-8")
+    (tmp_path / "img_0.long.txt").write_text("已有描述", encoding="utf-8")
+    (tmp_path / "img_1.long.txt").write_text("已有描述", encoding="utf-8")
+
+    prepared, generated, retried = [], [], []
+    monkeypatch.setattr(app, "load_qwen3_model", lambda **kwargs: None)
+    monkeypatch.setattr(app, "prepare_profile_inputs",
+                        lambda paths, prompts: prepared.append(list(prompts)) or ([{}] * len(prompts), [0, 1]))
+
+    def fake_generate(image_paths, prompts, profile_inputs, valid_indices):
+        generated.append(list(prompts))
+        return [["bad"] * len(image_paths) for _ in prompts]
+
+    monkeypatch.setattr(app, "generate_profile_captions", fake_generate)
+    monkeypatch.setattr(app, "generate_chinese_caption",
+                        lambda path, prompt=None, **kwargs: retried.append(os.path.basename(path)) or GOOD)
+
+    app.process_images_profiles(str(tmp_path), "", [("short", "简短描述"), ("long", "详细描述")],
+                                batch_size=2, prefetch_workers=1)
+
+    assert prepared == [["简短描述"]] and generated == [["简短描述"]]
+    assert retried == ["img_1.png"]
+    assert (tmp_path / "img_0.short.txt").read_text(encoding="utf-8") == "已有描述"
+    assert (tmp_path / "img_1.short.txt").read_text(encoding="utf-8").endswith(GOOD)
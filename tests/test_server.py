@@ -0,0 +1,105 @@
+import os
+import threading
+import time
+
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from quality import CaptionValidator
+from server import DynamicBatcher, _is_within, create_app
+from stub_model import StubCaptioner
+
+
+def _make_images(folder, count):
+    paths = []
+    for i in range(count):
+        path = os.path.join(folder, f"img_{i}.png")
+        Image.new("RGB", (48 + i, 32)).save(path)
+        paths.append(path)
+    return paths
+
+
+def test_concurrent_requests_are_batched(tmp_path):
+    stub = StubCaptioner(delay=0.0)
+    sizes = []
+
+    def caption_batch(paths):
+        sizes.append(len(paths))
+        time.sleep(0.05)
+        return stub.caption_batch(paths)
+
+    paths = _make_images(str(tmp_path), 6)
+    batcher = DynamicBatcher(caption_batch, max_batch=8, window=0.3, queue_size=16)
+    responses = {}
+    with TestClient(create_app(batcher, allowed_root=str(tmp_path))) as client:
+        def request(path):
+            responses[path] = client.post("/caption", json={"path": path, "trigger_word": "xxg"})
+
+        threads = [threading.Thread(target=request, args=(path,)) for path in paths]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=30)
+        health = client.get("/health").json()
+
+    assert all(r.status_code == 200 and r.json()["caption"].startswith("xxg,") for r in responses.values())
+    assert sum(sizes) == len(paths) and max(sizes) > 1
+    assert health["processed"] == len(paths) and health["batches"] == len(sizes)
+
+
+def test_full_queue_returns_429(tmp_path):
+    started, release = threading.Event(), threading.Event()
+    stub = StubCaptioner(delay=0.0)
+
+    def caption_batch(paths):
+        started.set()
+        release.wait(timeout=30)
+        return stub.caption_batch(paths)
+
+    paths = _make_images(str(tmp_path), 3)
+    batcher = DynamicBatcher(caption_batch, max_batch=1, window=0.0, queue_size=1)
+    statuses = []
+    with TestClient(create_app(batcher)) as client:
+        def request(path):
+            statuses.append(client.post("/caption", json={"path": path}).status_code)
+
+        # 第一个请求被取出后阻塞在生成中，第二个占满队列，第三个被拒绝
+        first = threading.Thread(target=request, args=(paths[0],))
+        first.start()
+        assert started.wait(timeout=10)
+        second = threading.Thread(target=request, args=(paths[1],))
+        second.start()
+        deadline = time.time() + 10
+        while batcher.pending() < 1 and time.time() < deadline:
+            time.sleep(0.01)
+
+        assert client.post("/caption", json={"path": paths[2]}).status_code == 429
+        release.set()
+        first.join(timeout=30)
+        second.join(timeout=30)
+
+    assert statuses == [200, 200]
+
+
+def test_path_outside_root_is_forbidden(tmp_path):
+    allowed = tmp_path / "allowed"
+    allowed.mkdir()
+    outside = _make_images(str(tmp_path), 1)[0]
+    batcher = DynamicBatcher(StubCaptioner(delay=0.0).caption_batch)
+    with TestClient(create_app(batcher, allowed_root=str(allowed))) as client:
+        assert client.post("/caption", json={"path": outside}).status_code == 403
+
+
+def test_unrelated_paths_are_not_within_root():
+    # commonpath对无公共前缀的路径 (Windows不同盘符，或绝对/相对路径混用) 抛出ValueError
+    assert not _is_within(os.path.abspath("allowed"), "relative/img.png")
+
+
+def test_caption_failing_quality_check_returns_422(tmp_path):
+    path = _make_images(str(tmp_path), 1)[0]
+    # 非空但过短、且为英文的caption: 不是生成失败，却不应作为成功结果返回
+    batcher = DynamicBatcher(lambda paths: ["a photo"] * len(paths))
+    with TestClient(create_app(batcher, validator=CaptionValidator())) as client:
+        response = client.post("/caption", json={"path": path})
+    assert response.status_code == 422
+    assert "质量检查" in response.json()["detail"]
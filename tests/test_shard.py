@@ -0,0 +1,117 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+from PIL import Image
+
+from conftest import ROOT
+from shard import LeaseManager, parse_shard
+
+CLAIM_SCRIPT = """
+import json, sys
+from shard import LeaseManager
+leases = LeaseManager(sys.argv[1], ttl=600)
+print(json.dumps([name for name in json.loads(sys.argv[2]) if leases.claim(name)]))
+"""
+
+
+def test_parse_shard_rejects_invalid():
+    assert parse_shard("1/4") == (1, 4)
+    for spec in ("4/4", "-1/2", "a/b", "1"):
+        with pytest.raises(ValueError):
+            parse_shard(spec)
+
+
+def test_lease_paths_do_not_collide(tmp_path):
+    leases = LeaseManager(str(tmp_path))
+    names = [os.path.join("a", "b__c.jpg"), os.path.join("a__b", "c.jpg"), "a__b__c.jpg"]
+    assert len({leases._lease_path(name) for name in names}) == len(names)
+    for name in names:
+        assert leases.claim(name)
+
+
+def test_concurrent_processes_claim_disjoint(tmp_path):
+    names = [f"img_{i:03d}.jpg" for i in range(200)]
+    procs = [subprocess.Popen([sys.executable, "-c", CLAIM_SCRIPT, str(tmp_path), json.dumps(names)],
+                              cwd=ROOT, stdout=subprocess.PIPE, text=True) for _ in range(4)]
+    claimed = [json.loads(proc.communicate(timeout=60)[0]) for proc in procs]
+
+    flat = [name for names_claimed in claimed for name in names_claimed]
+    assert sorted(flat) == names
+
+
+def _age(path, seconds):
+    past = time.time() - seconds
+    os.utime(path, (past, past))
+
+
+def test_stale_lease_is_reclaimed(tmp_path):
+    dead = LeaseManager(str(tmp_path), ttl=60)
+    assert dead.claim("a.jpg")
+    _age(dead.held["a.jpg"], 120)
+
+    alive = LeaseManager(str(tmp_path), ttl=60)
+    assert alive.claim("a.jpg")
+    assert LeaseManager._owner_of(alive.held["a.jpg"]) == alive.owner
+    assert not os.path.exists(alive.held["a.jpg"] + ".breaking")
+
+
+def test_break_stale_keeps_lease_recreated_by_another_node(tmp_path):
+    dead = LeaseManager(str(tmp_path), ttl=60)
+    assert dead.claim("a.jpg")
+    path = dead.held["a.jpg"]
+    _age(path, 120)
+    seen = os.stat(path)
+
+    # 判定过期后、回收前，第三个节点已回收并重新认领
+    os.remove(path)
+    third = LeaseManager(str(tmp_path), ttl=60)
+    assert third.claim("a.jpg")
+
+    LeaseManager(str(tmp_path), ttl=60)._break_stale(path, seen)
+    assert LeaseManager._owner_of(path) == third.owner
+
+
+def test_leftover_breaking_lock_expires(tmp_path):
+    dead = LeaseManager(str(tmp_path), ttl=60)
+    assert dead.claim("a.jpg")
+    path = dead.held["a.jpg"]
+    _age(path, 120)
+    open(path + ".breaking", "w").close()
+    _age(path + ".breaking", 120)
+
+    # 第一次只清理遗留的锁文件，第二次正常回收
+    other = LeaseManager(str(tmp_path), ttl=60)
+    assert not other.claim("a.jpg")
+    assert other.claim("a.jpg")
+
+
+def test_lease_nodes_caption_each_image_once(tmp_path):
+    folder = tmp_path / "images"
+    os.makedirs(folder / "sub")
+    names = [f"img_{i:02d}.png" for i in range(8)] + [os.path.join("sub", f"img_{i:02d}.png") for i in range(4)]
+    for i, name in enumerate(names):
+        Image.new("RGB", (32 + i, 32)).save(folder / name)
+
+    procs = []
+    for node in range(3):
+        cmd = [sys.executable, "app.py", "--folder", str(folder), "--recursive", "--stub-model",
+               "--dp-workers", "1", "--lease", "--no-caption-cache", "--no-journal",
+               "--metadata-jsonl", str(tmp_path / f"node{node}.jsonl")]
+        procs.append(subprocess.Popen(cmd, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True))
+    for proc in procs:
+        _, stderr = proc.communicate(timeout=300)
+        assert proc.returncode == 0, stderr
+
+    captioned = []
+    for node in range(3):
+        path = tmp_path / f"node{node}.jsonl"
+        if path.exists():
+            captioned += [json.loads(line)["file"] for line in path.read_text(encoding="utf-8").splitlines()]
+    assert sorted(captioned) == sorted(names)
+    for name in names:
+        assert (folder / name).with_suffix(".txt").stat().st_size > 0
+    assert not os.listdir(folder / ".caption_leases")
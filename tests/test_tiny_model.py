@@ -0,0 +1,115 @@
+"""随机初始化的小号Qwen3-VL (tiny_model.py) 在CPU上验证生成路径；缺少torch/transformers或源模型配置时跳过"""
+import pytest
+from PIL import Image
+
+import app
+from config import Config
+from prompt_cache import PromptPrefixCache
+
+GREEDY = {"max_new_tokens": 16, "do_sample": False}
+PARAGRAPHS = "画面中央是一只橘色的猫趴在木质窗台上，眯着眼睛晒太阳，尾巴自然地垂落在窗沿的边缘。\n背景是模糊的绿色植物。"
+SENTENCES = "一只橘猫趴在窗台上。背景是绿色植物。光线柔和明亮。画面安静而温暖。"
+
+
+def _load(path):
+    import torch
+    from transformers import AutoProcessor, Qwen3VLForConditionalGeneration
+
+    model = Qwen3VLForConditionalGeneration.from_pretrained(path, torch_dtype=torch.float32).eval()
+    return model, AutoProcessor.from_pretrained(path)
+
+
+@pytest.fixture
+def tiny_app(tiny_models, monkeypatch):
+    """把tiny target模型装入app的全局状态 (测试结束后还原)"""
+    import torch
+
+    model, processor = _load(tiny_models[0])
+    for name, value in {"torch": torch, "model": model, "processor": processor, "device": "cpu",
+                        "prompt_cache": None, "draft_model": None, "_stop_tokenizer": None}.items():
+        monkeypatch.setattr(app, name, value)
+    return app
+
+
+class _Scripted:
+    """logits processor: 强制按给定文本逐token生成 (随机权重的小模型不会自己写出换行或句号)"""
+
+    def __init__(self, tokens, prompt_len):
+        self.tokens = tokens
+        self.prompt_len = prompt_len
+
+    def __call__(self, input_ids, scores):
+        import torch
+
+        step = min(input_ids.shape[1] - self.prompt_len, len(self.tokens) - 1)
+        forced = torch.full_like(scores, float("-inf"))
+        forced[:, self.tokens[step]] = 0
+        return forced
+
+
+def _scripted_generate(text, max_new_tokens):
+    """以app的停止条件生成预设文本，返回 (解码后的caption, 停止条件)"""
+    import torch
+    from transformers import LogitsProcessorList
+
+    inputs = _probe_inputs()
+    prompt_len = inputs["input_ids"].shape[1]
+    tokens = app.processor.tokenizer.encode(text, add_special_tokens=False)
+    kwargs, criteria, _ = app._decoding_kwargs(prompt_len, 1, max_new_tokens)
+    with torch.no_grad():
+        output = app.model.generate(**inputs, max_new_tokens=max_new_tokens, do_sample=False,
+                                    logits_processor=LogitsProcessorList([_Scripted(tokens, prompt_len)]), **kwargs)
+    generated = output[:, prompt_len:]
+    text = criteria.trim(0, app.processor.batch_decode(generated, skip_special_tokens=True)[0])
+    return text, criteria
+
+
+def _probe_inputs():
+    text = app.processor.apply_chat_template(app._build_caption_messages("probe"), tokenize=False,
+                                             add_generation_prompt=True)
+    image = Image.radial_gradient("L").convert("RGB").resize((64, 64))
+    return app._processor_inputs([text], [image], None)
+
+
+def test_prompt_cache_matches_full_prefill(tiny_app):
+    import torch
+
+    cache = PromptPrefixCache(Config.get_caption_prompt_path())
+    cache.build(app.model, app.processor, app._caption_prompt())
+    inputs = _probe_inputs()
+    assert cache.matches(inputs)
+    with torch.no_grad():
+        reference = app.model.generate(**inputs, **GREEDY)
+        cached = app.model.generate(**cache.prepare(app.model, inputs), **GREEDY)
+    assert torch.equal(reference, cached)
+
+
+def test_newline_stop_only_when_opted_in(tiny_app, monkeypatch):
+    first = PARAGRAPHS.split("\n")[0]
+    monkeypatch.setattr(app, "global_early_stop", True)
+    monkeypatch.setattr(app, "global_stop_at_newline", True)
+    text, criteria = _scripted_generate(PARAGRAPHS, max_new_tokens=200)
+    assert criteria.row_reasons == ["complete"] and text == first
+
+    monkeypatch.setattr(app, "global_stop_at_newline", False)
+    text, criteria = _scripted_generate(PARAGRAPHS, max_new_tokens=200)
+    assert criteria.row_reasons != ["complete"] and text.startswith(PARAGRAPHS)
+
+
+def test_length_stop_ends_on_sentence(tiny_app, monkeypatch):
+    monkeypatch.setattr(app, "global_early_stop", True)
+    # max_new_tokens=64 时软上限为48字: 写满48字后的第一个句号处停止，而不是生成满64个token
+    text, criteria = _scripted_generate(SENTENCES * 4, max_new_tokens=64)
+    assert criteria.row_reasons == ["length"]
+    assert text.endswith("。") and 48 <= len(text) < len(SENTENCES * 2) and (SENTENCES * 4).startswith(text)
+
+
+def test_assisted_decoding_matches_greedy(tiny_app, tiny_models):
+    import torch
+
+    draft, _ = _load(tiny_models[1])
+    inputs = _probe_inputs()
+    with torch.no_grad():
+        reference = app.model.generate(**inputs, **GREEDY)
+        assisted = app.model.generate(**inputs, assistant_model=draft, **GREEDY)
+    assert torch.equal(reference, assisted)
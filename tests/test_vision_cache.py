@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from vision_cache import VisionCache  # noqa: E402
+
+GRID = [1, 4, 4]
+
+
+def _entry(seed, tokens=4):
+    # [1 + deepstack层数, 视觉token数, hidden]: merge_size=2时网格1x4x4对应4个视觉token
+    return torch.arange(2 * tokens * 8, dtype=torch.float32).reshape(2, tokens, 8) + seed
+
+
+def _cache(tmp_path, max_bytes=1 << 20):
+    cache = VisionCache(str(tmp_path / "vision"), max_bytes)
+    cache.set_context("ctx", merge_size=2)
+    return cache
+
+
+def test_hit_after_put(tmp_path):
+    cache = _cache(tmp_path)
+    key = cache.key("img", None)
+    assert cache.get(key) is None
+
+    cache.put_async(key, torch.tensor(GRID), list(_entry(0)))
+    cache.flush()
+    grid, tensor = cache.get(key)
+    assert grid == tuple(GRID) and torch.equal(tensor, _entry(0))
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.close()
+
+
+def test_evicts_least_recently_used_over_budget(tmp_path):
+    nbytes = _entry(0).numel() * 4
+    cache = _cache(tmp_path, max_bytes=int(nbytes * 2.5))
+    keys = [cache.key(f"img{i}", None) for i in range(3)]
+    cache.put(keys[0], GRID, _entry(0))
+    cache.put(keys[1], GRID, _entry(1))
+    assert cache.get(keys[0]) is not None
+    # 第三条超出预算: 淘汰最久未使用的keys[1]，刚读取过的keys[0]保留
+    cache.put(keys[2], GRID, _entry(2))
+
+    assert cache.get(keys[1]) is None and not os.path.exists(cache._path(keys[1]))
+    assert cache.get(keys[0]) is not None and cache.get(keys[2]) is not None
+    assert cache.total_bytes() == cache._total == 2 * nbytes
+    cache.close()
+
+
+def test_corrupt_or_mismatched_entries_are_dropped(tmp_path):
+    cache = _cache(tmp_path)
+    truncated, mismatched = cache.key("truncated", None), cache.key("mismatched", None)
+    cache.put(truncated, GRID, _entry(0))
+    cache.put(mismatched, GRID, _entry(1, tokens=5))
+    with open(cache._path(truncated), "r+b") as f:
+        f.truncate(16)
+
+    assert cache.get(truncated) is None
+    assert cache.get(mismatched) is None
+    assert cache.total_bytes() == cache._total == 0
+    assert not os.path.exists(cache._path(truncated)) and not os.path.exists(cache._path(mismatched))
+    cache.close()
@@ -0,0 +1,72 @@
+# tiny_model.py
+"""生成随机初始化的小号Qwen3-VL检查点，用于在CPU上验证生成流程 (停止条件、辅助解码、基准脚本)
+
+    python tiny_model.py --source ./qwen3_vl_models --output ./tiny_models
+    python bench_caption.py --synthetic 4 --sizes 256x256 --cpu --skip-verify \\
+        --model-path tiny_models/target --draft-model tiny_models/draft
+
+只从--source读取config与tokenizer/预处理配置 (不加载权重)。target与draft共用tokenizer，仅层数不同，
+输出内容无意义，只用于测试流程与相对速度。
+"""
+import argparse
+import os
+
+
+def make_tiny_checkpoint(source: str, output: str, num_layers: int, hidden_size: int = 64, seed: int = 0) -> str:
+    """按source的配置缩小为num_layers层、hidden_size维的随机模型，连同processor一起保存到output"""
+    import torch
+    from transformers import AutoConfig, Qwen3VLForConditionalGeneration, Qwen3VLProcessor
+
+    config = AutoConfig.from_pretrained(source)
+    text = config.text_config
+    text.hidden_size = hidden_size
+    text.intermediate_size = hidden_size * 2
+    text.num_hidden_layers = num_layers
+    text.num_attention_heads = 4
+    text.num_key_value_heads = 2
+    text.head_dim = hidden_size // 4
+    # mrope三个分段 (时间/高/宽) 之和需等于head_dim的一半
+    half = text.head_dim // 2
+    for attr in ("rope_scaling", "rope_parameters"):
+        rope = getattr(text, attr, None)
+        if isinstance(rope, dict) and "mrope_section" in rope:
+            rope["mrope_section"] = [half - 2 * (half // 4), half // 4, half // 4]
+    if isinstance(getattr(text, "layer_types", None), list):
+        text.layer_types = text.layer_types[:num_layers]
+
+    vision = config.vision_config
+    vision.depth = 2
+    vision.hidden_size = 32
+    vision.intermediate_size = 64
+    vision.num_heads = 2
+    vision.out_hidden_size = hidden_size
+    vision.deepstack_visual_indexes = [0]
+
+    torch.manual_seed(seed)
+    model = Qwen3VLForConditionalGeneration(config).eval()
+    os.makedirs(output, exist_ok=True)
+    model.save_pretrained(output, safe_serialization=True)
+    Qwen3VLProcessor.from_pretrained(source).save_pretrained(output)
+    params = sum(p.numel() for p in model.parameters())
+    print(f"✅ {output}: {num_layers}层, hidden {hidden_size}, 参数量 {params / 1e6:.1f}M")
+    return output
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成随机初始化的小号Qwen3-VL检查点 (CPU测试用)")
+    parser.add_argument("--source", type=str, default="./qwen3_vl_models", help="读取config与tokenizer的模型目录")
+    parser.add_argument("--output", type=str, default="./tiny_models", help="输出目录 (生成target/与draft/)")
+    parser.add_argument("--target-layers", type=int, default=4, help="主模型层数")
+    parser.add_argument("--draft-layers", type=int, default=1, help="草稿模型层数")
+    parser.add_argument("--hidden-size", type=int, default=64, help="文本模型hidden维度")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    args = parser.parse_args()
+
+    make_tiny_checkpoint(args.source, os.path.join(args.output, "target"), args.target_layers, args.hidden_size,
+                         args.seed)
+    make_tiny_checkpoint(args.source, os.path.join(args.output, "draft"), args.draft_layers, args.hidden_size,
+                         args.seed + 1)
+
+
+if __name__ == "__main__":
+    main()
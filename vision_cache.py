@@ -0,0 +1,218 @@
+# vision_cache.py
+import os
+import queue
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from caption_cache import hash_context
+
+
+class VisionCache:
+    """视觉编码结果磁盘缓存 (内存映射读取，按总大小LRU淘汰)
+
+    键为 图片内容hash + 上下文hash (模型标识/缩放参数/图片预处理配置)，
+    值为该图片视觉塔的输出: [1 + deepstack层数, 视觉token数, hidden] 的原始字节文件，
+    另记录image_grid_thw，命中时无需解码、预处理图片即可构造模型输入。
+    索引 (SQLite, WAL模式) 记录大小与最近使用时间，可被多个线程/进程同时使用。
+    put_async把写入交给后台线程 (设备到主机拷贝、写文件、写索引、淘汰均不在prefill中执行)；
+    写入线程非守护、空闲时自动退出，进程退出前会写完已提交的条目。
+    缓存总大小在内存中增量维护，只在估计值超出上限时才重新统计索引 (多进程共用时校正)。
+    读取时校验文件大小与索引一致、视觉token数与网格一致 (t*h*w / merge_size²)，不一致的条目删除并视为未命中。
+    """
+
+    # 淘汰到上限的该比例以下，避免容量已满时每次写入都触发统计与淘汰
+    EVICT_TARGET = 0.9
+
+    def __init__(self, directory: str, max_bytes: int, queue_size: int = 32):
+        self.directory = directory
+        self.max_bytes = max(0, int(max_bytes))
+        self.context = ""
+        self.merge_length = 1
+        self.hits = 0
+        self.misses = 0
+        self.dropped = 0
+        os.makedirs(directory, exist_ok=True)
+
+        self._queue = queue.Queue(maxsize=max(1, int(queue_size)))
+        self._writer = None
+        self._writer_lock = threading.Lock()
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(directory, "index.db"), timeout=30, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, grid TEXT NOT NULL, dtype TEXT NOT NULL, shape TEXT NOT NULL, "
+            "nbytes INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+        self._total = self.total_bytes()
+
+    def set_context(self, context: str, merge_size: int = 1) -> None:
+        """设置当前上下文hash与视觉token的空间合并尺寸 (模型加载后调用)"""
+        self.context = context
+        self.merge_length = max(1, int(merge_size)) ** 2
+
+    def key(self, image_hash: str, max_pixels: Optional[int]) -> str:
+        """缓存键: 同一图片在不同像素上限下的视觉输出不同，分别缓存"""
+        return hash_context(image=image_hash, max_pixels=max_pixels, context=self.context)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + ".bin")
+
+    def get(self, key: str):
+        """读取缓存条目，返回 (grid_thw, 视觉输出张量) (内存映射的CPU张量)，未命中或文件失效时返回None"""
+        with self._lock:
+            row = self._conn.execute("SELECT grid, dtype, shape, nbytes FROM entries WHERE key = ?",
+                                     (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        try:
+            grid = tuple(int(x) for x in row[0].split(","))
+            shape = tuple(int(x) for x in row[2].split(","))
+            if len(grid) != 3 or len(shape) != 3 or shape[1] != grid[0] * grid[1] * grid[2] // self.merge_length:
+                raise ValueError(f"视觉token数与网格不一致: {shape} / {grid}")
+            tensor = self._load(key, row[1], shape, row[3])
+        except (OSError, ValueError, RuntimeError, AttributeError):
+            # 文件被其他进程淘汰、已损坏，或条目与当前模型配置不一致
+            self._delete([key])
+            self.misses += 1
+            return None
+
+        with self._lock:
+            self._conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+        self.hits += 1
+        return grid, tensor
+
+    def _load(self, key: str, dtype: str, shape: Tuple[int, ...], nbytes: int):
+        import numpy as np
+        import torch
+
+        path = self._path(key)
+        if os.path.getsize(path) != nbytes:
+            raise ValueError(f"缓存文件大小与索引不一致: {path}")
+        # 写时复制映射: 只读访问按需分页加载，且得到可写的numpy数组 (避免torch告警)
+        data = np.memmap(path, dtype=np.uint8, mode="c")
+        return torch.from_numpy(data).view(getattr(torch, dtype)).reshape(shape)
+
+    def put_async(self, key: str, grid_thw, tensors: list) -> None:
+        """提交后台写入: grid_thw与tensors ([视觉输出] + 各deepstack层) 可仍在GPU上，由写入线程拷贝堆叠
+
+        队列满时丢弃本条 (只影响之后的命中率)，不阻塞调用方。
+        """
+        try:
+            self._queue.put_nowait((key, grid_thw, tensors))
+        except queue.Full:
+            self.dropped += 1
+            return
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name="vision-cache-writer")
+                self._writer.start()
+
+    def flush(self) -> None:
+        """等待已提交的条目全部写入"""
+        self._queue.join()
+
+    def _write_loop(self) -> None:
+        import torch
+
+        while True:
+            try:
+                key, grid_thw, tensors = self._queue.get(timeout=1.0)
+            except queue.Empty:
+                # 在锁内确认队列为空后再退出，put_async看到_writer为None时会重新启动线程
+                with self._writer_lock:
+                    if self._queue.empty():
+                        self._writer = None
+                        return
+                continue
+            try:
+                grid = [int(x) for x in (grid_thw.tolist() if hasattr(grid_thw, "tolist") else grid_thw)]
+                self.put(key, grid, torch.stack([t.detach().to("cpu") for t in tensors]))
+            except Exception as e:
+                print(f"⚠️  视觉缓存写入失败: {str(e)}")
+            finally:
+                self._queue.task_done()
+
+    def put(self, key: str, grid_thw: List[int], tensor) -> None:
+        """写入一张图片的视觉输出 (先写临时文件再原子改名)，超出容量时按最近使用时间淘汰"""
+        import torch
+
+        tensor = tensor.detach().to("cpu").contiguous()
+        raw = tensor.view(-1).view(torch.uint8).numpy()
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix="." + key[:8] + ".", suffix=".tmp", dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                raw.tofile(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        with self._lock:
+            old = self._conn.execute("SELECT nbytes FROM entries WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, grid, dtype, shape, nbytes, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, ",".join(str(int(x)) for x in grid_thw), str(tensor.dtype).replace("torch.", ""),
+                 ",".join(str(x) for x in tensor.shape), raw.nbytes, time.time())
+            )
+            self._total += raw.nbytes - (old[0] if old else 0)
+        self._evict()
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM entries").fetchone()[0]
+
+    def _evict(self) -> None:
+        if self._total <= self.max_bytes:
+            return
+        # 其他进程可能同时写入/淘汰，估计值超限时以索引统计为准
+        self._total = self.total_bytes()
+        excess = self._total - int(self.max_bytes * self.EVICT_TARGET)
+        if self._total <= self.max_bytes or excess <= 0:
+            return
+        victims = []
+        with self._lock:
+            for key, nbytes in self._conn.execute("SELECT key, nbytes FROM entries ORDER BY last_used"):
+                victims.append(key)
+                excess -= nbytes
+                if excess <= 0:
+                    break
+        self._delete(victims)
+
+    def _delete(self, keys: List[str]) -> None:
+        with self._lock:
+            for key in keys:
+                row = self._conn.execute("SELECT nbytes FROM entries WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                    self._total -= row[0]
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def summary(self) -> str:
+        if not self.hits and not self.misses:
+            return ""
+        dropped = f" / 队列满未写入 {self.dropped}" if self.dropped else ""
+        return f" | 视觉缓存: 命中 {self.hits} / 未命中 {self.misses}{dropped}"
+
+    def close(self) -> None:
+        self.flush()
+        with self._lock:
+            self._conn.close()